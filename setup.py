@@ -24,5 +24,6 @@ setup(
     author_email="Meysam.or.us@gmail.com",
     url="https://github.com/Meisam984/Plotly_Dash_project.git",
     packages=find_packages(),
-    install_requires=fetch_requirements("requirements.txt")
+    install_requires=fetch_requirements("requirements.txt"),
+    entry_points={"console_scripts": ["trading-pipeline=src.cli:main"]}
 )
\ No newline at end of file
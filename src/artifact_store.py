@@ -0,0 +1,109 @@
+from src.exceptions import CustomException
+from src.log import logger, stage_timer
+from src.dtypes import DtypePolicy, concat_frames, string_columns
+import pandas as pd
+import os
+from typing import List
+
+# pyarrow is imported by the readers and writers, so that importing this module (e.g. in the worker processes of the
+# stages) does not load it.
+
+
+# Write a dataframe as a zstd-compressed Parquet file
+def _write_parquet(df: pd.DataFrame, file_path: str):
+    df.to_parquet(file_path, index=False, compression='zstd')
+
+
+# Read a Parquet file, memory-mapped, optionally projecting a subset of the columns
+def _read_parquet(file_path: str, columns: List[str] = None):
+    import pyarrow.parquet as pq
+    return pq.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+
+# Write a dataframe as an uncompressed Arrow IPC (Feather v2) file, so that reads can map it without copying
+def _write_feather(df: pd.DataFrame, file_path: str):
+    import pyarrow.feather as feather
+    feather.write_feather(df.reset_index(drop=True), file_path, compression='uncompressed')
+
+
+# Read an Arrow IPC (Feather v2) file, memory-mapped, optionally projecting a subset of the columns
+def _read_feather(file_path: str, columns: List[str] = None):
+    import pyarrow.feather as feather
+    return feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+
+# Write a dataframe as a CSV file
+def _write_csv(df: pd.DataFrame, file_path: str):
+    df.to_csv(file_path, header=True, index=False)
+
+
+# Read a CSV file, optionally projecting a subset of the columns. CSV keeps no dtypes: the ids and metadata are read
+# as strings and the dtype policy is applied again, so that they read back as the categoricals that were written
+# (e.g. 'category.id' stays a categorical feature instead of a numerical one).
+def _read_csv(file_path: str, columns: List[str] = None):
+    header = pd.read_csv(file_path, nrows=0).columns.to_list()
+    df = pd.read_csv(file_path, usecols=columns, dtype={col: str for col in string_columns(header)})
+    return DtypePolicy().cast(df)
+
+
+# Registered backends: file extension, writer and reader
+BACKENDS = {
+    'parquet': ('parquet', _write_parquet, _read_parquet),
+    'feather': ('feather', _write_feather, _read_feather),
+    'csv': ('csv', _write_csv, _read_csv),
+}
+
+
+# Artifact store for the tabular artifacts (raw, train and test data) under '.artifacts'.
+# The backend defaults to the 'ARTIFACT_BACKEND' environment variable, else Parquet.
+class ArtifactStore:
+    def __init__(self, backend: str = None):
+        self.backend = backend or os.getenv('ARTIFACT_BACKEND', 'parquet')
+        try:
+            self.extension, self.__writer, self.__reader = BACKENDS[self.backend]
+            logger.info(f"Artifact store uses the '{self.backend}' backend.")
+        except KeyError as e:
+            raise CustomException(e)
+
+    # Path to the artifact 'name' of the dataframe 'df_name'
+    def artifact_path(self, df_name: str, name: str):
+        return os.path.join('.artifacts', df_name, f"{name}.{self.extension}")
+
+    # Store a dataframe, or append it to the stored one
+    def write(self, df: pd.DataFrame, file_path: str, append: bool = False):
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if append and os.path.exists(file_path):
+                if self.backend == 'csv':
+                    df.to_csv(file_path, mode='a', header=False, index=False)
+                    logger.info(f"Appended {len(df)} rows to '{file_path}'.")
+                    return
+                df = concat_frames([self.__reader(file_path), df])
+
+            with stage_timer('artifact_write', file_path, backend=self.backend, rows=len(df)) as event:
+                self.__writer(df, file_path)
+                event['bytes_written'] = os.path.getsize(file_path)
+            logger.info(f"Stored {len(df)} rows into '{file_path}'.")
+        except Exception as e:
+            raise CustomException(e)
+
+    # Load a stored dataframe, only the given columns if any
+    def read(self, file_path: str, columns: List[str] = None):
+        try:
+            with stage_timer('artifact_read', file_path, backend=self.backend, bytes_read=os.path.getsize(file_path)) as event:
+                df = self.__reader(file_path, columns)
+                event['rows'] = len(df)
+            logger.info(f"Loaded '{file_path}' content.")
+            return df
+        except Exception as e:
+            raise CustomException(e)
+
+    # Export a stored dataframe as CSV next to it, or into 'csv_path'
+    def export_csv(self, file_path: str, csv_path: str = None):
+        csv_path = csv_path or f"{os.path.splitext(file_path)[0]}.csv"
+        try:
+            self.read(file_path).to_csv(csv_path, header=True, index=False)
+            logger.info(f"Exported '{file_path}' into '{csv_path}'.")
+            return csv_path
+        except Exception as e:
+            raise CustomException(e)
@@ -0,0 +1,382 @@
+from src.log import logger
+from src.exceptions import CustomException
+from src.artifact_store import ArtifactStore, BACKENDS as ARTIFACT_BACKENDS
+from src.dtypes import DtypePolicy, feature_columns
+from src.indicators import BACKENDS as INDICATOR_BACKENDS, add_indicators
+from src.pipelines.transformation_pipeline import make_preprocessor_pipeline
+from src.pipelines.preprocessor_state import FittedPreprocessor
+from src import utils
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+from persiantools.jdatetime import JalaliDate
+
+
+# Jalali 'YYYY/MM/DD' strings of 'n_days' consecutive days, starting on a Gregorian date
+def jalali_calendar(n_days: int, start: date = date(1990, 3, 21)):
+    days = [JalaliDate(start + timedelta(days=i)) for i in range(n_days)]
+    return np.array([f"{d.year:04d}/{d.month:02d}/{d.day:02d}" for d in days])
+
+
+# Synthetic table shaped like the 'production' schema tables: an 'id', the Jalali 'j_date' (with 'rows_per_date'
+# rows per day), random-walk prices and volumes, 'meta.*' strings, the 'category.id' and 'market.id' categories and
+# 'extra_columns' numerical columns that no later stage uses (a wide table).
+def synthetic_table(rows: int, seed: int = 0, rows_per_date: int = 1, extra_columns: int = 0):
+    rng = np.random.default_rng(seed)
+    calendar = jalali_calendar(-(-rows // rows_per_date))
+    close = 1_000 * np.exp(np.cumsum(rng.normal(0, 0.02, rows)))
+    spread = np.abs(rng.normal(0, 0.01, rows)) * close
+
+    df = pd.DataFrame({
+        'id': np.arange(rows, dtype=np.int64),
+        'j_date': np.repeat(calendar, rows_per_date)[:rows],
+        'open_price': close * (1 + rng.normal(0, 0.005, rows)),
+        'high_price': close + spread,
+        'low_price': close - spread,
+        'close_price': close,
+        'volume': rng.integers(1_000, 1_000_000, rows),
+        'value': rng.integers(1_000, 1_000_000, rows) * close,
+        'meta.symbol': f"SYM{seed:04d}",
+        'meta.name': rng.choice([f"name-{i}" for i in range(8)], rows),
+        'category.id': rng.integers(1, 40, rows),
+        'market.id': rng.integers(1, 4, rows),
+    })
+    for i in range(extra_columns):
+        df[f"extra_{i}"] = rng.normal(0, 1, rows)
+    return df
+
+
+# PostgreSQL's split_part, for the SQLite stand-in: the n-th (from 1) field of a string split on a delimiter
+def _split_part(string: str, delimiter: str, n: int):
+    if string is None:
+        return None
+    fields = string.split(delimiter)
+    return fields[n - 1] if 0 < n <= len(fields) else ''
+
+
+# Engine of a local stand-in database: the given URL (e.g. a local PostgreSQL), else a SQLite file with the schema
+# attached as a second database file, and PostgreSQL's split_part, so that the '"<schema>".<table>' queries run
+# unchanged
+def stand_in_engine(database_url: str = None, schema: str = 'production', work_dir: str = None):
+    from sqlalchemy import create_engine, event
+    if database_url:
+        return create_engine(database_url)
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix='bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'main.db')}")
+    schema_path = os.path.join(work_dir, f"{schema}.db")
+
+    @event.listens_for(engine, 'connect')
+    def _attach_schema(dbapi_conn, _):
+        dbapi_conn.execute(f"ATTACH DATABASE '{schema_path}' AS \"{schema}\"")
+        dbapi_conn.create_function('split_part', 3, _split_part, deterministic=True)
+
+    return engine
+
+
+# Generate 'tables' synthetic tables of 'rows' rows, load them into the stand-in database and return their names
+def load_synthetic_tables(engine, tables: int, rows: int, schema: str = 'production', rows_per_date: int = 1,
+                          extra_columns: int = 0):
+    names = []
+    try:
+        with engine.begin() as conn:
+            for i in range(tables):
+                name = f"bench_table_{i}"
+                df = synthetic_table(rows, seed=i, rows_per_date=rows_per_date, extra_columns=extra_columns)
+                df.to_sql(name, con=conn, schema=schema, if_exists='replace', index=False, chunksize=50_000)
+                names.append(name)
+        logger.info(f"Loaded {tables} synthetic tables of {rows} rows into the '{engine.dialect.name}' stand-in.")
+        return names
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Run 'func' 'repeat' times for the best wall-clock time, then once more under tracemalloc for the peak of the
+# traced allocations (NumPy and pandas buffers included); the timed runs are not traced. 'setup' builds fresh
+# arguments before every run, outside of the measurements.
+def measure(func: Callable, repeat: int = 3, setup: Callable = None):
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(seconds=min(times), mean_seconds=float(np.mean(times)), repeat=repeat, peak_bytes=peak)
+
+
+# Modules whose import time is measured: the command line entry point has to stay cheap, each stage only pays for
+# its own dependencies once it runs
+IMPORT_MODULES = ['src.cli', 'src.log', 'src.utils', 'src.components.data_ingestion',
+                  'src.components.data_transformation', 'src.serving']
+
+
+# Cumulative import time of a module in a fresh interpreter, in seconds, as reported by '-X importtime'
+def import_time(module: str):
+    try:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True,
+                                text=True, check=True)
+        for line in reversed(result.stderr.splitlines()):
+            parts = line.split('|')
+            if len(parts) == 3 and parts[2].strip() == module:
+                return int(parts[1]) / 1e6
+        raise ValueError(f"No import time reported for {module}.")
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Wall-clock time of a Python snippet in a fresh interpreter, from its first statement: the imports it runs included.
+# The time is printed on a tagged line, the snippet may log to stdout as well.
+def cold_time(code: str):
+    script = f"import time\n_start = time.perf_counter()\n{code}\nprint('cold_time', time.perf_counter() - _start)"
+    try:
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        return next(float(line.split()[1]) for line in result.stdout.splitlines() if line.startswith('cold_time '))
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Row-wise labelling of the baseline, one Python call per row through DataFrame.apply; the fitted quantiles stand in
+# for the .quantile() it called on scalars, so that both paths give the same labels
+def label_rows(df: pd.DataFrame, fitted: dict):
+    def get_label(row):
+        if (row['rsi'] > fitted['rsi_overbought'] and row['macd'] < 0 and
+                row['upper_bb'] > fitted['upper_bb_high'] and row['lower_bb'] < fitted['lower_bb_high']):
+            return 'SELL'
+        elif (row['rsi'] < fitted['rsi_oversold'] and row['macd'] > 0 and
+              row['upper_bb'] < fitted['upper_bb_low'] and row['lower_bb'] > fitted['lower_bb_low']):
+            return 'BUY'
+        else:
+            return 'HOLD'
+
+    return df.apply(get_label, axis=1)
+
+
+# Current git commit of the working tree, if any
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# Benchmark suite: each stage of the ingestion and transformation is timed and memory-profiled on its own, over the
+# same synthetic tables. Results are kept in 'results' and saved as JSON, one entry per (case, params).
+class BenchmarkSuite:
+    def __init__(self, rows: int = 100_000, tables: int = 4, repeat: int = 3, schema: str = 'production',
+                 database_url: str = None, rows_per_date: int = 1, extra_columns: int = 0, work_dir: str = None):
+        self.rows = rows
+        self.tables = tables
+        self.repeat = repeat
+        self.schema = schema
+        self.rows_per_date = rows_per_date
+        self.extra_columns = extra_columns
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix='bench-')
+        self.engine = stand_in_engine(database_url, schema, self.work_dir)
+        self.results = []
+
+    def __record(self, case: str, params: dict, func: Callable, setup: Callable = None):
+        result = dict(case=case, params=params, **measure(func, self.repeat, setup))
+        self.results.append(result)
+        logger.info(f"Benchmark {case} {params}: {result['seconds']:.4f}s, peak {result['peak_bytes'] / 2**20:.1f} MiB.")
+        return result
+
+    # Cold runs convert every distinct date, warm runs only read the process-wide cache
+    def bench_jalali(self, df: pd.DataFrame):
+        def clear_cache():
+            utils._JALALI_DATE_CACHE.clear()
+            return ()
+
+        self.__record('jalali_str_to_greg', dict(cache='cold', rows=len(df)),
+                      lambda: utils.jalali_str_to_greg(df['j_date']), setup=clear_cache)
+        self.__record('jalali_str_to_greg', dict(cache='warm', rows=len(df)),
+                      lambda: utils.jalali_str_to_greg(df['j_date']))
+
+    # The COPY path is only measured against PostgreSQL, both with all the columns and with a projection
+    def bench_fetch(self, table_names: List[str]):
+        methods = ['sql', 'copy'] if self.engine.dialect.name == 'postgresql' else ['sql']
+        for method in methods:
+            for columns in [None, ['close_price']]:
+                self.__record('fetch_tables_dict', dict(method=method, columns=columns, tables=len(table_names),
+                                                        rows=self.rows),
+                              lambda: utils.fetch_tables_dict(table_names, self.schema, columns=columns,
+                                                              method=method))
+
+    def bench_indicators(self, df: pd.DataFrame):
+        self.__record('add_trade_indicators', dict(rows=len(df)),
+                      lambda: utils.add_trade_indicators(df, df, 'bench'))
+        for backend in INDICATOR_BACKENDS:
+            self.__record('add_indicators', dict(backend=backend, rows=len(df)),
+                          lambda: add_indicators(df, backend=backend))
+
+    # The vectorized labels against the baseline's row-wise apply, on the same fitted thresholds
+    def bench_label(self, df: pd.DataFrame):
+        self.__record('add_label', dict(rows=len(df)),
+                      lambda train, test: utils.add_label(train, test, 'bench'),
+                      setup=lambda: (df.copy(), df.copy()))
+        fitted = utils.fit_label_thresholds(df)
+        self.__record('label_rows_apply', dict(rows=len(df)), lambda: label_rows(df, fitted))
+
+    # Features typed by the dtype policy, as the ingested tables are
+    def __features(self, df: pd.DataFrame):
+        policy = DtypePolicy(os.path.join(self.work_dir, 'vocabularies.json'))
+        X = policy.apply(df.drop(columns=['label'], errors='ignore'), 'bench')
+        num_feats, cat_feats = feature_columns(X)
+        return X, num_feats, cat_feats
+
+    # Fit of the preprocessor ColumnTransformer
+    def bench_preprocessor(self, df: pd.DataFrame):
+        X, num_feats, cat_feats = self.__features(df)
+        self.__record('column_transformer_fit', dict(rows=len(X), num_feats=len(num_feats), cat_feats=len(cat_feats)),
+                      lambda: make_preprocessor_pipeline(num_feats, cat_feats).fit_transform(X))
+
+    # Loading a fitted preprocessor, pickled with dill (the baseline) or as a FittedPreprocessor state: warm in this
+    # process, and cold in a fresh interpreter, where the load pays for the imports it needs (e.g. scikit-learn)
+    def bench_preprocessor_load(self, df: pd.DataFrame):
+        X, num_feats, cat_feats = self.__features(df)
+        column_transformer = make_preprocessor_pipeline(num_feats, cat_feats).fit(X)
+        dill_path = os.path.join(self.work_dir, 'preprocessor.pkl')
+        state_dir = os.path.join(self.work_dir, 'preprocessor')
+        utils.save_obj(dill_path, column_transformer)
+        FittedPreprocessor.from_column_transformer(column_transformer).save(state_dir)
+
+        loads = {'dill': (lambda: utils.load_obj(dill_path), f"from src.utils import load_obj; load_obj({dill_path!r})"),
+                 'state': (lambda: FittedPreprocessor.load(state_dir),
+                           "from src.pipelines.preprocessor_state import FittedPreprocessor; "
+                           f"FittedPreprocessor.load({state_dir!r})")}
+        for fmt, (load, code) in loads.items():
+            self.__record('preprocessor_load', dict(format=fmt, start='warm'), load)
+            times = [cold_time(code) for _ in range(self.repeat)]
+            self.results.append(dict(case='preprocessor_load', params=dict(format=fmt, start='cold'),
+                                     seconds=min(times), mean_seconds=float(np.mean(times)), repeat=self.repeat,
+                                     peak_bytes=None))
+            logger.info(f"Benchmark preprocessor_load {fmt} cold: {min(times):.4f}s.")
+
+    def bench_artifacts(self, df: pd.DataFrame):
+        for backend in ARTIFACT_BACKENDS:
+            store = ArtifactStore(backend)
+            path = os.path.join(self.work_dir, f"artifact.{store.extension}")
+            write = self.__record('artifact_write', dict(backend=backend, rows=len(df)), lambda: store.write(df, path))
+            write['bytes'] = os.path.getsize(path)
+            self.__record('artifact_read', dict(backend=backend, rows=len(df)), lambda: store.read(path))
+
+    # Import times are measured in fresh interpreters, without a memory profile
+    def bench_imports(self, modules: List[str] = None):
+        for module in modules or IMPORT_MODULES:
+            times = [import_time(module) for _ in range(self.repeat)]
+            self.results.append(dict(case='import_time', params=dict(module=module), seconds=min(times),
+                                     mean_seconds=float(np.mean(times)), repeat=self.repeat, peak_bytes=None))
+            logger.info(f"Benchmark import_time {module}: {min(times):.4f}s.")
+
+    # Run all the cases. The in-memory stages run on the first fetched table.
+    def run(self):
+        table_names = load_synthetic_tables(self.engine, self.tables, self.rows, self.schema, self.rows_per_date,
+                                            self.extra_columns)
+        utils.set_engine(self.engine)
+
+        self.bench_jalali(synthetic_table(self.rows, rows_per_date=self.rows_per_date))
+        self.bench_fetch(table_names)
+
+        df = utils.fetch_table(table_names[0], self.schema)
+        self.bench_indicators(df)
+        df = add_indicators(df)
+        self.bench_label(df)
+        df = utils.add_label(df, df.copy(), 'bench')[0]
+        self.bench_preprocessor(df)
+        self.bench_preprocessor_load(df)
+        self.bench_artifacts(df)
+        return self.results
+
+    def to_dict(self):
+        return dict(meta=dict(commit=_git_commit(), time=datetime.now().isoformat(timespec='seconds'),
+                              python=platform.python_version(), platform=platform.platform(),
+                              numpy=np.__version__, pandas=pd.__version__, database=self.engine.dialect.name,
+                              rows=self.rows, tables=self.tables, repeat=self.repeat,
+                              rows_per_date=self.rows_per_date, extra_columns=self.extra_columns),
+                    results=self.results)
+
+    def save(self, file_path: str):
+        utils.save_json(file_path=file_path, obj=self.to_dict())
+        return file_path
+
+
+# Compare results with a baseline results file: the time and peak memory ratios of the cases present in both
+def compare_results(results: dict, baseline: dict):
+    key = lambda r: (r['case'], json.dumps(r['params'], sort_keys=True))
+    baseline_results = {key(r): r for r in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        base = baseline_results.get(key(result))
+        if base is None:
+            continue
+        comparison.append(dict(case=result['case'], params=result['params'],
+                               time_ratio=result['seconds'] / base['seconds'] if base['seconds'] else None,
+                               peak_ratio=result['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else None))
+    return comparison
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion and transformation stages on synthetic tables.")
+    parser.add_argument('--rows', type=int, default=100_000, help="rows per table")
+    parser.add_argument('--tables', type=int, default=4, help="number of tables")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case, the best one is kept")
+    parser.add_argument('--rows-per-date', type=int, default=1, help="rows sharing the same 'j_date'")
+    parser.add_argument('--extra-columns', type=int, default=0, help="unused numerical columns, for wide tables")
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help="stand-in database, e.g. a local PostgreSQL; a temporary SQLite file by default")
+    parser.add_argument('--output', default=os.path.join('.artifacts', 'benchmarks',
+                                                         f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    parser.add_argument('--baseline', help="results file of an earlier run to compare with")
+    parser.add_argument('--imports-only', action='store_true', help="only measure the import times")
+    parser.add_argument('--import-budget-ms', type=float, default=None,
+                        help="fail when importing the command line entry point ('src.cli') takes longer")
+    args = parser.parse_args(argv)
+
+    suite = BenchmarkSuite(rows=args.rows, tables=args.tables, repeat=args.repeat, database_url=args.database_url,
+                           rows_per_date=args.rows_per_date, extra_columns=args.extra_columns)
+    if not args.imports_only:
+        suite.run()
+    suite.bench_imports()
+    suite.save(args.output)
+    logger.info(f"Saved the benchmark results into '{args.output}'.")
+
+    if args.baseline:
+        for row in compare_results(suite.to_dict(), utils.load_json(args.baseline)):
+            ratios = [f"{name} x{row[key]:.2f}" for name, key in [('time', 'time_ratio'), ('peak', 'peak_ratio')]
+                      if row[key] is not None]
+            print(f"{row['case']:<24} {json.dumps(row['params']):<80} {' '.join(ratios)}")
+
+    if args.import_budget_ms is not None:
+        cli_time = next(r['seconds'] for r in suite.results if r['case'] == 'import_time' and
+                        r['params']['module'] == 'src.cli')
+        if cli_time * 1000 > args.import_budget_ms:
+            raise SystemExit(f"Importing src.cli took {cli_time * 1000:.1f} ms, over the {args.import_budget_ms} ms budget.")
+    return args.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+from src.exceptions import CustomException
+from src.log import logger
+from src.utils import fetch_schema_catalog
+import copy
+import json
+import os
+import time
+
+
+# Catalog of the tables in a schema, built once per pipeline run and shared by all the stages.
+# With a 'cache_ttl' (seconds), the catalog is also cached on disk and reused while it is fresh.
+class DataCatalog:
+    def __init__(self, schema: str = 'production', cache_ttl: float = None, cache_dir: str = '.artifacts'):
+        self.schema = schema
+        self.cache_ttl = cache_ttl
+        self.cache_path = os.path.join(cache_dir, f"catalog_{schema}.json")
+        self.tables = self.__load()
+
+    def __load(self):
+        if self.cache_ttl is not None and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "r") as f:
+                    cached = json.load(f)
+                if time.time() - cached['created_at'] < self.cache_ttl:
+                    logger.info(f"Loaded the '{self.schema}' catalog from '{self.cache_path}'.")
+                    return cached['tables']
+            except Exception as e:
+                raise CustomException(e)
+
+        return self.refresh()
+
+    # Query the database for the catalog again, and cache it on disk if enabled
+    def refresh(self):
+        self.tables = fetch_schema_catalog(self.schema)
+        logger.info(f"Built the '{self.schema}' catalog with {len(self.tables)} tables.")
+
+        if self.cache_ttl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                with open(self.cache_path, "w") as f:
+                    json.dump({'created_at': time.time(), 'tables': self.tables}, f, default=str)
+                logger.info(f"Cached the '{self.schema}' catalog into '{self.cache_path}'.")
+            except Exception as e:
+                raise CustomException(e)
+
+        return self.tables
+
+    @property
+    def table_names(self):
+        return list(self.tables)
+
+    # Catalog restricted to some of its tables, e.g. those selected on the command line. Unknown tables raise a
+    # KeyError.
+    def select(self, table_names: list):
+        missing = [table for table in table_names if table not in self.tables]
+        if missing:
+            raise KeyError(f"Tables {missing} are not in the '{self.schema}' catalog.")
+        catalog = copy.copy(self)
+        catalog.tables = {table: self.tables[table] for table in table_names}
+        return catalog
+
+    def columns(self, table: str):
+        return self.tables[table]['columns']
+
+    def dtypes(self, table: str):
+        return self.tables[table]['dtypes']
+
+    def row_count(self, table: str):
+        return self.tables[table]['row_count']
+
+    def watermark(self, table: str):
+        return self.tables[table]['watermark']
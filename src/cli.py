@@ -0,0 +1,243 @@
+import argparse
+import sys
+
+# Command line entry point of the pipeline stages. Only argparse is imported here: each subcommand imports the
+# components it runs (and, through them, pandas, scikit-learn, the database driver, ...) when it is called.
+
+
+# Catalog of the schema, restricted to the '--tables'; unknown tables are a usage error
+def _catalog(args):
+    from src.catalog import DataCatalog
+    catalog = DataCatalog(schema=args.schema, cache_ttl=args.catalog_ttl)
+    try:
+        return catalog.select(args.tables) if args.tables else catalog
+    except KeyError as e:
+        args.error(e.args[0])
+
+
+# Exit status of a stage: 1 when some tables failed, which are reported
+def _report(failures: dict):
+    from src.log import logger
+    for df_name, error in failures.items():
+        logger.error(f"Table {df_name} failed: {error}")
+    return 1 if failures else 0
+
+
+def ingest(args):
+    from src.components.data_ingestion import DataIngestion
+    DataIngestion(incremental=args.incremental, catalog=_catalog(args), split=args.split).initiate_data_ingestion()
+    return 0
+
+
+def build_preprocessors(args):
+    from src.pipelines.transformation_pipeline import TransformationPipeline
+    pipeline = TransformationPipeline(catalog=_catalog(args), max_workers=args.max_workers)
+    pipeline.initiate_transformation_pipeline()
+    return _report(pipeline.failures)
+
+
+def transform(args):
+    catalog = _catalog(args)
+    if args.mode == 'streaming':
+        from src.components.streaming_transformation import StreamingTransformation
+        StreamingTransformation(catalog=catalog, chunksize=args.chunksize,
+                                test_size=args.test_size).initiate_streaming_transformation()
+        return 0
+    if args.mode == 'panel':
+        from src.components.panel_transformation import PanelTransformation
+        PanelTransformation(catalog=catalog, test_size=args.test_size).initiate_panel_transformation()
+        return 0
+
+    from src.artifact_store import ArtifactStore
+    from src.components.data_transformation import DataTransformation
+    store = ArtifactStore()
+    transformation = DataTransformation(store=store, catalog=catalog, max_workers=args.max_workers)
+    transformation.initiate_data_transformation({df_name: store.artifact_path(df_name, 'train') for df_name in catalog.table_names},
+                                                {df_name: store.artifact_path(df_name, 'test') for df_name in catalog.table_names})
+    return _report(transformation.failures)
+
+
+# Ingestion then batch transformation of the selected tables
+def run(args):
+    from src.components.data_ingestion import DataIngestion
+    from src.components.data_transformation import DataTransformation
+    catalog = _catalog(args)
+    train_data_dict, test_data_dict = DataIngestion(incremental=args.incremental, catalog=catalog,
+                                                    split=args.split).initiate_data_ingestion()
+    transformation = DataTransformation(catalog=catalog, max_workers=args.max_workers)
+    transformation.initiate_data_transformation(train_data_dict, test_data_dict)
+    return _report(transformation.failures)
+
+
+# Chart data over HTTP: GET /line and /ohlc with the 'symbol', 'start', 'end' and 'width' query parameters (and an
+# optional 'column' for /line) answer with Plotly JSON. GET /screen answers with the screened symbols as JSON records,
+# given the screener filters as query parameters (e.g. /screen?rsi_below=30&macd_sign=positive&limit=20).
+def serve(args):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+    from src.log import logger
+    from src.latest_state import LatestStateIndex, LATEST_STATE_DIR
+    from src.serving import ChartDataServer
+    server = ChartDataServer(schema=args.schema)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path not in ['/line', '/ohlc', '/screen']:
+                self.send_error(404)
+                return
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                if url.path == '/screen':
+                    # Loaded on every request (memory-mapped), so that the updates of 'screen --update' show up
+                    result = LatestStateIndex.load(LATEST_STATE_DIR).screen(**_screen_params(query))
+                    body = result.to_json(orient='records', date_format='iso').encode()
+                else:
+                    params = dict(symbol=query['symbol'], start=query['start'], end=query['end'],
+                                  width=int(query.get('width', 1000)))
+                    if url.path == '/line':
+                        trace = server.line(column=query.get('column'), **params)
+                    else:
+                        trace = server.ohlc(**params)
+                    body = server.to_json(trace).encode()
+            except (KeyError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+            except Exception as e:
+                logger.error(f"Chart request {self.path} failed: {e}")
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.info(f"{self.address_string()} - {format % args}")
+
+    httpd = ThreadingHTTPServer((args.host, args.port), Handler)
+    logger.info(f"Serving chart data on http://{args.host}:{args.port}.")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
+
+# Screen the symbols on their latest state, after feeding it the new bars of the raw data with '--update'
+def screen(args):
+    from src.latest_state import LatestStateIndex, refresh_latest_state, LATEST_STATE_DIR
+    if args.update:
+        from src.market_context import MARKET_TABLES
+        catalog = _catalog(args)
+        index = refresh_latest_state([df_name for df_name in catalog.table_names if df_name not in MARKET_TABLES],
+                                     n_closes=args.n_closes)
+    else:
+        index = LatestStateIndex.load(LATEST_STATE_DIR)
+    result = index.screen(**_screen_params(vars(args)))
+    print(result.to_string(index=False))
+    return 0
+
+
+# Screener filters from the command line arguments or the query parameters of a request
+def _screen_params(params: dict):
+    floats = ['rsi_below', 'rsi_above', 'band_below', 'band_above']
+    out = {key: float(params[key]) for key in floats if params.get(key) is not None}
+    if params.get('macd_sign') is not None:
+        out['macd_sign'] = 1 if params['macd_sign'] in ['positive', '1', 1] else -1
+    if params.get('labels'):
+        labels = params['labels']
+        out['labels'] = labels.split(',') if isinstance(labels, str) else labels
+    if params.get('limit') is not None:
+        out['limit'] = int(params['limit'])
+    out['sort_by'] = params.get('sort_by') or 'rsi'
+    out['ascending'] = str(params.get('descending', False)).lower() not in ['true', '1']
+    return out
+
+
+def bench(args):
+    from src.benchmarks import main as bench_main
+    bench_main(args.bench_args)
+    return 0
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='trading-pipeline', description="Run the stages of the trading data pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    tables_parser = argparse.ArgumentParser(add_help=False)
+    tables_parser.add_argument('--schema', default='production', help="database schema of the tables")
+    tables_parser.add_argument('--tables', nargs='+', metavar='TABLE', help="only these tables (all by default)")
+    tables_parser.add_argument('--catalog-ttl', type=float, default=None,
+                               help="reuse the cached catalog for this many seconds")
+    tables_parser.add_argument('--max-workers', type=int, default=None, help="worker processes, 1 to run serially")
+
+    ingestion_parser = argparse.ArgumentParser(add_help=False)
+    ingestion_parser.add_argument('--incremental', action='store_true', help="only fetch rows past the watermarks")
+    ingestion_parser.add_argument('--split', choices=['random', 'time'], default='random')
+
+    subparser = subparsers.add_parser('ingest', parents=[tables_parser, ingestion_parser],
+                                      help="fetch the tables and store the raw, train and test data")
+    subparser.set_defaults(func=ingest)
+
+    subparser = subparsers.add_parser('build-preprocessors', parents=[tables_parser],
+                                      help="build the preprocessor pipeline specs from the raw data")
+    subparser.set_defaults(func=build_preprocessors)
+
+    subparser = subparsers.add_parser('transform', parents=[tables_parser],
+                                      help="build the feature sets and fitted preprocessors")
+    subparser.add_argument('--mode', choices=['batch', 'streaming', 'panel'], default='batch')
+    subparser.add_argument('--chunksize', type=int, default=100_000, help="rows per chunk, in streaming mode")
+    subparser.add_argument('--test-size', type=float, default=0.2, help="test share, in streaming and panel modes")
+    subparser.set_defaults(func=transform)
+
+    subparser = subparsers.add_parser('run', parents=[tables_parser, ingestion_parser],
+                                      help="ingest, then transform in batch mode")
+    subparser.set_defaults(func=run)
+
+    subparser = subparsers.add_parser('serve', help="serve the chart data over HTTP")
+    subparser.add_argument('--schema', default='production')
+    subparser.add_argument('--host', default='127.0.0.1')
+    subparser.add_argument('--port', type=int, default=8050)
+    subparser.set_defaults(func=serve)
+
+    subparser = subparsers.add_parser('screen', parents=[tables_parser],
+                                      help="filter and rank the symbols on their latest indicators and label")
+    subparser.add_argument('--update', action='store_true',
+                           help="first feed the index the new bars of the raw data (built on the first run)")
+    subparser.add_argument('--n-closes', type=int, default=50, help="closes kept per symbol, for a new index")
+    subparser.add_argument('--rsi-below', type=float)
+    subparser.add_argument('--rsi-above', type=float)
+    subparser.add_argument('--macd-sign', choices=['positive', 'negative'])
+    subparser.add_argument('--band-below', type=float, help="max position of the close in the Bollinger bands (0-1)")
+    subparser.add_argument('--band-above', type=float, help="min position of the close in the Bollinger bands (0-1)")
+    subparser.add_argument('--labels', nargs='+', choices=['HOLD', 'BUY', 'SELL'])
+    subparser.add_argument('--sort-by', default='rsi', help="indicator column, 'close' or 'band_position'")
+    subparser.add_argument('--descending', action='store_true')
+    subparser.add_argument('--limit', type=int)
+    subparser.set_defaults(func=screen)
+
+    # The arguments of the benchmark suite are passed through, see 'bench --help'
+    subparser = subparsers.add_parser('bench', help="run the benchmark suite", add_help=False)
+    subparser.set_defaults(func=bench)
+
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args, args.bench_args = parser.parse_known_args(argv)
+    if args.bench_args and args.command != 'bench':
+        parser.error(f"unrecognized arguments: {' '.join(args.bench_args)}")
+    args.error = parser.error
+
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv(usecwd=True))
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,28 @@
 import os
 from src.exceptions import CustomException
 from src.log import logger
-from src.utils import fetch_tables_list, fetch_tables_dict
-from sklearn.model_selection import train_test_split
+from src.artifact_store import ArtifactStore
+from src.catalog import DataCatalog
+from src.stage_cache import StageCache
+from src.dtypes import DtypePolicy
+from src.indicators import add_indicators
+from src.utils import fetch_tables_dict, load_watermark, save_watermark, chronological_split
 
 
-# Data ingestion config class
+# Data ingestion config class. Tables are only fetched once the ingestion is initiated.
 class DataIngestionConfig:
-    def __init__(self):
-        self.df_name_list = fetch_tables_list(schema='production')
-        self.df_dict = fetch_tables_dict(self.df_name_list, 'production')
+    def __init__(self, incremental: bool = False, store: ArtifactStore = None, catalog: DataCatalog = None,
+                 split: str = 'random', cache: StageCache = None, dtype_policy: DtypePolicy = None):
+        self.incremental = incremental
+        self.split = split
+        self.dtype_policy = dtype_policy or DtypePolicy()
+        self.cache = cache or StageCache()
+        self.store = store or ArtifactStore()
+        self.catalog = catalog or DataCatalog(schema='production')
+        self.df_name_list = self.catalog.table_names
         self.data_paths_dict = self.__data_paths()
+        self.watermark_paths_dict = self.__watermark_paths()
+        self.watermarks_dict = self.__watermarks() if incremental else {}
         
     def __data_paths(self):
         paths = {}
@@ -18,28 +30,69 @@ class DataIngestionConfig:
             for i in ['raw', 'train', 'test']:
                 paths[i] = {}
                 for df_name in self.df_name_list:
-                    paths[i][df_name] = os.path.join('.artifacts', df_name, str(f"{i}.csv"))
-                    logger.info(f"Defined the data path for '{df_name}/{i}.csv'.")
+                    paths[i][df_name] = self.store.artifact_path(df_name, i)
+                    logger.info(f"Defined the data path for '{df_name}/{i}.{self.store.extension}'.")
         
             return paths
         except Exception as e:
             raise CustomException(e)
 
+    def __watermark_paths(self):
+        paths = {}
+        try:
+            for df_name in self.df_name_list:
+                paths[df_name] = os.path.join('.artifacts', df_name, 'watermark.json')
+                logger.info(f"Defined the watermark path for '{df_name}/watermark.json'.")
+
+            return paths
+        except Exception as e:
+            raise CustomException(e)
+
+    # A watermark is only usable while the raw data it was taken from is still stored
+    def __watermarks(self):
+        watermarks = {}
+        for df_name in self.df_name_list:
+            if os.path.exists(self.data_paths_dict['raw'][df_name]):
+                watermarks[df_name] = load_watermark(self.watermark_paths_dict[df_name])
+            else:
+                watermarks[df_name] = None
+
+        return watermarks
 
-# Data ingestion class
+
+# Data ingestion class. In incremental mode, only the rows past each table's 'j_date' watermark are fetched and
+# appended to the stored raw, train and test data.
+# With split='time', price tables are sorted by 'greg_date', their indicators are computed once over the whole series
+# and the latest rows make the test set; new rows of an incremental run go to the test set.
+# Outside incremental mode, tables whose catalog fingerprint (columns, row count and last 'j_date') is unchanged are
+# restored from the stage cache instead of being fetched. The fingerprint is not a checksum of the content: rows
+# updated in place, without a new row or a later date, are served stale from the cache. Pass a StageCache over an
+# empty 'cache_dir' to fetch every table again after such updates.
+# Fetched tables are typed once by the dtype policy (see src.dtypes.DtypePolicy) before being stored, the later
+# stages read them with those dtypes.
 class DataIngestion:
-    def __init__(self):
-        self.__ingestion_config = DataIngestionConfig()
+    def __init__(self, incremental: bool = False, store: ArtifactStore = None, catalog: DataCatalog = None,
+                 split: str = 'random', cache: StageCache = None, dtype_policy: DtypePolicy = None):
+        self.__ingestion_config = DataIngestionConfig(incremental=incremental, store=store, catalog=catalog,
+                                                      split=split, cache=cache, dtype_policy=dtype_policy)
         logger.info(f"Data ingestion config captured.")
     
     def initiate_data_ingestion(self):
         raw_data_dict = self.__ingestion_config.data_paths_dict['raw']
         train_data_dict = self.__ingestion_config.data_paths_dict['train']
         test_data_dict = self.__ingestion_config.data_paths_dict['test']
+        watermark_paths_dict = self.__ingestion_config.watermark_paths_dict
+        watermarks_dict = self.__ingestion_config.watermarks_dict
+        store = self.__ingestion_config.store
+        split = self.__ingestion_config.split
+        dtype_policy = self.__ingestion_config.dtype_policy
         logger.info(f"Data ingestion process initiated for the dataframe by storing the raw, train and test data path lists.")
 
-        df_name_list = self.__ingestion_config.df_name_list
-        df_dict = self.__ingestion_config.df_dict
+        cache = self.__ingestion_config.cache
+        cache_keys = self.__cache_keys()
+        df_name_list = [df_name for df_name in self.__ingestion_config.df_name_list
+                        if df_name not in cache_keys or not cache.fetch(cache_keys[df_name], self.__outputs(df_name))]
+        df_dict = fetch_tables_dict(df_name_list, self.__ingestion_config.catalog.schema, since_dict=watermarks_dict)
         logger.info("Stored table name list and tables dictionary into 'df_name_list' and 'df_dict'.")
                         
         
@@ -51,30 +104,71 @@ class DataIngestion:
                 raise CustomException(e)
             
             try:
-                df = df_dict[df_name]
+                df = dtype_policy.apply(df_dict[df_name], df_name)
                 raw_path = raw_data_dict[df_name]
+                append = watermarks_dict.get(df_name) is not None
                 logger.info(f"Fetched the dataframe and its storage path for {df_name}.")
             except Exception as e:
                 raise CustomException(e)
+
+            if df.empty:
+                logger.info(f"No new rows for {df_name}, past the watermark {watermarks_dict.get(df_name)}.")
+                continue
             
             try:
-                df.to_csv(raw_path, header=True, index=False)
-                logger.info(f"Dataframe {df_name} was stored into '.artifacts/{df_name}/raw.csv' file.")
+                store.write(df, raw_path, append=append)
+                logger.info(f"Dataframe {df_name} was {'appended to' if append else 'stored into'} '{raw_path}' file.")
             except Exception as e:
                 raise CustomException(e)
     
             try:
-                train_set, test_set = train_test_split(df, test_size=0.2, random_state=102)
+                if split == 'time' and 'close_price' in df.columns:
+                    train_set, test_set = self.__time_split(df, raw_path, append)
+                elif len(df) > 1:
+                    from sklearn.model_selection import train_test_split
+                    train_set, test_set = train_test_split(df, test_size=0.2, random_state=102)
+                else:
+                    train_set, test_set = df, df.iloc[0:0]
                 logger.info(f"Dataframe {df_name} was split into train and test sets.")
             except Exception as e:
                 raise CustomException(e)
     
             try:
-                train_set.to_csv(train_data_dict[df_name], header=True, index=False)
-                test_set.to_csv(test_data_dict[df_name], header=True, index=False)
-                logger.info(f"Stored train and test data in dataframe {df_name} into '.artifacts/{df_name}/train.csv' and '.artifacts/{df_name}/test.csv', respectively.")
+                store.write(train_set, train_data_dict[df_name], append=append)
+                store.write(test_set, test_data_dict[df_name], append=append)
+                logger.info(f"Stored train and test data in dataframe {df_name} into '{train_data_dict[df_name]}' and '{test_data_dict[df_name]}', respectively.")
             except Exception as e:
                 raise CustomException(e)
+
+            # 'jal_date' is zero-padded, its largest string is the latest date
+            save_watermark(watermark_paths_dict[df_name], str(df['jal_date'].max()))
+
+            if df_name in cache_keys:
+                cache.store(cache_keys[df_name], self.__outputs(df_name))
+
+        dtype_policy.save()
                 
         return [train_data_dict, test_data_dict]
 
+    # Cache keys of the tables, from their catalog entries; no caching in incremental mode
+    def __cache_keys(self):
+        config = self.__ingestion_config
+        if config.incremental:
+            return {}
+        return {df_name: config.cache.make_key('ingestion', df_name, config.catalog.tables[df_name],
+                                               config.split, config.store.backend)
+                for df_name in config.df_name_list}
+
+    def __outputs(self, df_name):
+        paths = self.__ingestion_config.data_paths_dict
+        return [paths['raw'][df_name], paths['train'][df_name], paths['test'][df_name],
+                self.__ingestion_config.watermark_paths_dict[df_name]]
+
+    # Indicators over the whole sorted series, then train and test slices of that single frame
+    def __time_split(self, df, raw_path, append):
+        if not append:
+            return chronological_split(add_indicators(df.sort_values('greg_date', kind='stable', ignore_index=True)))
+
+        full_df = self.__ingestion_config.store.read(raw_path)
+        full_df = add_indicators(full_df.sort_values('greg_date', kind='stable', ignore_index=True))
+        return [full_df.iloc[0:0], full_df.iloc[len(full_df) - len(df):]]
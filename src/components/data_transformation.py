@@ -1,26 +1,31 @@
 from src.log import logger
 from src.exceptions import CustomException
-from src.utils import load_obj, save_obj, fetch_tables_list, add_trade_indicators, add_label
-import pandas as pd
-import numpy as np
+from src.artifact_store import ArtifactStore
+from src.catalog import DataCatalog
+from src.indicators import indicator_columns
+from src.stage_cache import StageCache
+from src.scheduler import run_tables
+from src.feature_set import FeatureSet
+from src.market_context import MARKET_TABLES, context_files, load_market_context
+from src.utils import load_json, add_trade_indicators, add_label, LABELS
 import os
-from src.components.data_ingestion import DataIngestion
-from src.pipelines.transformation_pipeline import TransformationPipeline
+from src.pipelines.transformation_pipeline import TransformationPipeline, make_preprocessor_pipeline
+from src.pipelines.preprocessor_state import FittedPreprocessor
 
 
 class DataTransformationConfig:
-    def __init__(self):
-        self.df_name_list = fetch_tables_list(schema='production')
-        self.df_name_list.remove("prd_exchange_news")
-        self.df_name_list.remove("prd_exchange_indexvalues")
+    def __init__(self, catalog: DataCatalog = None):
+        self.catalog = catalog or DataCatalog(schema='production')
+        self.df_name_list = [df_name for df_name in self.catalog.table_names if df_name not in MARKET_TABLES]
         self.preprocessor_pipeline_paths_dict = self.__prep_pipeline_paths()
         self.preprocessor_paths_dict = self.__prep_paths()
+        self.features_paths_dict = self.__features_paths()
 
     def __prep_pipeline_paths(self):
        paths = {}
        try:
            for df_name in self.df_name_list:
-               paths[df_name] = os.path.join('.artifacts', df_name, 'preprocessor_pipeline.pkl')
+               paths[df_name] = os.path.join('.artifacts', df_name, 'preprocessor_pipeline.json')
                logger.info(f"Defined the preprocessor pipeline path for dataframe {df_name}.")
 
            return paths
@@ -31,7 +36,7 @@ class DataTransformationConfig:
        paths = {}
        try:
            for df_name in self.df_name_list:
-               paths[df_name] = os.path.join('.artifacts', df_name, 'preprocessor.pkl')
+               paths[df_name] = os.path.join('.artifacts', df_name, 'preprocessor')
                logger.info(f"Defined the preprocessor object path for dataframe {df_name}.")
 
            return paths
@@ -39,9 +44,115 @@ class DataTransformationConfig:
            raise CustomException(e)
 
 
+    def __features_paths(self):
+       paths = {}
+       try:
+           for i in ['train', 'test']:
+               paths[i] = {}
+               for df_name in self.df_name_list:
+                   paths[i][df_name] = os.path.join('.artifacts', df_name, f'{i}_features')
+                   logger.info(f"Defined the {i} feature set path for dataframe {df_name}.")
+
+           return paths
+       except Exception as e:
+           raise CustomException(e)
+
+
+# Transform a single table: market context, indicators, labels, preprocessor fit and transform, with the resulting
+# feature sets saved into 'train_features_path' and 'test_features_path'. Runs in a worker process, restoring the
+# outputs from the stage cache when the table's train, test data, preprocessor pipeline and context are unchanged.
+def transform_table(df_name: str, train_path: str, test_path: str, prep_pip_path: str, prep_path: str,
+                    train_features_path: str, test_features_path: str, store: ArtifactStore, cache: StageCache,
+                    market_context_path: str = None):
+    outputs = [prep_path, train_features_path, test_features_path]
+    cache_key = cache.make_key('transformation', train_path, test_path, prep_pip_path,
+                               *context_files(market_context_path))
+    if cache.fetch(cache_key, outputs):
+        return train_features_path, test_features_path
+
+    try:
+        train_df = store.read(train_path)
+        test_df = store.read(test_path)
+        logger.info(f"Loaded the train and test data for the dataframe {df_name}.")
+    except Exception as e:
+        raise CustomException(e)
+
+    # The context arrays are memory-mapped, every worker shares the same pages
+    market_context = load_market_context(market_context_path)
+    if market_context is not None:
+        train_df, test_df = market_context.add_context(train_df), market_context.add_context(test_df)
+        logger.info(f"Joined the market context columns {market_context.columns} onto {df_name}.")
+
+    try:
+        # Time-split ingestion already computed the indicators over the whole series
+        if all(col in train_df.columns for col in indicator_columns()):
+            train_df_with_indices, test_df_with_indices = train_df, test_df
+        else:
+            train_df_with_indices, test_df_with_indices = add_trade_indicators(train_df, test_df, df_name)
+        train_df_with_indices_labeled, test_df_with_indices_labeled = add_label(train_df_with_indices, test_df_with_indices, df_name)
+    except Exception as e:
+        raise CustomException(e)
+
+    try:
+        prep_pipeline_spec = load_json(prep_pip_path)
+        prep_pipeline = make_preprocessor_pipeline(prep_pipeline_spec['num_feats'], prep_pipeline_spec['cat_feats'])
+        logger.info("Created the preprocessor pipeline from its spec into 'prep_pipeline' variable.")
+    except Exception as e:
+        raise CustomException(e)
+
+    try:
+        X_train = train_df_with_indices_labeled.drop(columns='label')
+        y_train = train_df_with_indices_labeled['label']
+        logger.info(f"Split train data in {df_name} into features and label dataframes.")
+    except Exception as e:
+        raise CustomException(e)
+
+    try:
+        X_test = test_df_with_indices_labeled.drop(columns='label')
+        y_test = test_df_with_indices_labeled['label']
+        logger.info(f"Split test data in {df_name} into features and label dataframes.")
+    except Exception as e:
+        raise CustomException(e)
+
+    try:
+        X_train_arr = prep_pipeline.fit_transform(X_train)
+        X_test_arr = prep_pipeline.transform(X_test)
+        logger.info(f"Applied the preprocessor pipeline onto the train and test features sets in {df_name}.")
+    except Exception as e:
+        raise CustomException(e)
+
+    try:
+        feature_names = prep_pipeline.get_feature_names_out()
+    except Exception:
+        feature_names = [f"x{i}" for i in range(X_train_arr.shape[1])]
+
+    train_features = FeatureSet.from_arrays(X_train_arr, y_train, feature_names, LABELS)
+    test_features = FeatureSet.from_arrays(X_test_arr, y_test, feature_names, LABELS)
+    logger.info(f"Built the train and test feature sets of {df_name}.")
+
+    try:
+        FittedPreprocessor.from_column_transformer(prep_pipeline).save(prep_path)
+        logger.info(f"Preprocessor state saved into '{prep_path}'")
+    except Exception as e:
+        raise CustomException(e)
+
+    train_features.save(train_features_path)
+    test_features.save(test_features_path)
+    cache.store(cache_key, outputs)
+
+    return train_features_path, test_features_path
+
+
+# Data transformation class. Tables are transformed in parallel over 'max_workers' processes; the tables that
+# fail are logged and listed in 'failures' instead of aborting the run.
 class DataTransformation:
-    def __init__(self):
-        self.__transformation_config = DataTransformationConfig()
+    def __init__(self, store: ArtifactStore = None, catalog: DataCatalog = None, cache: StageCache = None,
+                 max_workers: int = None):
+        self.__transformation_config = DataTransformationConfig(catalog=catalog)
+        self.__store = store or ArtifactStore()
+        self.__cache = cache or StageCache()
+        self.__max_workers = max_workers
+        self.failures = {}
         logger.info(f"Data Transformation config captured.")
 
 
@@ -50,73 +161,23 @@ class DataTransformation:
         df_name_list = self.__transformation_config.df_name_list
         prep_pip_dict = self.__transformation_config.preprocessor_pipeline_paths_dict
         prep_dict = self.__transformation_config.preprocessor_paths_dict
+        features_paths_dict = self.__transformation_config.features_paths_dict
         logger.info("Stored the paths to preprocessor pipeline and objects as dictionary.")
 
-        TransformationPipeline().initiate_transformation_pipeline()
-
-        train_arr_dict = {}
-        test_arr_dict = {}
-
-        for df_name in df_name_list:
-            try:
-                train_df = pd.read_csv(train_data_dict[df_name])
-                test_df = pd.read_csv(test_data_dict[df_name])
-                logger.info(f"Loaded the train and test data for the dataframe {df_name}.")
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                train_df_with_indices, test_df_with_indices = add_trade_indicators(train_df, test_df, df_name)
-                train_df_with_indices_labeled, test_df_with_indices_labeled = add_label(train_df_with_indices, test_df_with_indices, df_name)
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                prep_pipeline = load_obj(prep_pip_dict[df_name])
-                logger.info("Loaded the preprocessor pipeline object into 'prep_pipeline' variable.")
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                X_train = train_df_with_indices_labeled.drop(columns='label')
-                y_train = train_df_with_indices_labeled['label']
-                logger.info(f"Split train data in {df_name} into features and label dataframes.")
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                X_test = test_df_with_indices_labeled.drop(columns='label')
-                y_test = test_df_with_indices_labeled['label']
-                logger.info(f"Split test data in {df_name} into features and label dataframes.")
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                X_train_arr = prep_pipeline.fit_transform(X_train)
-                X_test_arr = prep_pipeline.transform(X_test)
-                logger.info(f"Applied the preprocessor pipeline onto the train and test features sets in {df_name}.")
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                train_arr_dict[df_name] = np.c_[X_train_arr, np.array(y_train)]
-                test_arr_dict[df_name] = np.c_[X_test_arr, np.array(y_test)]
-                logger.info("Concatenated the train and test feats and label arrays.")
-            except Exception as e:
-                raise CustomException(e)
-
-            try:
-                save_obj(file_path=prep_dict[df_name], obj=prep_pipeline)
-                logger.info(f"Preprocessor object saved into '.artifacts/{df_name}/preprocessor.pkl'")
-            except Exception as e:
-                raise CustomException(e)
+        pipeline = TransformationPipeline(store=self.__store, catalog=self.__transformation_config.catalog,
+                                          cache=self.__cache, max_workers=self.__max_workers)
+        pipeline.initiate_transformation_pipeline()
+
+        tasks = {df_name: (train_data_dict[df_name], test_data_dict[df_name], prep_pip_dict[df_name],
+                           prep_dict[df_name], features_paths_dict['train'][df_name], features_paths_dict['test'][df_name],
+                           self.__store, self.__cache, pipeline.market_context_path)
+                 for df_name in df_name_list if df_name not in pipeline.failures}
+        results, self.failures = run_tables(transform_table, tasks, max_workers=self.__max_workers)
+        self.failures.update(pipeline.failures)
+
+        # Feature sets come back as paths and are loaded memory-mapped, rather than pickled across processes
+        train_arr_dict = {df_name: FeatureSet.load(results[df_name][0]) for df_name in df_name_list if df_name in results}
+        test_arr_dict = {df_name: FeatureSet.load(results[df_name][1]) for df_name in df_name_list if df_name in results}
+        logger.info(f"Transformed {len(results)} tables, {len(self.failures)} failed.")
                 
         return(train_arr_dict, test_arr_dict, prep_dict)
-    
-
-ingested_data = DataIngestion().initiate_data_ingestion()
-DataTransformation().initiate_data_transformation(ingested_data[0], ingested_data[1])
-
-
-
-
@@ -0,0 +1,73 @@
+import os
+from src.log import logger
+from src.artifact_store import ArtifactStore
+from src.catalog import DataCatalog
+from src.dtypes import feature_columns
+from src.feature_set import FeatureSet
+from src.market_context import MARKET_TABLES, build_market_context, load_market_context
+from src.panel import Panel, segment_offsets, segmented_sum
+from src.pipelines.panel_pipeline import PanelPreprocessor
+from src.stage_cache import StageCache
+from src.utils import save_json, LABELS
+import numpy as np
+
+
+# Panel transformation config class
+class PanelTransformationConfig:
+    def __init__(self, catalog: DataCatalog = None, store: ArtifactStore = None, cache: StageCache = None,
+                 test_size: float = 0.2):
+        self.catalog = catalog or DataCatalog(schema='production')
+        self.store = store or ArtifactStore()
+        self.cache = cache or StageCache()
+        self.test_size = test_size
+        self.df_name_list = [df_name for df_name in self.catalog.table_names if df_name not in MARKET_TABLES]
+        self.panel_dir = os.path.join('.artifacts', 'panel')
+        self.index_path = os.path.join(self.panel_dir, 'index.json')
+        self.preprocessor_dir = os.path.join(self.panel_dir, 'preprocessor')
+        self.features_paths_dict = {i: os.path.join(self.panel_dir, f'{i}_features') for i in ['train', 'test']}
+
+
+# Transformation of all the symbols at once, over a panel of their raw data instead of one table at a time:
+# indicators, the chronological split, labels and the preprocessor all run as segmented operations over the panel.
+# The train and test feature sets hold the rows of every symbol, in (symbol, date) order; their row offsets per
+# symbol are stored in the panel index, and each symbol's preprocessor state in its own directory.
+class PanelTransformation:
+    def __init__(self, catalog: DataCatalog = None, store: ArtifactStore = None, cache: StageCache = None,
+                 test_size: float = 0.2):
+        self.__panel_config = PanelTransformationConfig(catalog=catalog, store=store, cache=cache, test_size=test_size)
+        logger.info("Panel transformation config captured.")
+
+    def initiate_panel_transformation(self):
+        config = self.__panel_config
+        panel = Panel.from_store(config.df_name_list, 'raw', config.store)
+
+        # One join of the market context over the whole panel
+        market_context = load_market_context(build_market_context(config.store, config.cache))
+        if market_context is not None:
+            panel.data = market_context.add_context(panel.data)
+
+        # Same features as the per-table preprocessor pipelines, which are built from the raw data
+        num_feats, cat_feats = feature_columns(panel.data)
+        panel.add_indicators()
+        train_mask = panel.train_mask(config.test_size)
+        panel.add_label(train_mask)
+
+        preprocessor = PanelPreprocessor(num_feats, cat_feats).fit(panel, train_mask)
+        X = preprocessor.transform(panel)
+        y = panel.data['label']
+        train_lengths = segmented_sum(train_mask.astype(np.float64), panel.offsets).astype(np.int64)
+
+        train_features = FeatureSet.from_arrays(X[train_mask], y[train_mask], preprocessor.feature_names, LABELS)
+        test_features = FeatureSet.from_arrays(X[~train_mask], y[~train_mask], preprocessor.feature_names, LABELS)
+        train_features.save(config.features_paths_dict['train'])
+        test_features.save(config.features_paths_dict['test'])
+        logger.info(f"Built the train and test feature sets of the panel of {len(panel.symbols)} symbols.")
+
+        for symbol in panel.symbols:
+            preprocessor.for_symbol(symbol).save(os.path.join(config.preprocessor_dir, symbol))
+
+        save_json(file_path=config.index_path,
+                  obj=dict(symbols=panel.symbols, train_offsets=segment_offsets(train_lengths).tolist(),
+                           test_offsets=segment_offsets(panel.lengths - train_lengths).tolist()))
+
+        return train_features, test_features, config.index_path
@@ -0,0 +1,122 @@
+import os
+import numpy as np
+from src.exceptions import CustomException
+from src.log import logger
+from src.artifact_store import ArtifactStore
+from src.dtypes import DtypePolicy, feature_columns
+from src.catalog import DataCatalog
+from src.feature_set import FeatureSet
+from src.market_context import MARKET_TABLES, build_market_context, load_market_context
+from src.indicators import StreamingIndicators
+from src.pipelines.streaming_pipeline import StreamingPreprocessor, Reservoir
+from src.utils import iter_table_chunks, add_date_columns, assign_labels, LABELS, LABEL_THRESHOLDS
+
+
+# Streaming transformation config class
+class StreamingTransformationConfig:
+    def __init__(self, catalog: DataCatalog = None, store: ArtifactStore = None, chunksize: int = 100_000,
+                 test_size: float = 0.2, dtype_policy: DtypePolicy = None):
+        self.catalog = catalog or DataCatalog(schema='production')
+        self.store = store or ArtifactStore()
+        self.dtype_policy = dtype_policy or DtypePolicy()
+        self.chunksize = chunksize
+        self.test_size = test_size
+        self.df_name_list = [df_name for df_name in self.catalog.table_names if df_name not in MARKET_TABLES]
+        self.stream_dirs_dict = self.__stream_dirs()
+
+    def __stream_dirs(self):
+        paths = {}
+        try:
+            for df_name in self.df_name_list:
+                paths[df_name] = os.path.join('.artifacts', df_name, 'stream')
+                logger.info(f"Defined the streaming artifacts directory for dataframe {df_name}.")
+
+            return paths
+        except Exception as e:
+            raise CustomException(e)
+
+
+# Out-of-core transformation, for tables larger than memory. Each table is streamed from Postgres in date order,
+# chunk by chunk: indicators carry their state across chunks, the preprocessor and label thresholds are fitted
+# incrementally over the train rows (the first 1 - test_size of the table), then every chunk is transformed into
+# its own feature set part. Peak memory is bounded by the chunk size. Chunks are typed by the same dtype policy as
+# the batch ingestion, so the categorical vocabularies agree across chunks, and get the market context of the
+# ingested market tables, if any.
+class StreamingTransformation:
+    def __init__(self, catalog: DataCatalog = None, store: ArtifactStore = None, chunksize: int = 100_000,
+                 test_size: float = 0.2, dtype_policy: DtypePolicy = None):
+        self.__streaming_config = StreamingTransformationConfig(catalog=catalog, store=store, chunksize=chunksize,
+                                                                test_size=test_size, dtype_policy=dtype_policy)
+        logger.info("Streaming transformation config captured.")
+
+    def initiate_streaming_transformation(self):
+        train_parts_dict = {}
+        test_parts_dict = {}
+        self.__market_context = load_market_context(build_market_context(self.__streaming_config.store))
+
+        for df_name in self.__streaming_config.df_name_list:
+            train_parts_dict[df_name], test_parts_dict[df_name] = self.__transform_table(df_name)
+
+        return [train_parts_dict, test_parts_dict]
+
+    def __transform_table(self, df_name):
+        config = self.__streaming_config
+        store = config.store
+        stream_dir = config.stream_dirs_dict[df_name]
+        n_train = int(config.catalog.row_count(df_name) - np.ceil(config.catalog.row_count(df_name) * config.test_size))
+
+        indicators = StreamingIndicators()
+        upper_bb, lower_bb = Reservoir(), Reservoir()
+        preprocessor = None
+        chunk_paths = []
+        n_rows = 0
+
+        # First pass: stream from the database, store the chunks with their indicators, fit over the train rows
+        for i, chunk in enumerate(iter_table_chunks(df_name, config.catalog.schema, config.chunksize, order_by='j_date')):
+            chunk = config.dtype_policy.apply(add_date_columns(chunk, df_name), df_name)
+            if self.__market_context is not None:
+                chunk = self.__market_context.add_context(chunk)
+            if preprocessor is None:
+                preprocessor = StreamingPreprocessor(*feature_columns(chunk))
+            chunk = indicators.add_indicators(chunk)
+
+            chunk_paths.append(os.path.join(stream_dir, f"chunk-{i:05d}.{store.extension}"))
+            store.write(chunk, chunk_paths[-1])
+
+            train_rows = chunk.iloc[:max(n_train - n_rows, 0)]
+            if len(train_rows):
+                preprocessor.partial_fit(train_rows)
+                upper_bb.update(train_rows['upper_bb'].to_numpy(dtype=np.float64))
+                lower_bb.update(train_rows['lower_bb'].to_numpy(dtype=np.float64))
+            n_rows += len(chunk)
+            logger.info(f"Streamed {n_rows} rows of {df_name}.")
+
+        if preprocessor is None:
+            logger.info(f"No rows to transform in {df_name}.")
+            return [], []
+
+        fitted = dict(LABEL_THRESHOLDS,
+                      upper_bb_high=upper_bb.quantile(LABEL_THRESHOLDS['high_quantile']),
+                      upper_bb_low=upper_bb.quantile(LABEL_THRESHOLDS['low_quantile']),
+                      lower_bb_high=lower_bb.quantile(LABEL_THRESHOLDS['high_quantile']),
+                      lower_bb_low=lower_bb.quantile(LABEL_THRESHOLDS['low_quantile']))
+        preprocessor.finalize()
+        config.dtype_policy.save()
+
+        # Second pass: label and transform the stored chunks one at a time
+        train_parts, test_parts = [], []
+        n_rows = 0
+        for i, chunk_path in enumerate(chunk_paths):
+            chunk = store.read(chunk_path)
+            y = assign_labels(chunk, fitted)
+            X = preprocessor.transform(chunk)
+            cut = min(max(n_train - n_rows, 0), len(chunk))
+
+            for rows, parts, name in [(slice(0, cut), train_parts, 'train'), (slice(cut, len(chunk)), test_parts, 'test')]:
+                if rows.stop > rows.start:
+                    parts.append(os.path.join(stream_dir, f"{name}_features", f"part-{i:05d}"))
+                    FeatureSet.from_arrays(X[rows], y[rows], preprocessor.feature_names, LABELS).save(parts[-1])
+            n_rows += len(chunk)
+
+        logger.info(f"Transformed {n_rows} rows of {df_name} into {len(train_parts)} train and {len(test_parts)} test parts.")
+        return train_parts, test_parts
@@ -0,0 +1,158 @@
+from src.exceptions import CustomException
+from src.log import logger, log_event
+import numpy as np
+import pandas as pd
+import json
+import os
+from typing import List
+
+# Categorical columns whose vocabularies are shared by all the tables, so that a code means the same value everywhere
+SHARED_VOCABULARY_COLUMNS = ['category.id', 'market.id']
+
+# Date columns, kept as datetime64
+DATE_COLUMNS = ['greg_date']
+
+# Jalali date parts: numbers, but not features (the year of a chronological test set is outside the training range)
+DATE_PART_COLUMNS = ['jal_year', 'jal_month', 'jal_day']
+
+_INT32 = np.iinfo(np.int32)
+
+
+# Id and metadata columns, dictionary-encoded as categoricals of strings
+def is_id_or_meta(col: str):
+    return any(x in col for x in ['id', 'meta']) and col not in SHARED_VOCABULARY_COLUMNS
+
+
+# Numerical and categorical features of a typed dataframe: the ids, metadata and date parts are neither
+def feature_columns(df: pd.DataFrame):
+    num_feats = [col for col in df.select_dtypes(include=['number']).columns if col not in DATE_PART_COLUMNS]
+    cat_feats = [col for col in df.columns if col in SHARED_VOCABULARY_COLUMNS]
+    return num_feats, cat_feats
+
+
+# String values of a column, missing values kept missing. An integer column with missing values is read as floats,
+# its values are written as the integers they are ('1', not '1.0'), as they are without missing values.
+def _as_strings(series: pd.Series):
+    if pd.api.types.is_float_dtype(series.dtype):
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[~np.isnan(values)]
+        if np.isfinite(values).all() and np.array_equal(values, np.trunc(values)) and \
+                (len(values) == 0 or np.abs(values).max() < 2**53):
+            series = series.astype('Int64')
+    return series.astype(str).where(series.notna())
+
+
+# Columns typed as categoricals of strings by the policy, which a CSV file must read back as strings
+def string_columns(columns: List[str]):
+    return [col for col in columns if col in SHARED_VOCABULARY_COLUMNS or is_id_or_meta(col)]
+
+
+# Downcast a numerical column to float32 or int32 when no value changes, else return it as is
+def downcast(series: pd.Series):
+    values = series.to_numpy()
+    if values.dtype == np.float64:
+        values32 = values.astype(np.float32)
+        if np.array_equal(values32.astype(np.float64), values, equal_nan=True):
+            return pd.Series(values32, index=series.index, name=series.name)
+    elif values.dtype == np.int64:
+        if len(values) == 0 or (values.min() >= _INT32.min and values.max() <= _INT32.max):
+            return series.astype(np.int32)
+    return series
+
+
+# Concatenate dataframes, keeping their categorical columns categorical over the union of their categories
+def concat_frames(frames: List[pd.DataFrame]):
+    frames = [df for df in frames if df is not None]
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.Index([])
+            for df in frames:
+                categories = categories.append(df[col].cat.categories.difference(categories))
+            dtype = pd.CategoricalDtype(categories)
+            frames = [df.assign(**{col: df[col].astype(dtype)}) if col in df.columns else df for df in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+# Per-table memory report of a dataframe before and after typing, in bytes (deep, strings included)
+def memory_report(before: pd.DataFrame, after: pd.DataFrame):
+    before_bytes = before.memory_usage(deep=True, index=False)
+    after_bytes = after.memory_usage(deep=True, index=False)
+    return dict(rows=len(after), bytes_before=int(before_bytes.sum()), bytes_after=int(after_bytes.sum()),
+                columns={col: [int(before_bytes.get(col, 0)), int(after_bytes[col]), str(after[col].dtype)]
+                         for col in after.columns})
+
+
+# Dtype policy applied once at ingestion, so that the later stages receive compact, stable types:
+# ids and metadata become categoricals of strings, 'category.id' and 'market.id' categoricals over vocabularies
+# shared by all the tables (stored in 'vocabulary_path', new values are only ever appended, so codes never change),
+# prices and volumes float32 or int32 where lossless, and dates datetime64.
+class DtypePolicy:
+    def __init__(self, vocabulary_path: str = os.path.join('.artifacts', 'vocabularies.json')):
+        self.vocabulary_path = vocabulary_path
+        self.vocabularies = self.__load()
+
+    def __load(self):
+        vocabularies = {col: [] for col in SHARED_VOCABULARY_COLUMNS}
+        if not os.path.exists(self.vocabulary_path):
+            return vocabularies
+        try:
+            with open(self.vocabulary_path, "r") as f:
+                return {**vocabularies, **json.load(f)}
+        except Exception as e:
+            raise CustomException(e)
+
+    # Categorical dtype of a shared column, extending its vocabulary with the unseen values
+    def category_dtype(self, col: str, values: pd.Series):
+        vocabulary = self.vocabularies.setdefault(col, [])
+        vocabulary.extend(sorted(set(values.dropna().unique()) - set(vocabulary)))
+        return pd.CategoricalDtype(vocabulary)
+
+    # Return the typed dataframe, without logging its memory report (e.g. a stored dataframe read back)
+    def cast(self, df: pd.DataFrame):
+        try:
+            typed = {}
+            for col in df.columns:
+                series = df[col]
+                if col in SHARED_VOCABULARY_COLUMNS:
+                    values = _as_strings(series)
+                    typed[col] = values.astype(self.category_dtype(col, values))
+                elif is_id_or_meta(col):
+                    typed[col] = series if isinstance(series.dtype, pd.CategoricalDtype) else \
+                        _as_strings(series).astype('category')
+                elif col in DATE_COLUMNS:
+                    typed[col] = pd.to_datetime(series)
+                elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+                    typed[col] = downcast(series)
+                else:
+                    typed[col] = series
+            return pd.DataFrame(typed, index=df.index)
+        except Exception as e:
+            raise CustomException(e)
+
+    # Return the typed dataframe; 'table' names it in the memory report
+    def apply(self, df: pd.DataFrame, table: str = None):
+        typed_df = self.cast(df)
+        report = memory_report(df, typed_df)
+        log_event('dtype_policy', table, rows=report['rows'], bytes_before=report['bytes_before'],
+                  bytes_after=report['bytes_after'], columns=report['columns'])
+        logger.info(f"Typed {table}: {report['bytes_before'] / 2**20:.1f} MiB -> {report['bytes_after'] / 2**20:.1f} MiB.")
+        return typed_df
+
+    # Store the shared vocabularies, keeping the values another run stored meanwhile
+    def save(self):
+        try:
+            stored = self.__load()
+            for col, vocabulary in self.vocabularies.items():
+                stored_vocabulary = stored.setdefault(col, [])
+                seen = set(stored_vocabulary)
+                stored_vocabulary.extend(v for v in vocabulary if v not in seen)
+            self.vocabularies = stored
+
+            os.makedirs(os.path.dirname(self.vocabulary_path) or '.', exist_ok=True)
+            tmp_path = f"{self.vocabulary_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self.vocabulary_path)
+            logger.info(f"Stored the shared category vocabularies into '{self.vocabulary_path}'.")
+        except Exception as e:
+            raise CustomException(e)
@@ -0,0 +1,104 @@
+from src.exceptions import CustomException
+from src.log import logger
+import numpy as np
+import pandas as pd
+import json
+import os
+from typing import List
+
+# scipy is imported by the methods that use it, so that importing this module (e.g. in the worker processes of the
+# stages) does not load it.
+
+# Version of the on-disk feature set layout
+FEATURE_SET_VERSION = 1
+
+
+# Size of a float32 CSR matrix with 'nnz' stored values, without building it: scipy stores its indices as int32
+# while they fit, else as int64
+def _csr_nbytes(nnz: int, n_rows: int, n_cols: int):
+    index_bytes = 4 if max(nnz, n_cols) <= np.iinfo(np.int32).max else 8
+    return nnz * (4 + index_bytes) + (n_rows + 1) * index_bytes
+
+
+# Feature matrix of a table: X as float32 (dense or CSR sparse, whichever is smaller), y as int8 codes with their
+# label map, and the feature names. Saved as .npy files plus a JSON spec, so that X and y load memory-mapped.
+class FeatureSet:
+    def __init__(self, X, y: np.ndarray, feature_names: List[str], labels: List[str]):
+        self.X = X
+        self.y = y
+        self.feature_names = feature_names
+        self.labels = labels
+
+    @classmethod
+    def from_arrays(cls, X, y, feature_names: List[str], labels: List[str]):
+        from scipy import sparse
+        try:
+            X = X.astype(np.float32) if sparse.issparse(X) else np.asarray(X, dtype=np.float32)
+            n_rows, n_cols = X.shape
+            nnz = X.nnz if sparse.issparse(X) else np.count_nonzero(X)
+            if _csr_nbytes(nnz, n_rows, n_cols) < n_rows * n_cols * 4:
+                X = X.tocsr() if sparse.issparse(X) else sparse.csr_matrix(X)
+            elif sparse.issparse(X):
+                X = X.toarray()
+
+            y = pd.Categorical(np.asarray(y), categories=labels).codes.astype(np.int8)
+            return cls(X, y, [str(name) for name in feature_names], list(labels))
+        except Exception as e:
+            raise CustomException(e)
+
+    @property
+    def is_sparse(self):
+        from scipy import sparse
+        return sparse.issparse(self.X)
+
+    @property
+    def nbytes(self):
+        if self.is_sparse:
+            return self.X.data.nbytes + self.X.indices.nbytes + self.X.indptr.nbytes + self.y.nbytes
+        return self.X.nbytes + self.y.nbytes
+
+    # Decode the int8 label codes
+    def label_values(self):
+        return np.asarray(self.labels, dtype=object)[self.y]
+
+    def save(self, dir_path: str):
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+            if self.is_sparse:
+                np.save(os.path.join(dir_path, 'X_data.npy'), self.X.data)
+                np.save(os.path.join(dir_path, 'X_indices.npy'), self.X.indices)
+                np.save(os.path.join(dir_path, 'X_indptr.npy'), self.X.indptr)
+            else:
+                np.save(os.path.join(dir_path, 'X.npy'), self.X)
+            np.save(os.path.join(dir_path, 'y.npy'), self.y)
+
+            spec = dict(version=FEATURE_SET_VERSION, format='csr' if self.is_sparse else 'dense',
+                        shape=list(self.X.shape), feature_names=self.feature_names, labels=self.labels)
+            with open(os.path.join(dir_path, 'spec.json'), "w") as f:
+                json.dump(spec, f)
+            logger.info(f"Stored the feature set ({self.nbytes} bytes) into '{dir_path}'.")
+        except Exception as e:
+            raise CustomException(e)
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True):
+        from scipy import sparse
+        mmap_mode = 'r' if mmap else None
+        try:
+            with open(os.path.join(dir_path, 'spec.json'), "r") as f:
+                spec = json.load(f)
+            if spec['version'] != FEATURE_SET_VERSION:
+                raise ValueError(f"Unsupported feature set version {spec['version']} in '{dir_path}'.")
+
+            if spec['format'] == 'csr':
+                X = sparse.csr_matrix((np.load(os.path.join(dir_path, 'X_data.npy'), mmap_mode=mmap_mode),
+                                       np.load(os.path.join(dir_path, 'X_indices.npy'), mmap_mode=mmap_mode),
+                                       np.load(os.path.join(dir_path, 'X_indptr.npy'), mmap_mode=mmap_mode)),
+                                      shape=tuple(spec['shape']), copy=False)
+            else:
+                X = np.load(os.path.join(dir_path, 'X.npy'), mmap_mode=mmap_mode)
+            y = np.load(os.path.join(dir_path, 'y.npy'), mmap_mode=mmap_mode)
+            logger.info(f"Loaded the feature set from '{dir_path}'.")
+            return cls(X, y, spec['feature_names'], spec['labels'])
+        except Exception as e:
+            raise CustomException(e)
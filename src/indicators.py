@@ -0,0 +1,359 @@
+from src.exceptions import CustomException
+from numpy.lib.stride_tricks import sliding_window_view
+import importlib.util
+import numpy as np
+import pandas as pd
+from typing import List
+
+# TA-Lib is optional, the NumPy implementations below are used where it is not installed. It is only imported on
+# the first call to a TA-Lib function.
+_TALIB_AVAILABLE = importlib.util.find_spec('talib') is not None
+
+
+# Default indicator specs, as used by the trading labels
+INDICATOR_SPECS = [
+    dict(kind='RSI', timeperiod=14),
+    dict(kind='MACD', fastperiod=12, slowperiod=26, signalperiod=9),
+    dict(kind='BBANDS', timeperiod=20, nbdevup=2, nbdevdn=2),
+]
+
+# Output column names of each indicator kind, unless a spec overrides them with 'columns'
+OUTPUT_COLUMNS = {
+    'RSI': ['rsi'],
+    'MACD': ['macd', 'signal', 'hist'],
+    'BBANDS': ['upper_bb', 'middle_bb', 'lower_bb'],
+}
+
+
+# Recursive mean y[t] = (1 - alpha) * y[t-1] + alpha * x[t], starting from y[-1] = seed
+def _ewm(x, alpha: float, seed: float):
+    if len(x) == 0:
+        return np.empty(0)
+    from scipy.signal import lfilter
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], x, zi=[(1.0 - alpha) * seed])
+    return y
+
+
+# Exponential moving average, seeded with the simple average of the first 'period' values (as TA-Lib does)
+def _ema(x, period: int):
+    out = np.full(len(x), np.nan)
+    if len(x) < period:
+        return out
+    seed = x[:period].mean()
+    out[period - 1] = seed
+    out[period:] = _ewm(x[period:], 2.0 / (period + 1), seed)
+    return out
+
+
+# Relative Strength Index, with Wilder's smoothing
+def _rsi(close, timeperiod: int = 14):
+    n = len(close)
+    out = np.full(n, np.nan)
+    if n <= timeperiod:
+        return out
+
+    diff = np.diff(close)
+    gain = np.clip(diff, 0, None)
+    loss = np.clip(-diff, 0, None)
+    avg_gain = np.empty(n - timeperiod)
+    avg_loss = np.empty(n - timeperiod)
+    avg_gain[0] = gain[:timeperiod].mean()
+    avg_loss[0] = loss[:timeperiod].mean()
+    avg_gain[1:] = _ewm(gain[timeperiod:], 1.0 / timeperiod, avg_gain[0])
+    avg_loss[1:] = _ewm(loss[timeperiod:], 1.0 / timeperiod, avg_loss[0])
+
+    total = avg_gain + avg_loss
+    nonzero = np.abs(total) >= 1e-8
+    out[timeperiod:] = np.where(nonzero, 100.0 * avg_gain / np.where(nonzero, total, 1.0), 0.0)
+    return out
+
+
+# Moving Average Convergence Divergence, aligned on TA-Lib's lookback
+def _macd(close, fastperiod: int = 12, slowperiod: int = 26, signalperiod: int = 9):
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+    n = len(close)
+    lookback = slowperiod - 1 + signalperiod - 1
+    macd, signal = np.full(n, np.nan), np.full(n, np.nan)
+    if n <= lookback:
+        return macd, signal, macd - signal
+
+    slow_ema = _ema(close, slowperiod)
+    fast_ema = np.full(n, np.nan)
+    fast_ema[slowperiod - fastperiod:] = _ema(close[slowperiod - fastperiod:], fastperiod)
+    macd = fast_ema - slow_ema
+    signal[slowperiod - 1:] = _ema(macd[slowperiod - 1:], signalperiod)
+    macd[:lookback] = np.nan
+    return macd, signal, macd - signal
+
+
+# Bollinger Bands over a simple moving average, with the population standard deviation
+def _bbands(close, timeperiod: int = 5, nbdevup: float = 2, nbdevdn: float = 2):
+    n = len(close)
+    upper, middle, lower = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    if n < timeperiod:
+        return upper, middle, lower
+
+    windows = sliding_window_view(close, timeperiod)
+    mean = windows.mean(axis=1)
+    std = windows.std(axis=1)
+    middle[timeperiod - 1:] = mean
+    upper[timeperiod - 1:] = mean + nbdevup * std
+    lower[timeperiod - 1:] = mean - nbdevdn * std
+    return upper, middle, lower
+
+
+# Streaming exponential moving average: seeded with the simple average of its first 'period' values, then carried
+# across updates as a single value
+class _StreamingEMA:
+    def __init__(self, period: int, alpha: float):
+        self.period = period
+        self.alpha = alpha
+        self.seed_values = []
+        self.value = None
+
+    def update(self, x):
+        out = np.full(len(x), np.nan)
+        i = 0
+        if self.value is None:
+            i = min(self.period - len(self.seed_values), len(x))
+            self.seed_values.extend(x[:i].tolist())
+            if len(self.seed_values) < self.period:
+                return out
+            self.value = float(np.mean(self.seed_values))
+            out[i - 1] = self.value
+        if i < len(x):
+            out[i:] = _ewm(x[i:], self.alpha, self.value)
+            self.value = float(out[-1])
+        return out
+
+    # State as a flat array: the number of seed values, the current value, then the seed values (NaN padded)
+    @property
+    def state_size(self):
+        return self.period + 2
+
+    def get_state(self):
+        state = np.full(self.state_size, np.nan)
+        state[0] = len(self.seed_values)
+        state[1] = np.nan if self.value is None else self.value
+        state[2:2 + len(self.seed_values)] = self.seed_values
+        return state
+
+    # The value is set once the seed values are all known
+    def set_state(self, state):
+        n_seed = int(state[0])
+        self.seed_values = state[2:2 + n_seed].tolist()
+        self.value = float(state[1]) if n_seed == self.period else None
+
+
+# Streaming RSI, the Wilder averages of gains and losses carried across updates
+class _StreamingRSI:
+    def __init__(self, timeperiod: int = 14):
+        self.avg_gain = _StreamingEMA(timeperiod, 1.0 / timeperiod)
+        self.avg_loss = _StreamingEMA(timeperiod, 1.0 / timeperiod)
+        self.last_close = None
+
+    def update(self, close):
+        if len(close) == 0:
+            return np.empty(0)
+        prev = close[:1] if self.last_close is None else np.array([self.last_close])
+        diff = np.diff(np.concatenate([prev, close]))
+        if self.last_close is None:
+            diff = diff[1:]
+        self.last_close = float(close[-1])
+
+        avg_gain = self.avg_gain.update(np.clip(diff, 0, None))
+        avg_loss = self.avg_loss.update(np.clip(-diff, 0, None))
+        total = avg_gain + avg_loss
+        nonzero = np.abs(total) >= 1e-8
+        rsi = np.where(nonzero, 100.0 * avg_gain / np.where(nonzero, total, 1.0), 0.0)
+        rsi[np.isnan(total)] = np.nan
+
+        out = np.full(len(close), np.nan)
+        out[len(close) - len(rsi):] = rsi
+        return out
+
+    # State as a flat array: whether a close was seen, the last close, then the states of both averages
+    @property
+    def state_size(self):
+        return 2 + self.avg_gain.state_size + self.avg_loss.state_size
+
+    def get_state(self):
+        last = [0.0, np.nan] if self.last_close is None else [1.0, self.last_close]
+        return np.concatenate([last, self.avg_gain.get_state(), self.avg_loss.get_state()])
+
+    def set_state(self, state):
+        self.last_close = float(state[1]) if state[0] else None
+        self.avg_gain.set_state(state[2:2 + self.avg_gain.state_size])
+        self.avg_loss.set_state(state[2 + self.avg_gain.state_size:])
+
+
+# Streaming MACD, aligned on the batch (TA-Lib) lookback
+class _StreamingMACD:
+    def __init__(self, fastperiod: int = 12, slowperiod: int = 26, signalperiod: int = 9):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+        self.fastperiod, self.slowperiod = fastperiod, slowperiod
+        self.lookback = slowperiod - 1 + signalperiod - 1
+        self.fast = _StreamingEMA(fastperiod, 2.0 / (fastperiod + 1))
+        self.slow = _StreamingEMA(slowperiod, 2.0 / (slowperiod + 1))
+        self.signal = _StreamingEMA(signalperiod, 2.0 / (signalperiod + 1))
+        self.n = 0
+
+    def update(self, close):
+        n = len(close)
+        fast = np.full(n, np.nan)
+        fast_start = min(max(self.slowperiod - self.fastperiod - self.n, 0), n)
+        fast[fast_start:] = self.fast.update(close[fast_start:])
+        macd = fast - self.slow.update(close)
+
+        signal = np.full(n, np.nan)
+        signal_start = min(max(self.slowperiod - 1 - self.n, 0), n)
+        signal[signal_start:] = self.signal.update(macd[signal_start:])
+
+        macd[:min(max(self.lookback - self.n, 0), n)] = np.nan
+        self.n += n
+        return macd, signal, macd - signal
+
+    # State as a flat array: the number of closes seen, then the states of the three averages
+    @property
+    def state_size(self):
+        return 1 + self.fast.state_size + self.slow.state_size + self.signal.state_size
+
+    def get_state(self):
+        return np.concatenate([[self.n], self.fast.get_state(), self.slow.get_state(), self.signal.get_state()])
+
+    def set_state(self, state):
+        self.n = int(state[0])
+        i = 1
+        for ema in [self.fast, self.slow, self.signal]:
+            ema.set_state(state[i:i + ema.state_size])
+            i += ema.state_size
+
+
+# Streaming Bollinger Bands, the last 'timeperiod - 1' closes carried across updates
+class _StreamingBBANDS:
+    def __init__(self, timeperiod: int = 5, nbdevup: float = 2, nbdevdn: float = 2):
+        self.params = dict(timeperiod=timeperiod, nbdevup=nbdevup, nbdevdn=nbdevdn)
+        self.tail = np.empty(0)
+
+    def update(self, close):
+        window = np.concatenate([self.tail, close])
+        self.tail = window[max(len(window) - (self.params['timeperiod'] - 1), 0):] if self.params['timeperiod'] > 1 else np.empty(0)
+        return tuple(output[len(window) - len(close):] for output in _bbands(window, **self.params))
+
+    # State as a flat array: the number of carried closes, then the closes (NaN padded)
+    @property
+    def state_size(self):
+        return 1 + max(self.params['timeperiod'] - 1, 0)
+
+    def get_state(self):
+        state = np.full(self.state_size, np.nan)
+        state[0] = len(self.tail)
+        state[1:1 + len(self.tail)] = self.tail
+        return state
+
+    def set_state(self, state):
+        self.tail = np.array(state[1:1 + int(state[0])], dtype=np.float64)
+
+
+# Stateful indicator computation over a price series arriving in chunks. Each update returns the indicator values
+# of the new prices, equal to the batch computation over the whole series. The state of all the indicators is a
+# flat float64 array of a size fixed by the specs, e.g. to store many series' states as the rows of one 2D array.
+class StreamingIndicators:
+    STREAMING = {'RSI': _StreamingRSI, 'MACD': _StreamingMACD, 'BBANDS': _StreamingBBANDS}
+
+    def __init__(self, specs: List[dict] = None):
+        self.specs = specs or INDICATOR_SPECS
+        self.columns = indicator_columns(self.specs)
+        self.__states = [self.STREAMING[spec['kind']](**{k: v for k, v in spec.items() if k not in ['kind', 'columns']})
+                         for spec in self.specs]
+
+    def update(self, close):
+        close = np.ascontiguousarray(close, dtype=np.float64)
+        values = np.empty((len(close), len(self.columns)), dtype=np.float64)
+        i = 0
+        for state in self.__states:
+            outputs = state.update(close)
+            for output in (outputs if isinstance(outputs, tuple) else (outputs,)):
+                values[:, i] = output
+                i += 1
+        return self.columns, values
+
+    @property
+    def state_size(self):
+        return sum(state.state_size for state in self.__states)
+
+    def get_state(self):
+        return np.concatenate([state.get_state() for state in self.__states])
+
+    # Resume from a state returned by get_state, for the same specs
+    def set_state(self, state):
+        state = np.asarray(state, dtype=np.float64)
+        if len(state) != self.state_size:
+            raise ValueError(f"Indicator state of size {len(state)}, expected {self.state_size} for these specs.")
+        i = 0
+        for indicator_state in self.__states:
+            indicator_state.set_state(state[i:i + indicator_state.state_size])
+            i += indicator_state.state_size
+        return self
+
+    # Return the chunk with the indicator columns of its prices added
+    def add_indicators(self, df: pd.DataFrame, price_col: str = 'close_price'):
+        columns, values = self.update(df[price_col].to_numpy())
+        indicators_df = pd.DataFrame(values, columns=columns, index=df.index)
+        return pd.concat([df.drop(columns=[c for c in columns if c in df.columns]), indicators_df], axis=1)
+
+
+# Indicator implementations per backend
+BACKENDS = {
+    'numpy': {'RSI': _rsi, 'MACD': _macd, 'BBANDS': _bbands},
+}
+
+
+# TA-Lib function of an indicator kind, resolved on its first call
+def _talib(kind: str):
+    def function(*args, **kwargs):
+        import talib
+        return getattr(talib, kind)(*args, **kwargs)
+    return function
+
+
+if _TALIB_AVAILABLE:
+    BACKENDS['talib'] = {kind: _talib(kind) for kind in ['RSI', 'MACD', 'BBANDS']}
+
+
+# Column names of the indicators computed for the given specs
+def indicator_columns(specs: List[dict] = None):
+    specs = specs or INDICATOR_SPECS
+    return [col for spec in specs for col in spec.get('columns', OUTPUT_COLUMNS[spec['kind']])]
+
+
+# Compute all the indicators of the given specs over a price array, in one pass, into a single 2D array
+def compute_indicators(close, specs: List[dict] = None, backend: str = None):
+    specs = specs or INDICATOR_SPECS
+    backend = backend or ('talib' if _TALIB_AVAILABLE else 'numpy')
+    try:
+        functions = BACKENDS[backend]
+        close = np.ascontiguousarray(close, dtype=np.float64)
+        columns = indicator_columns(specs)
+        values = np.empty((len(close), len(columns)), dtype=np.float64)
+
+        i = 0
+        for spec in specs:
+            params = {k: v for k, v in spec.items() if k not in ['kind', 'columns']}
+            outputs = functions[spec['kind']](close, **params)
+            for output in (outputs if isinstance(outputs, tuple) else (outputs,)):
+                values[:, i] = output
+                i += 1
+
+        return columns, values
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Return the dataframe with the indicator columns added, built in a single allocation
+def add_indicators(df: pd.DataFrame, specs: List[dict] = None, backend: str = None, price_col: str = 'close_price'):
+    columns, values = compute_indicators(df[price_col].to_numpy(), specs, backend)
+    indicators_df = pd.DataFrame(values, columns=columns, index=df.index)
+    return pd.concat([df.drop(columns=[c for c in columns if c in df.columns]), indicators_df], axis=1)
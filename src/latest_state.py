@@ -0,0 +1,263 @@
+from src.exceptions import CustomException
+from src.log import logger
+from src.artifact_store import ArtifactStore
+from src.indicators import StreamingIndicators, INDICATOR_SPECS, indicator_columns
+from src.pipelines.streaming_pipeline import Reservoir
+from src.utils import fit_label_thresholds, assign_labels, LABELS, LABEL_THRESHOLDS
+import numpy as np
+import pandas as pd
+import json
+import os
+from typing import List
+
+# Version of the on-disk latest-state layout
+LATEST_STATE_VERSION = 3
+
+# Default location of the stored index
+LATEST_STATE_DIR = os.path.join('.artifacts', 'latest_state')
+
+# Bollinger band thresholds of the labels, fitted per symbol
+THRESHOLD_COLUMNS = ['upper_bb_high', 'upper_bb_low', 'lower_bb_high', 'lower_bb_low']
+
+# Indicator columns the label thresholds are quantiles of
+BAND_COLUMNS = ['upper_bb', 'lower_bb']
+
+# Day number of the symbols without any bar yet
+_NO_DAY = np.iinfo(np.int64).min
+
+# Stored arrays of the index
+_ARRAYS = ['days', 'closes', 'values', 'thresholds', 'labels', 'states', 'band_samples', 'band_seen']
+
+
+# Days since the epoch of a date column, as int64
+def _days(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+# Latest state of every symbol: its last 'n_closes' closes, the indicator values (RSI/MACD/Bollinger) and label of
+# its last bar, the label thresholds fitted over its history, and its streaming indicator state (a row of 'states',
+# see StreamingIndicators.get_state), so new bars update a symbol in O(new bars) instead of recomputing its whole
+# history. The thresholds are refitted on every update, over a reservoir sample of the symbol's Bollinger band
+# values ('band_samples', of which 'band_seen' values were seen): exact up to 'n_band_samples' bars, as
+# utils.add_label over the whole history, and a uniform sample of it beyond. All the symbols share the same columnar
+# arrays, and the screener filters and ranks them in one vectorized pass.
+class LatestStateIndex:
+    def __init__(self, symbols: List[str], days: np.ndarray, closes: np.ndarray, values: np.ndarray,
+                 thresholds: np.ndarray, labels: np.ndarray, states: np.ndarray, band_samples: np.ndarray,
+                 band_seen: np.ndarray, specs: List[dict] = None):
+        self.symbols = list(symbols)
+        self.specs = specs or INDICATOR_SPECS
+        self.columns = indicator_columns(self.specs)
+        self.days = days
+        self.closes = closes
+        self.values = values
+        self.thresholds = thresholds
+        self.labels = labels
+        self.states = states
+        self.band_samples = band_samples
+        self.band_seen = band_seen
+        self.__positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    # Empty index, keeping the last 'n_closes' closes of each symbol and a sample of 'n_band_samples' of its band values
+    @classmethod
+    def empty(cls, n_closes: int = 50, specs: List[dict] = None, n_band_samples: int = 1024):
+        n_columns = len(indicator_columns(specs))
+        state_size = StreamingIndicators(specs).state_size
+        return cls([], np.empty(0, dtype=np.int64), np.empty((0, n_closes)), np.empty((0, n_columns)),
+                   np.empty((0, len(THRESHOLD_COLUMNS))), np.empty(0, dtype=np.int8), np.empty((0, state_size)),
+                   np.empty((0, len(BAND_COLUMNS), n_band_samples)), np.empty((0, len(BAND_COLUMNS)), dtype=np.int64),
+                   specs)
+
+    # Build the index from a dictionary of per-symbol dataframes
+    @classmethod
+    def from_frames(cls, df_dict: dict, n_closes: int = 50, specs: List[dict] = None, date_col: str = 'greg_date',
+                    price_col: str = 'close_price', n_band_samples: int = 1024):
+        index = cls.empty(n_closes, specs, n_band_samples)
+        index.update_frames(df_dict, date_col, price_col)
+        return index
+
+    @property
+    def n_closes(self):
+        return self.closes.shape[1]
+
+    @property
+    def n_band_samples(self):
+        return self.band_samples.shape[2]
+
+    def __add_symbol(self, symbol: str):
+        self.__positions[symbol] = len(self.symbols)
+        self.symbols.append(symbol)
+        self.days = np.append(self.days, _NO_DAY)
+        self.closes = np.vstack([self.closes, np.full((1, self.n_closes), np.nan)])
+        self.values = np.vstack([self.values, np.full((1, len(self.columns)), np.nan)])
+        self.thresholds = np.vstack([self.thresholds, np.full((1, len(THRESHOLD_COLUMNS)), np.nan)])
+        self.labels = np.append(self.labels, np.int8(LABELS.index('HOLD')))
+        self.states = np.vstack([self.states, StreamingIndicators(self.specs).get_state()])
+        self.band_samples = np.concatenate([self.band_samples,
+                                            np.full((1, len(BAND_COLUMNS), self.n_band_samples), np.nan)])
+        self.band_seen = np.vstack([self.band_seen, np.zeros((1, len(BAND_COLUMNS)), dtype=np.int64)])
+
+    # Stored arrays are memory-mapped read-only, copy them before the first update
+    def __make_writable(self):
+        for name in _ARRAYS:
+            array = getattr(self, name)
+            if not array.flags.writeable:
+                setattr(self, name, np.array(array))
+
+    # Feed the new bars of a symbol, oldest first; bars not past its last date are ignored. Returns the number of
+    # new bars.
+    def update(self, symbol: str, dates, closes):
+        n_bars = self.__feed(symbol, dates, closes)
+        if n_bars:
+            i = self.__positions[symbol]
+            self.labels[i] = self.__labels(np.array([i]))[0]
+        return n_bars
+
+    # Update the state of a symbol with its new bars, all but its label
+    def __feed(self, symbol: str, dates, closes):
+        self.__make_writable()
+        try:
+            days = _days(dates)
+            closes = np.asarray(closes, dtype=np.float64)
+            if symbol not in self.__positions:
+                self.__add_symbol(symbol)
+            i = self.__positions[symbol]
+            new = days > self.days[i]
+            if not new.any():
+                return 0
+            days, closes = days[new], closes[new]
+
+            indicators = StreamingIndicators(self.specs).set_state(self.states[i])
+            _, values = indicators.update(closes)
+            self.states[i] = indicators.get_state()
+            self.__sample_bands(i, values)
+
+            self.days[i] = days[-1]
+            self.closes[i] = np.concatenate([self.closes[i], closes])[-self.n_closes:]
+            self.values[i] = values[-1]
+            return len(days)
+        except Exception as e:
+            raise CustomException(e)
+
+    # Add the band values of a symbol's new bars to its reservoirs, then refit its label thresholds over them. Each
+    # update draws from a generator seeded with the count of values seen, so that a stored index resumes the same way.
+    def __sample_bands(self, i: int, values: np.ndarray):
+        samples = {}
+        for j, col in enumerate(BAND_COLUMNS):
+            reservoir = Reservoir(self.n_band_samples, seed=int(self.band_seen[i, j]))
+            reservoir.seen = int(self.band_seen[i, j])
+            reservoir.values = self.band_samples[i, j, :min(reservoir.seen, self.n_band_samples)].copy()
+            reservoir.update(values[:, self.columns.index(col)])
+            self.band_samples[i, j, :len(reservoir.values)] = reservoir.values
+            self.band_seen[i, j] = reservoir.seen
+            samples[col] = pd.Series(reservoir.values)
+
+        fitted = fit_label_thresholds(samples) if min(len(v) for v in samples.values()) else {}
+        self.thresholds[i] = [fitted.get(col, np.nan) for col in THRESHOLD_COLUMNS]
+
+    # Feed the new bars of many symbols, from their dataframes, then label them all at once
+    def update_frames(self, df_dict: dict, date_col: str = 'greg_date', price_col: str = 'close_price'):
+        n_bars = 0
+        for symbol, df in df_dict.items():
+            df = df.sort_values(date_col, kind='stable')
+            n_bars += self.__feed(symbol, df[date_col].to_numpy(), df[price_col].to_numpy())
+        rows = np.array([self.__positions[symbol] for symbol in df_dict], dtype=np.int64)
+        if len(rows):
+            self.labels[rows] = self.__labels(rows)
+        logger.info(f"Updated the latest state of {len(df_dict)} symbols with {n_bars} new bars.")
+        return n_bars
+
+    # Feed the new bars of the given tables, from their stored artifacts 'name' (e.g. 'raw')
+    def update_from_store(self, df_name_list: List[str], name: str = 'raw', store: ArtifactStore = None):
+        store = store or ArtifactStore()
+        return self.update_frames({df_name: store.read(store.artifact_path(df_name, name), ['greg_date', 'close_price'])
+                                   for df_name in df_name_list})
+
+    # Label codes of the given rows, with each symbol's own thresholds
+    def __labels(self, rows: np.ndarray):
+        fitted = dict(LABEL_THRESHOLDS, **{col: self.thresholds[rows, j] for j, col in enumerate(THRESHOLD_COLUMNS)})
+        df = pd.DataFrame(self.values[rows], columns=self.columns)
+        return np.asarray(assign_labels(df, fitted).codes, dtype=np.int8)
+
+    # Position of the last close within the Bollinger bands: 0 on the lower band, 1 on the upper band
+    def band_position(self):
+        close = self.closes[:, -1]
+        upper = self.values[:, self.columns.index('upper_bb')]
+        lower = self.values[:, self.columns.index('lower_bb')]
+        width = upper - lower
+        return np.where(width > 0, (close - lower) / np.where(width > 0, width, 1.0), np.nan)
+
+    # Filter and rank all the symbols in one pass over the index arrays. Filters left to None are not applied;
+    # 'macd_sign' is 1 or -1, 'labels' a list among LABELS. Rows sort on 'sort_by' (an indicator column, 'close'
+    # or 'band_position'), NaNs last, and only the first 'limit' are returned.
+    def screen(self, rsi_below: float = None, rsi_above: float = None, macd_sign: int = None, labels: List[str] = None,
+               band_below: float = None, band_above: float = None, sort_by: str = 'rsi', ascending: bool = True,
+               limit: int = None):
+        try:
+            rsi = self.values[:, self.columns.index('rsi')]
+            macd = self.values[:, self.columns.index('macd')]
+            band = self.band_position()
+            mask = self.days != _NO_DAY
+            if rsi_below is not None:
+                mask &= rsi < rsi_below
+            if rsi_above is not None:
+                mask &= rsi > rsi_above
+            if macd_sign is not None:
+                mask &= np.sign(macd) == np.sign(macd_sign)
+            if labels is not None:
+                mask &= np.isin(self.labels, [LABELS.index(label) for label in labels])
+            if band_below is not None:
+                mask &= band < band_below
+            if band_above is not None:
+                mask &= band > band_above
+
+            rows = np.flatnonzero(mask)
+            key = {'close': self.closes[:, -1], 'band_position': band}.get(sort_by)
+            key = (self.values[:, self.columns.index(sort_by)] if key is None else key)[rows]
+            key = np.where(np.isnan(key), np.inf, key if ascending else -key)
+            rows = rows[np.argsort(key, kind='stable')][:limit]
+
+            result = pd.DataFrame(self.values[rows], columns=self.columns)
+            result.insert(0, 'symbol', np.asarray(self.symbols, dtype=object)[rows])
+            result.insert(1, 'greg_date', self.days[rows].astype('datetime64[D]'))
+            result.insert(2, 'close', self.closes[rows, -1])
+            result['band_position'] = band[rows]
+            result['label'] = pd.Categorical.from_codes(self.labels[rows], categories=LABELS)
+            return result
+        except Exception as e:
+            raise CustomException(e)
+
+    def save(self, dir_path: str):
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+            for name in _ARRAYS:
+                np.save(os.path.join(dir_path, f'{name}.npy'), getattr(self, name))
+            with open(os.path.join(dir_path, 'spec.json'), "w") as f:
+                json.dump(dict(version=LATEST_STATE_VERSION, symbols=self.symbols, specs=self.specs), f)
+        except Exception as e:
+            raise CustomException(e)
+        logger.info(f"Stored the latest state of {len(self.symbols)} symbols into '{dir_path}'.")
+
+    # Load a stored index, its arrays memory-mapped
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True):
+        mmap_mode = 'r' if mmap else None
+        try:
+            with open(os.path.join(dir_path, 'spec.json'), "r") as f:
+                spec = json.load(f)
+            if spec['version'] != LATEST_STATE_VERSION:
+                raise ValueError(f"Unsupported latest state version {spec['version']} in '{dir_path}'.")
+            arrays = {name: np.load(os.path.join(dir_path, f'{name}.npy'), mmap_mode=mmap_mode) for name in _ARRAYS}
+            return cls(spec['symbols'], specs=spec['specs'], **arrays)
+        except Exception as e:
+            raise CustomException(e)
+
+
+# Update the stored index with the new bars of the given tables' raw data, building it on the first run
+def refresh_latest_state(df_name_list: List[str], store: ArtifactStore = None, dir_path: str = LATEST_STATE_DIR,
+                         n_closes: int = 50):
+    index = LatestStateIndex.load(dir_path) if os.path.exists(os.path.join(dir_path, 'spec.json')) \
+        else LatestStateIndex.empty(n_closes)
+    if index.update_from_store(df_name_list, 'raw', store):
+        index.save(dir_path)
+    return index
@@ -1,22 +1,108 @@
+import atexit
 import json
 import os
+import queue
 import sys
+import time
 import logging
 import logging.config
+import logging.handlers
+from contextlib import contextmanager
 from datetime import datetime
 
-os.makedirs('.logs', exist_ok=True)
+
+# Sample the INFO (and lower) records of each call site: the first 'burst' records pass, then one in 'every'.
+# Warnings and errors always pass. Keeps per-item messages (one per path, column or table) from flooding the logs.
+class SamplingFilter(logging.Filter):
+    def __init__(self, burst: int = 20, every: int = 100):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.__counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        # The decision is kept on the record, as the filter is shared by several handlers
+        if not hasattr(record, 'sampled'):
+            site = (record.pathname, record.lineno)
+            count = self.__counts.get(site, 0) + 1
+            self.__counts[site] = count
+            record.sampled = count <= self.burst or (count - self.burst) % self.every == 0
+        return record.sampled
+
+
+# Rotating file handler opened on the first record, creating its directory then: importing this module opens no file
+class LazyRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+# Logger config file, in the working directory or else next to the package
+_CONFIG_PATH = 'log_dict_config.json' if os.path.exists('log_dict_config.json') else \
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'log_dict_config.json')
 
 # Set the logger config, using dictConfig and loading the log_dict_config.json
-with open(file='log_dict_config.json') as f:
+with open(file=_CONFIG_PATH) as f:
     config_dict = json.load(f)
     config_dict["handlers"]["file"]["filename"] = f".logs/{datetime.now().strftime('%d-%B-%Y')}.log"
+    config_dict["handlers"]["events_file"]["filename"] = f".logs/events-{datetime.now().strftime('%d-%B-%Y')}.jsonl"
+    # This module is still being imported, so dictConfig cannot resolve the filter class by its dotted name
+    config_dict["filters"]["sampling"]["()"] = SamplingFilter
+    for handler in ["file", "events_file"]:
+        del config_dict["handlers"][handler]["class"]
+        config_dict["handlers"][handler]["()"] = LazyRotatingFileHandler
     logging.config.dictConfig(config_dict)
 
 
 # Instantiate logger object
 logger = logging.getLogger("main")
 
+# Structured event logger, one JSON object per line
+event_logger = logging.getLogger("events")
+
+
+# Non-blocking logging: the handlers of the 'main' and 'events' loggers run on a background listener thread, fed
+# through a queue. Disabled with LOG_ASYNC=0.
+_listeners = {}
+if os.getenv('LOG_ASYNC', '1') != '0':
+    for _logger in [logger, event_logger]:
+        _queue = queue.SimpleQueue()
+        _listeners[_logger] = logging.handlers.QueueListener(_queue, *_logger.handlers, respect_handler_level=True)
+        _logger.handlers = [logging.handlers.QueueHandler(_queue)]
+        _listeners[_logger].start()
+        atexit.register(_listeners[_logger].stop)
+
+
+# Forked worker processes have no listener thread, they write through the handlers directly
+def _restore_sync_handlers():
+    for _logger, listener in _listeners.items():
+        _logger.handlers = list(listener.handlers)
+
+os.register_at_fork(after_in_child=_restore_sync_handlers)
+
+
+# Record a structured event of a stage, e.g. its elapsed time, rows processed and bytes read or written
+def log_event(stage: str, table: str = None, **fields):
+    event = dict(time=datetime.now().isoformat(timespec='milliseconds'), pid=os.getpid(), stage=stage, table=table,
+                 **fields)
+    event_logger.info(json.dumps(event, default=str))
+
+
+# Time a stage and record it as an event; the yielded dict collects extra fields, such as 'rows' or 'bytes_read'
+@contextmanager
+def stage_timer(stage: str, table: str = None, **fields):
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield fields
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        log_event(stage, table, elapsed=round(time.perf_counter() - start, 6), status=status, **fields)
+
 
 # Override the excepthook, for uncaught exceptions
 def handle_exception(exc_type, exc_value, exc_traceback):
@@ -25,4 +111,4 @@ def handle_exception(exc_type, exc_value, exc_traceback):
         return
     logger.exception("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
 
-sys.excepthook = handle_exception
\ No newline at end of file
+sys.excepthook = handle_exception
@@ -0,0 +1,156 @@
+from src.exceptions import CustomException
+from src.log import logger
+from src.artifact_store import ArtifactStore
+from src.dtypes import feature_columns
+from src.stage_cache import StageCache
+import numpy as np
+import pandas as pd
+import json
+import os
+from typing import List
+
+# Version of the on-disk market context layout
+MARKET_CONTEXT_VERSION = 1
+
+# Market-wide tables, joined onto the symbol tables instead of being transformed themselves
+INDEX_TABLE = 'prd_exchange_indexvalues'
+NEWS_TABLE = 'prd_exchange_news'
+MARKET_TABLES = [INDEX_TABLE, NEWS_TABLE]
+
+# Rolling news count windows, in calendar days
+NEWS_WINDOWS = [1, 7, 30]
+
+
+# Days since the epoch of a date column, as int64
+def _days(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+# Market context of the symbol rows: the latest exchange index values as of each date, and the number of news in the
+# trailing windows up to each date. Built once from the two market tables into sorted date arrays, then joined onto
+# any number of symbol rows with binary searches: O(n log m) time and O(n) memory per join, without any merge.
+class MarketContext:
+    def __init__(self, index_days: np.ndarray, index_values: np.ndarray, index_columns: List[str],
+                 news_days: np.ndarray, windows: List[int] = None):
+        self.index_days = np.asarray(index_days, dtype=np.int64)
+        self.index_values = np.asarray(index_values, dtype=np.float64).reshape(len(self.index_days), len(index_columns))
+        self.index_columns = list(index_columns)
+        self.news_days = np.asarray(news_days, dtype=np.int64)
+        self.windows = list(windows or NEWS_WINDOWS)
+
+    # Build the context from the index values and news tables (either may be None). With a 'key_col', the index
+    # table holds several indices per date and every (index, value column) pair becomes its own context column.
+    @classmethod
+    def from_frames(cls, index_df: pd.DataFrame = None, news_df: pd.DataFrame = None, key_col: str = None,
+                    date_col: str = 'greg_date', windows: List[int] = None):
+        try:
+            if index_df is not None and len(index_df):
+                value_cols = [col for col in feature_columns(index_df)[0] if col != key_col]
+                index_df = index_df.sort_values(date_col, kind='stable')
+                if key_col is None:
+                    wide = index_df.groupby(date_col, sort=True)[value_cols].last()
+                    columns = [f"index_{col}" for col in value_cols]
+                else:
+                    wide = index_df.pivot_table(index=date_col, columns=key_col, values=value_cols, aggfunc='last',
+                                                observed=True).sort_index().ffill()
+                    columns = [f"index_{key}_{col}" for col, key in wide.columns]
+                index_days, index_values = _days(wide.index.to_numpy()), wide.to_numpy(dtype=np.float64)
+            else:
+                index_days, index_values, columns = np.empty(0, dtype=np.int64), np.empty((0, 0)), []
+
+            news_days = np.sort(_days(news_df[date_col].to_numpy())) if news_df is not None \
+                else np.empty(0, dtype=np.int64)
+        except Exception as e:
+            raise CustomException(e)
+
+        logger.info(f"Built the market context of {len(index_days)} index dates and {len(news_days)} news.")
+        return cls(index_days, index_values, columns, news_days, windows)
+
+    @property
+    def columns(self):
+        return self.index_columns + [f"news_count_{w}d" for w in self.windows]
+
+    # Context values of the given dates, as a 2D array in the order of 'columns'. Index values are those of the
+    # latest index date on or before each date (NaN before the first one).
+    def join(self, dates):
+        days = _days(dates)
+        values = np.full((len(days), len(self.columns)), np.nan)
+        try:
+            if len(self.index_days):
+                position = np.searchsorted(self.index_days, days, side='right') - 1
+                known = position >= 0
+                values[known, :len(self.index_columns)] = self.index_values[position[known]]
+
+            right = np.searchsorted(self.news_days, days, side='right')
+            for j, window in enumerate(self.windows, start=len(self.index_columns)):
+                values[:, j] = right - np.searchsorted(self.news_days, days - window, side='right')
+            return values
+        except Exception as e:
+            raise CustomException(e)
+
+    # Return the dataframe with the context columns added
+    def add_context(self, df: pd.DataFrame, date_col: str = 'greg_date'):
+        context_df = pd.DataFrame(self.join(df[date_col].to_numpy()), columns=self.columns, index=df.index)
+        return pd.concat([df.drop(columns=[c for c in self.columns if c in df.columns]), context_df], axis=1)
+
+    def save(self, dir_path: str):
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+            np.save(os.path.join(dir_path, 'index_days.npy'), self.index_days)
+            np.save(os.path.join(dir_path, 'index_values.npy'), self.index_values)
+            np.save(os.path.join(dir_path, 'news_days.npy'), self.news_days)
+            with open(os.path.join(dir_path, 'spec.json'), "w") as f:
+                json.dump(dict(version=MARKET_CONTEXT_VERSION, index_columns=self.index_columns,
+                               windows=self.windows), f)
+            logger.info(f"Stored the market context into '{dir_path}'.")
+        except Exception as e:
+            raise CustomException(e)
+
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True):
+        mmap_mode = 'r' if mmap else None
+        try:
+            with open(os.path.join(dir_path, 'spec.json'), "r") as f:
+                spec = json.load(f)
+            if spec['version'] != MARKET_CONTEXT_VERSION:
+                raise ValueError(f"Unsupported market context version {spec['version']} in '{dir_path}'.")
+            return cls(np.load(os.path.join(dir_path, 'index_days.npy'), mmap_mode=mmap_mode),
+                       np.load(os.path.join(dir_path, 'index_values.npy'), mmap_mode=mmap_mode),
+                       spec['index_columns'],
+                       np.load(os.path.join(dir_path, 'news_days.npy'), mmap_mode=mmap_mode),
+                       spec['windows'])
+        except Exception as e:
+            raise CustomException(e)
+
+
+# Files of a stored market context, as inputs of the stage cache keys that depend on it
+def context_files(dir_path: str = None):
+    if dir_path is None:
+        return []
+    return [os.path.join(dir_path, f) for f in ['spec.json', 'index_days.npy', 'index_values.npy', 'news_days.npy']]
+
+
+# Load a stored market context, None without one
+def load_market_context(dir_path: str = None, mmap: bool = True):
+    return MarketContext.load(dir_path, mmap) if dir_path is not None else None
+
+
+# Build the market context from the stored raw data of the market tables into 'dir_path', once per change of that
+# data (through the stage cache). Returns 'dir_path', or None when neither market table has been ingested.
+def build_market_context(store: ArtifactStore = None, cache: StageCache = None,
+                         dir_path: str = os.path.join('.artifacts', 'market_context'), key_col: str = None):
+    store = store or ArtifactStore()
+    cache = cache or StageCache()
+    raw_paths = [store.artifact_path(table, 'raw') for table in MARKET_TABLES]
+    if not any(os.path.exists(path) for path in raw_paths):
+        logger.info("No market table ingested, the symbols get no market context.")
+        return None
+
+    cache_key = cache.make_key('market_context', *raw_paths, key_col, NEWS_WINDOWS)
+    if cache.fetch(cache_key, [dir_path]):
+        return dir_path
+
+    index_df, news_df = [store.read(path) if os.path.exists(path) else None for path in raw_paths]
+    MarketContext.from_frames(index_df, news_df, key_col=key_col).save(dir_path)
+    cache.store(cache_key, [dir_path])
+    return dir_path
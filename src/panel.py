@@ -0,0 +1,197 @@
+from src.exceptions import CustomException
+from src.log import logger
+from src.artifact_store import ArtifactStore
+from src.dtypes import concat_frames
+from src.indicators import compute_indicators, indicator_columns
+from src.utils import assign_labels, LABEL_THRESHOLDS
+import numpy as np
+import pandas as pd
+import json
+import os
+from typing import List
+
+
+# Row offsets of consecutive segments of the given lengths: rows offsets[i]:offsets[i + 1] make the i-th segment
+def segment_offsets(lengths):
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64)
+
+
+# Segment number of every row
+def segment_ids(offsets: np.ndarray):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+# Per-segment sums of the columns of a 2D array (or of a 1D array)
+def segmented_sum(values: np.ndarray, offsets: np.ndarray):
+    seg = segment_ids(offsets)
+    n = len(offsets) - 1
+    if values.ndim == 1:
+        return np.bincount(seg, weights=values, minlength=n)
+    return np.stack([np.bincount(seg, weights=values[:, j], minlength=n) for j in range(values.shape[1])], axis=1)
+
+
+# Per-segment quantile of a 1D array, ignoring NaNs (linear interpolation, as np.nanquantile); NaN for the segments
+# without any value. One sort of the whole array instead of one call per segment.
+def segmented_quantile(values: np.ndarray, offsets: np.ndarray, q: float):
+    values = np.asarray(values, dtype=np.float64)
+    seg = segment_ids(offsets)
+    # NaNs sort last within their segment
+    sorted_values = values[np.lexsort((values, seg))]
+    counts = np.bincount(seg, weights=~np.isnan(values), minlength=len(offsets) - 1).astype(np.int64)
+
+    position = q * np.maximum(counts - 1, 0)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    last = max(len(values) - 1, 0)
+    v_low = sorted_values[np.minimum(offsets[:-1] + low, last)] if len(values) else np.zeros(len(counts))
+    v_high = sorted_values[np.minimum(offsets[:-1] + high, last)] if len(values) else np.zeros(len(counts))
+    result = v_low + (v_high - v_low) * (position - low)
+    result[counts == 0] = np.nan
+    return result
+
+
+# Panel of all the symbols: a single columnar dataframe sorted by (symbol, date), with an offset index giving the
+# row range of each symbol. Per-symbol views are zero-copy slices, and the indicators, labels and splits run as
+# segmented operations over the whole panel instead of one dataframe per table.
+class Panel:
+    def __init__(self, data: pd.DataFrame, symbols: List[str], offsets: np.ndarray, date_col: str = 'greg_date'):
+        self.data = data
+        self.symbols = list(symbols)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.date_col = date_col
+        self.__positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    # Build the panel from a dictionary of per-symbol dataframes, each sorted by date
+    @classmethod
+    def from_frames(cls, df_dict: dict, date_col: str = 'greg_date'):
+        try:
+            symbols = list(df_dict)
+            frames = [df_dict[s].sort_values(date_col, kind='stable', ignore_index=True) for s in symbols]
+            offsets = segment_offsets([len(df) for df in frames])
+            data = concat_frames(frames) if frames else pd.DataFrame()
+            logger.info(f"Built a panel of {len(symbols)} symbols and {len(data)} rows.")
+            return cls(data, symbols, offsets, date_col)
+        except Exception as e:
+            raise CustomException(e)
+
+    # Build the panel from the stored artifacts 'name' (e.g. 'raw') of the given tables
+    @classmethod
+    def from_store(cls, df_name_list: List[str], name: str = 'raw', store: ArtifactStore = None,
+                   date_col: str = 'greg_date'):
+        store = store or ArtifactStore()
+        return cls.from_frames({df_name: store.read(store.artifact_path(df_name, name)) for df_name in df_name_list},
+                               date_col)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def segment_ids(self):
+        return segment_ids(self.offsets)
+
+    # Row range of a symbol
+    def bounds(self, symbol: str):
+        i = self.__positions[symbol]
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    # Rows of a symbol, as a slice of the panel (no copy)
+    def view(self, symbol: str):
+        start, end = self.bounds(symbol)
+        return self.data.iloc[start:end]
+
+    # Values of a column, over the whole panel or one symbol, as a NumPy view
+    def column(self, col: str, symbol: str = None):
+        values = self.data[col].to_numpy()
+        if symbol is None:
+            return values
+        start, end = self.bounds(symbol)
+        return values[start:end]
+
+    # Per-symbol views, in place of a dictionary of tables
+    def frames(self):
+        return {symbol: self.view(symbol) for symbol in self.symbols}
+
+    # Add the indicator columns, each symbol's series computed on its own segment into a single panel-wide array
+    def add_indicators(self, specs: List[dict] = None, backend: str = None, price_col: str = 'close_price'):
+        close = self.column(price_col).astype(np.float64, copy=False)
+        columns = indicator_columns(specs)
+        values = np.empty((len(close), len(columns)), dtype=np.float64)
+        try:
+            for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+                values[start:end] = compute_indicators(close[start:end], specs, backend)[1]
+        except Exception as e:
+            raise CustomException(e)
+
+        indicators_df = pd.DataFrame(values, columns=columns, index=self.data.index)
+        self.data = pd.concat([self.data.drop(columns=[c for c in columns if c in self.data.columns]), indicators_df],
+                              axis=1)
+        logger.info(f"Indicator columns {columns} created for the {len(self.symbols)} symbols of the panel.")
+        return self
+
+    # Chronological split of every symbol: the latest 'test_size' of each segment is test data. Returns the boolean
+    # train mask of the panel rows.
+    def train_mask(self, test_size: float = 0.2):
+        lengths = self.lengths
+        cuts = lengths - np.ceil(lengths * test_size).astype(np.int64)
+        position = np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], lengths)
+        return position < np.repeat(cuts, lengths)
+
+    # Train and test panels, from a train mask of the rows. The rows are gathered once, train rows then test rows
+    # (both in (symbol, date) order), and each panel is a slice of that copy; its offsets come from the per-symbol
+    # count of its rows.
+    def split(self, mask: np.ndarray):
+        mask = np.asarray(mask, dtype=bool)
+        train_lengths = segmented_sum(mask.astype(np.float64), self.offsets).astype(np.int64)
+        n_train = int(train_lengths.sum())
+        try:
+            data = self.data.take(np.concatenate([np.flatnonzero(mask), np.flatnonzero(~mask)]))
+            data.index = pd.RangeIndex(len(data))
+            train = data.iloc[:n_train]
+            test = data.iloc[n_train:].set_axis(pd.RangeIndex(len(data) - n_train), axis=0)
+        except Exception as e:
+            raise CustomException(e)
+        return [Panel(train, self.symbols, segment_offsets(train_lengths), self.date_col),
+                Panel(test, self.symbols, segment_offsets(self.lengths - train_lengths), self.date_col)]
+
+    # Add the label column, the Bollinger band thresholds being fitted per symbol over its train rows (all rows
+    # without a mask), then broadcast over the panel for a single vectorized labelling pass
+    def add_label(self, mask: np.ndarray = None, thresholds: dict = None):
+        thresholds = {**LABEL_THRESHOLDS, **(thresholds or {})}
+        lengths = self.lengths
+        fitted = dict(thresholds)
+        try:
+            for col in ['upper_bb', 'lower_bb']:
+                values = self.column(col).astype(np.float64)
+                if mask is not None:
+                    values = np.where(mask, values, np.nan)
+                for level, quantile in [('high', thresholds['high_quantile']), ('low', thresholds['low_quantile'])]:
+                    fitted[f"{col}_{level}"] = np.repeat(segmented_quantile(values, self.offsets, quantile), lengths)
+            self.data['label'] = assign_labels(self.data, fitted)
+        except Exception as e:
+            raise CustomException(e)
+
+        logger.info(f"Added label column, wrt indicators for the {len(self.symbols)} symbols of the panel.")
+        return self
+
+    # Store the panel data as an artifact, with its offset index in a JSON file next to it
+    def save(self, dir_path: str, store: ArtifactStore = None):
+        store = store or ArtifactStore()
+        store.write(self.data, os.path.join(dir_path, f"data.{store.extension}"))
+        try:
+            with open(os.path.join(dir_path, 'index.json'), "w") as f:
+                json.dump(dict(symbols=self.symbols, offsets=self.offsets.tolist(), date_col=self.date_col), f)
+            logger.info(f"Stored the panel index into '{dir_path}'.")
+        except Exception as e:
+            raise CustomException(e)
+
+    @classmethod
+    def load(cls, dir_path: str, store: ArtifactStore = None):
+        store = store or ArtifactStore()
+        try:
+            with open(os.path.join(dir_path, 'index.json'), "r") as f:
+                index = json.load(f)
+        except Exception as e:
+            raise CustomException(e)
+        data = store.read(os.path.join(dir_path, f"data.{store.extension}"))
+        return cls(data, index['symbols'], index['offsets'], index['date_col'])
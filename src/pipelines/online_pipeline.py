@@ -0,0 +1,82 @@
+from src.log import logger
+from src.exceptions import CustomException
+from src.indicators import StreamingIndicators
+from src.market_context import MarketContext
+from src.pipelines.preprocessor_state import FittedPreprocessor, MISSING_CATEGORIES
+
+import math
+import numpy as np
+import pandas as pd
+from typing import List
+
+
+# Online transform of new bars for a single symbol. The indicator state (RSI/MACD/Bollinger) is carried from one
+# update to the next instead of being recomputed over the history, and the fitted preprocessor parameters are
+# precompiled into flat arrays and lookup tables, so a bar is transformed without pandas or sklearn. With the market
+# context the preprocessor was fitted with, each bar gets the same as-of context columns as the batch rows.
+class OnlineTransformer:
+    def __init__(self, preprocessor: FittedPreprocessor, indicators: StreamingIndicators = None,
+                 price_col: str = 'close_price', market_context: MarketContext = None, date_col: str = 'greg_date'):
+        self.preprocessor = preprocessor
+        self.indicators = indicators or StreamingIndicators()
+        self.price_col = price_col
+        self.market_context = market_context
+        self.date_col = date_col
+        self.last_indicators = dict.fromkeys(self.indicators.columns, np.nan)
+
+        n_num = len(preprocessor.num_feats)
+        self.__medians = preprocessor.medians.tolist()
+        self.__means = np.asarray(preprocessor.means)
+        self.__inv_scales = 1.0 / np.asarray(preprocessor.scales)
+        self.__width = n_num + sum(len(v) for v in preprocessor.vocabularies)
+
+        # Per categorical feature: the output column of each category and its one-hot value
+        self.__cat_lookups = []
+        offset = n_num
+        for col, vocabulary, most_frequent, scale in zip(preprocessor.cat_feats, preprocessor.vocabularies,
+                                                         preprocessor.most_frequent, preprocessor.cat_scales):
+            lookup = {c: (offset + i, float(1.0 / s)) for i, (c, s) in enumerate(zip(vocabulary, scale))}
+            self.__cat_lookups.append((col, lookup, most_frequent))
+            offset += len(vocabulary)
+
+    # Warm the indicator state up over the price history of the symbol
+    @classmethod
+    def from_history(cls, preprocessor: FittedPreprocessor, history: pd.DataFrame, price_col: str = 'close_price',
+                     market_context: MarketContext = None, date_col: str = 'greg_date'):
+        transformer = cls(preprocessor, price_col=price_col, market_context=market_context, date_col=date_col)
+        columns, values = transformer.indicators.update(history[price_col].to_numpy())
+        if len(values):
+            transformer.last_indicators = dict(zip(columns, values[-1].tolist()))
+        logger.info(f"Warmed the online transformer up over {len(history)} bars.")
+        return transformer
+
+    # Transform new bars (dicts of column values, oldest first) into a float32 feature matrix, updating the
+    # indicator state with their prices
+    def transform_bars(self, bars: List[dict]):
+        try:
+            columns, values = self.indicators.update(np.array([bar[self.price_col] for bar in bars], dtype=np.float64))
+            if len(values):
+                self.last_indicators = dict(zip(columns, values[-1].tolist()))
+            if self.market_context is not None:
+                context = self.market_context.join([bar[self.date_col] for bar in bars]).tolist()
+                bars = [{**bar, **dict(zip(self.market_context.columns, row))} for bar, row in zip(bars, context)]
+
+            out = np.zeros((len(bars), self.__width), dtype=np.float32)
+            num_feats = self.preprocessor.num_feats
+            for i, bar in enumerate(bars):
+                num = [bar.get(col, math.nan) for col in num_feats]
+                num = [m if v is None or v != v else v for v, m in zip(num, self.__medians)]
+                out[i, :len(num)] = (np.array(num, dtype=np.float64) - self.__means) * self.__inv_scales
+
+                for col, lookup, most_frequent in self.__cat_lookups:
+                    value = str(bar.get(col))
+                    hit = lookup.get(most_frequent if value in MISSING_CATEGORIES else value)
+                    if hit is not None:
+                        out[i, hit[0]] = hit[1]
+
+            return out
+        except Exception as e:
+            raise CustomException(e)
+
+    def transform_bar(self, bar: dict):
+        return self.transform_bars([bar])[0]
@@ -0,0 +1,113 @@
+from src.log import logger
+from src.exceptions import CustomException
+
+from src.panel import Panel, segment_ids, segment_offsets, segmented_quantile, segmented_sum
+from src.pipelines.preprocessor_state import FittedPreprocessor, as_str
+
+import numpy as np
+import pandas as pd
+from typing import List
+
+
+# Scale of a standardized column, 1 where the column is constant (as sklearn's StandardScaler)
+def _safe_scale(std: np.ndarray):
+    return np.where(std < 10 * np.finfo(np.float64).eps, 1.0, std)
+
+
+# Category codes of a column over a vocabulary: -1 for missing and unseen values
+def _category_codes(series: pd.Series, vocabulary: List[str]):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.set_categories(vocabulary).cat.codes.to_numpy()
+    return pd.Categorical(np.where(series.isna(), None, as_str(series)), categories=vocabulary).codes
+
+
+# Preprocessor of a whole panel, fitted per symbol in one segmented pass: for every symbol, the same state as the
+# ColumnTransformer of its table (numerical median imputation and standardization, categorical most-frequent
+# imputation, one-hot encoding and scaling). All the symbols share category vocabularies, of the values in the fitted
+# rows of the panel, so that the feature matrix has the same columns for every row.
+class PanelPreprocessor:
+    def __init__(self, num_feats: List[str], cat_feats: List[str]):
+        self.num_feats = list(num_feats)
+        self.cat_feats = list(cat_feats)
+        self.symbols = []
+        self.fitted = False
+
+    # Fit over the rows of the panel selected by 'mask' (e.g. the train rows), all the rows without a mask
+    def fit(self, panel: Panel, mask: np.ndarray = None):
+        try:
+            rows = np.ones(len(panel.data), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+            offsets = segment_offsets(segmented_sum(rows.astype(np.float64), panel.offsets).astype(np.int64))
+            seg = segment_ids(offsets)
+            n = np.maximum(np.diff(offsets), 1)[:, None]
+            data = panel.data[rows]
+
+            X = data[self.num_feats].to_numpy(dtype=np.float64).reshape(len(data), len(self.num_feats))
+            self.medians = np.stack([segmented_quantile(X[:, j], offsets, 0.5) for j in range(X.shape[1])], axis=1) \
+                if self.num_feats else np.empty((len(panel.symbols), 0))
+            X = np.where(np.isnan(X), self.medians[seg], X)
+            self.means = segmented_sum(X, offsets) / n if self.num_feats else self.medians.copy()
+            variances = segmented_sum((X - self.means[seg]) ** 2, offsets) / n if self.num_feats else self.medians.copy()
+            self.scales = _safe_scale(np.sqrt(variances))
+
+            self.vocabularies, self.most_frequent, self.cat_scales = [], [], []
+            for col in self.cat_feats:
+                series = data[col]
+                vocabulary = [str(c) for c in series.cat.remove_unused_categories().cat.categories] \
+                    if isinstance(series.dtype, pd.CategoricalDtype) else sorted(set(as_str(series.dropna())))
+                codes = _category_codes(data[col], vocabulary)
+                size = len(vocabulary)
+
+                counts = np.bincount(seg[codes >= 0] * size + codes[codes >= 0],
+                                     minlength=len(panel.symbols) * size).reshape(len(panel.symbols), size)
+                most_frequent = counts.argmax(axis=1)
+                codes = np.where(codes < 0, most_frequent[seg], codes)
+                counts = np.bincount(seg * size + codes, minlength=len(panel.symbols) * size).reshape(-1, size)
+                p = counts / n
+                self.vocabularies.append(vocabulary)
+                self.most_frequent.append(most_frequent)
+                self.cat_scales.append(_safe_scale(np.sqrt(p * (1 - p))))
+        except Exception as e:
+            raise CustomException(e)
+
+        self.symbols = list(panel.symbols)
+        self.fitted = True
+        logger.info(f"Fitted the panel preprocessor over {rows.sum()} rows of {len(self.symbols)} symbols.")
+        return self
+
+    @property
+    def feature_names(self):
+        return [f"num_pipeline__{c}" for c in self.num_feats] + \
+               [f"cat_pipeline__{c}_{v}" for c, vocab in zip(self.cat_feats, self.vocabularies) for v in vocab]
+
+    # Transform a panel of the same symbols into a float32 feature matrix, each row with its own symbol's state;
+    # unseen categories encode as all zeros
+    def transform(self, panel: Panel):
+        if panel.symbols != self.symbols:
+            raise ValueError("The panel symbols differ from the fitted ones.")
+        try:
+            seg = panel.segment_ids
+            n_rows = len(panel.data)
+            X = panel.data[self.num_feats].to_numpy(dtype=np.float64).reshape(n_rows, len(self.num_feats))
+            X = np.where(np.isnan(X), self.medians[seg], X)
+            out = np.zeros((n_rows, len(self.feature_names)), dtype=np.float32)
+            out[:, :len(self.num_feats)] = (X - self.means[seg]) / self.scales[seg]
+
+            offset = len(self.num_feats)
+            for col, vocabulary, most_frequent, scales in zip(self.cat_feats, self.vocabularies, self.most_frequent,
+                                                              self.cat_scales):
+                series = panel.data[col]
+                codes = np.where(series.isna().to_numpy(), most_frequent[seg], _category_codes(series, vocabulary))
+                known = np.flatnonzero(codes >= 0)
+                out[known, offset + codes[known]] = 1.0 / scales[seg[known], codes[known]]
+                offset += len(vocabulary)
+
+            return out
+        except Exception as e:
+            raise CustomException(e)
+
+    # Fitted state of one symbol, e.g. for the online transformer of that symbol
+    def for_symbol(self, symbol: str):
+        i = self.symbols.index(symbol)
+        return FittedPreprocessor(self.num_feats, self.cat_feats, self.medians[i], self.means[i], self.scales[i],
+                                  self.vocabularies, [vocab[mf[i]] for vocab, mf in zip(self.vocabularies, self.most_frequent)],
+                                  [scales[i] for scales in self.cat_scales])
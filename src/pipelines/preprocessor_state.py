@@ -0,0 +1,131 @@
+from src.log import logger
+from src.exceptions import CustomException
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import List
+
+# Version of the on-disk preprocessor state layout
+PREPROCESSOR_STATE_VERSION = 1
+
+# String forms of a missing category value
+MISSING_CATEGORIES = ['nan', 'None', '<NA>']
+
+
+# Values of a column as strings, missing values included ('nan', 'None')
+def as_str(series: pd.Series):
+    return np.asarray(series.astype(object)).astype(str)
+
+
+# Learned state of a fitted preprocessor (numerical imputation and scaling, categorical imputation, one-hot encoding
+# and scaling), applied with plain NumPy operations. Saved as a small JSON spec plus a single memory-mappable array
+# file, instead of a pickle.
+class FittedPreprocessor:
+    def __init__(self, num_feats: List[str], cat_feats: List[str], medians, means, scales,
+                 vocabularies: List[List[str]], most_frequent: List[str], cat_scales: List[np.ndarray]):
+        self.num_feats = list(num_feats)
+        self.cat_feats = list(cat_feats)
+        self.medians = np.asarray(medians, dtype=np.float64)
+        self.means = np.asarray(means, dtype=np.float64)
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.vocabularies = [list(v) for v in vocabularies]
+        self.most_frequent = list(most_frequent)
+        self.cat_scales = [np.asarray(s, dtype=np.float64) for s in cat_scales]
+        self.feature_names = [f"num_pipeline__{c}" for c in self.num_feats] + \
+                             [f"cat_pipeline__{c}_{v}" for c, vocab in zip(self.cat_feats, self.vocabularies) for v in vocab]
+
+    # Extract the learned state of a fitted ColumnTransformer, as built by the transformation pipeline
+    @classmethod
+    def from_column_transformer(cls, column_transformer):
+        try:
+            transformers = {name: (pipeline, cols) for name, pipeline, cols in column_transformer.transformers_}
+            num_pipeline, num_feats = transformers.get('num_pipeline', (None, []))
+            cat_pipeline, cat_feats = transformers.get('cat_pipeline', (None, []))
+
+            if len(num_feats):
+                medians = num_pipeline.named_steps['imputer'].statistics_
+                means = num_pipeline.named_steps['scalar'].mean_
+                scales = num_pipeline.named_steps['scalar'].scale_
+            else:
+                medians = means = scales = []
+
+            vocabularies, most_frequent, cat_scales = [], [], []
+            if len(cat_feats):
+                encoder_scales = cat_pipeline.named_steps['scalar'].scale_
+                offset = 0
+                for value, categories in zip(cat_pipeline.named_steps['imputer'].statistics_,
+                                             cat_pipeline.named_steps['one_hot_encoder'].categories_):
+                    vocabularies.append([str(c) for c in categories])
+                    most_frequent.append(str(value))
+                    cat_scales.append(encoder_scales[offset:offset + len(categories)])
+                    offset += len(categories)
+
+            return cls(num_feats, cat_feats, medians, means, scales, vocabularies, most_frequent, cat_scales)
+        except Exception as e:
+            raise CustomException(e)
+
+    # Transform a dataframe into a float32 feature matrix; unseen categories encode as all zeros
+    def transform(self, df: pd.DataFrame):
+        try:
+            X = df[self.num_feats].to_numpy(dtype=np.float64)
+            X = np.where(np.isnan(X), self.medians, X)
+            blocks = [((X - self.means) / self.scales).astype(np.float32)]
+
+            for col, vocabulary, most_frequent, scale in zip(self.cat_feats, self.vocabularies, self.most_frequent,
+                                                             self.cat_scales):
+                values = as_str(df[col])
+                values = np.where(np.isin(values, MISSING_CATEGORIES), most_frequent, values)
+                codes = pd.Categorical(values, categories=vocabulary).codes
+                one_hot = np.zeros((len(df), len(vocabulary)), dtype=np.float32)
+                known = codes >= 0
+                one_hot[np.flatnonzero(known), codes[known]] = 1.0
+                blocks.append((one_hot / scale).astype(np.float32))
+
+            return np.hstack(blocks)
+        except Exception as e:
+            raise CustomException(e)
+
+    def get_feature_names_out(self):
+        return np.asarray(self.feature_names, dtype=object)
+
+    def save(self, dir_path: str):
+        arrays = [self.medians, self.means, self.scales] + self.cat_scales
+        state = np.concatenate(arrays) if arrays else np.empty(0)
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+            np.save(os.path.join(dir_path, 'state.npy'), state)
+            spec = dict(version=PREPROCESSOR_STATE_VERSION, num_feats=self.num_feats, cat_feats=self.cat_feats,
+                        vocabularies=self.vocabularies, most_frequent=self.most_frequent,
+                        state_size=int(state.size), state_sha256=hashlib.sha256(state.tobytes()).hexdigest())
+            with open(os.path.join(dir_path, 'spec.json'), "w") as f:
+                json.dump(spec, f)
+            logger.info(f"Stored the preprocessor state into '{dir_path}'.")
+        except Exception as e:
+            raise CustomException(e)
+
+    # Rebuild a fitted preprocessor from its saved state, checking its version, size and (optionally) checksum
+    @classmethod
+    def load(cls, dir_path: str, mmap: bool = True, verify: bool = True):
+        try:
+            with open(os.path.join(dir_path, 'spec.json'), "r") as f:
+                spec = json.load(f)
+            if spec['version'] != PREPROCESSOR_STATE_VERSION:
+                raise ValueError(f"Unsupported preprocessor state version {spec['version']} in '{dir_path}'.")
+
+            state = np.load(os.path.join(dir_path, 'state.npy'), mmap_mode='r' if mmap else None)
+            n_num = len(spec['num_feats'])
+            if state.size != spec['state_size'] or state.size != 3 * n_num + sum(map(len, spec['vocabularies'])):
+                raise ValueError(f"Preprocessor state in '{dir_path}' does not match its spec.")
+            if verify and hashlib.sha256(np.ascontiguousarray(state).tobytes()).hexdigest() != spec['state_sha256']:
+                raise ValueError(f"Preprocessor state in '{dir_path}' failed its checksum.")
+
+            bounds = np.cumsum([0, n_num, n_num, n_num] + [len(v) for v in spec['vocabularies']])
+            parts = [state[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+            logger.info(f"Loaded the preprocessor state from '{dir_path}'.")
+            return cls(spec['num_feats'], spec['cat_feats'], parts[0], parts[1], parts[2],
+                       spec['vocabularies'], spec['most_frequent'], parts[3:])
+        except Exception as e:
+            raise CustomException(e)
@@ -0,0 +1,119 @@
+from src.log import logger
+from src.exceptions import CustomException
+
+from src.pipelines.preprocessor_state import FittedPreprocessor, as_str, MISSING_CATEGORIES
+
+import numpy as np
+import pandas as pd
+from typing import List
+
+
+# Fixed-size uniform sample of a stream of values (reservoir sampling), used to approximate quantiles
+class Reservoir:
+    def __init__(self, capacity: int = 10_000, seed: int = 102):
+        self.capacity = capacity
+        self.values = np.empty(0)
+        self.seen = 0
+        self.__rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        free = self.capacity - len(self.values)
+        if free > 0:
+            self.values = np.concatenate([self.values, values[:free]])
+            self.seen += len(values[:free])
+            values = values[free:]
+        if len(values) == 0:
+            return
+
+        # Item k of the stream (1-based) replaces a random slot with probability capacity / k
+        k = self.seen + np.arange(1, len(values) + 1)
+        keep = self.__rng.random(len(values)) < self.capacity / k
+        self.values[self.__rng.integers(0, self.capacity, keep.sum())] = values[keep]
+        self.seen += len(values)
+
+    def quantile(self, q: float):
+        return float(np.quantile(self.values, q)) if len(self.values) else np.nan
+
+
+# Preprocessor fitted incrementally, chunk by chunk, mirroring the batch ColumnTransformer of a table:
+# numerical features are median-imputed (approximated over a reservoir sample) and standardized (running mean and
+# variance), categorical features are most-frequent-imputed, one-hot encoded over the vocabulary seen so far and
+# scaled to unit variance.
+class StreamingPreprocessor:
+    def __init__(self, num_feats: List[str], cat_feats: List[str], reservoir_capacity: int = 10_000):
+        self.num_feats = num_feats
+        self.cat_feats = cat_feats
+        self.__count = np.zeros(len(num_feats))
+        self.__mean = np.zeros(len(num_feats))
+        self.__m2 = np.zeros(len(num_feats))
+        self.__missing = np.zeros(len(num_feats))
+        self.__reservoirs = [Reservoir(reservoir_capacity) for _ in num_feats]
+        self.__category_counts = [{} for _ in cat_feats]
+        self.fitted = False
+
+    def partial_fit(self, df: pd.DataFrame):
+        try:
+            X = df[self.num_feats].to_numpy(dtype=np.float64)
+            for j in range(X.shape[1]):
+                col = X[:, j]
+                valid = col[~np.isnan(col)]
+                self.__missing[j] += len(col) - len(valid)
+                self.__reservoirs[j].update(valid)
+                if len(valid) == 0:
+                    continue
+
+                # Chan et al. parallel update of the running mean and sum of squared deviations
+                n, mean, m2 = len(valid), valid.mean(), ((valid - valid.mean()) ** 2).sum()
+                total = self.__count[j] + n
+                delta = mean - self.__mean[j]
+                self.__mean[j] += delta * n / total
+                self.__m2[j] += m2 + delta ** 2 * self.__count[j] * n / total
+                self.__count[j] = total
+
+            for j, col in enumerate(self.cat_feats):
+                for category, count in zip(*np.unique(as_str(df[col]), return_counts=True)):
+                    self.__category_counts[j][category] = self.__category_counts[j].get(category, 0) + int(count)
+        except Exception as e:
+            raise CustomException(e)
+
+        self.fitted = False
+        return self
+
+    # Turn the accumulated statistics into the imputation, scaling and encoding parameters
+    def finalize(self):
+        medians = np.array([r.quantile(0.5) for r in self.__reservoirs])
+
+        # Statistics after imputation: the missing values join as a group of values equal to the median
+        n, k = self.__count, self.__missing
+        total = np.maximum(n + k, 1)
+        means = np.where(n > 0, (n * self.__mean + k * medians) / total, 0.0)
+        m2 = self.__m2 + np.where(n > 0, n * k / total * (self.__mean - medians) ** 2, 0.0)
+        scales = np.sqrt(m2 / total)
+
+        vocabularies, most_frequent, cat_scales = [], [], []
+        for counts in self.__category_counts:
+            missing = sum(n for c, n in counts.items() if c in MISSING_CATEGORIES)
+            counts = {c: n for c, n in counts.items() if c not in MISSING_CATEGORIES} or {'nan': 0}
+            vocabulary = sorted(counts)
+            most_frequent.append(min(vocabulary, key=lambda c: (-counts[c], c)))
+            counts[most_frequent[-1]] += missing
+            freq = np.array([counts[c] for c in vocabulary], dtype=np.float64)
+            p = freq / max(freq.sum(), 1)
+            scale = np.sqrt(p * (1 - p))
+            vocabularies.append(vocabulary)
+            cat_scales.append(np.where(scale == 0, 1.0, scale))
+
+        self.fitted_state = FittedPreprocessor(self.num_feats, self.cat_feats, medians, means,
+                                               np.where(scales == 0, 1.0, scales), vocabularies, most_frequent,
+                                               cat_scales)
+        self.feature_names = self.fitted_state.feature_names
+        self.fitted = True
+        logger.info(f"Finalized the streaming preprocessor over {int(self.__count.max(initial=0) + self.__missing.max(initial=0))} rows.")
+        return self
+
+    # Transform a chunk into a float32 feature matrix; unseen categories encode as all zeros
+    def transform(self, df: pd.DataFrame):
+        if not self.fitted:
+            self.finalize()
+        return self.fitted_state.transform(df)
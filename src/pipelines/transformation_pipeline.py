@@ -1,20 +1,23 @@
-from sklearn.pipeline import Pipeline
-from sklearn.impute import SimpleImputer
-from sklearn.compose import ColumnTransformer
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-
 from src.log import logger
 from src.exceptions import CustomException
-from src.utils import save_obj, fetch_tables_list
+from src.utils import save_json
+from src.artifact_store import ArtifactStore
+from src.catalog import DataCatalog
+from src.stage_cache import StageCache
+from src.scheduler import run_tables
+from src.dtypes import feature_columns
+from src.market_context import MARKET_TABLES, build_market_context, context_files, load_market_context
 
 import os
-import pandas as pd
 
 
 class TransformationPipelineConfig:
 
-    def __init__(self):
-        self.df_name_list = fetch_tables_list(schema='production')
+    def __init__(self, store: ArtifactStore = None, catalog: DataCatalog = None, cache: StageCache = None):
+        self.store = store or ArtifactStore()
+        self.cache = cache or StageCache()
+        self.catalog = catalog or DataCatalog(schema='production')
+        self.df_name_list = [df_name for df_name in self.catalog.table_names if df_name not in MARKET_TABLES]
         self.df_paths_dict = self.__data_paths()
         self.preprocessor_pipeline_paths_dict = self.__prep_pipeline_paths()
 
@@ -22,7 +25,7 @@ class TransformationPipelineConfig:
        paths = {}
        try:
            for df_name in self.df_name_list:
-               paths[df_name] = os.path.join('.artifacts', df_name, 'preprocessor_pipeline.pkl')
+               paths[df_name] = os.path.join('.artifacts', df_name, 'preprocessor_pipeline.json')
                logger.info(f"Defined the preprocessor pipeline path for dataframe {df_name}.")
 
            return paths
@@ -33,7 +36,7 @@ class TransformationPipelineConfig:
         paths = {}
         try:
             for df_name in self.df_name_list:
-                paths[df_name] = os.path.join('.artifacts', df_name, 'raw.csv')
+                paths[df_name] = self.store.artifact_path(df_name, 'raw')
                 logger.info(f"Defined the raw data path for dataframe {df_name}.")
 
             return paths
@@ -41,9 +44,75 @@ class TransformationPipelineConfig:
             raise CustomException(e)
 
 
+# Create the preprocessor pipeline, given its numerical and categorical features. scikit-learn is only imported here,
+# the stages that merely build or read the pipeline specs do not pay for it.
+def make_preprocessor_pipeline(num_feats: list, cat_feats: list):
+    from sklearn.pipeline import Pipeline
+    from sklearn.impute import SimpleImputer
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    try:
+        num_pipeline = Pipeline(steps=[('imputer', SimpleImputer(strategy='median')),
+                                       ('scalar', StandardScaler())])
+        logger.info("Numerical pipeline created as a series of SimpleImputer and StandardScalar.")
+    except Exception as e:
+        raise CustomException(e)
+    
+    try:
+        cat_pipeline = Pipeline(steps=[('imputer', SimpleImputer(strategy='most_frequent')),
+                                       ('one_hot_encoder', OneHotEncoder()),
+                                       ('scalar', StandardScaler(with_mean=False))])
+        logger.info("Categorical pipeline created as a series of SimpleImputer, OneHotEncoder and StandardScalar.")
+    except Exception as e:
+        raise CustomException(e)
+    
+    try:
+        preprocessor_pipeline = ColumnTransformer([('num_pipeline', num_pipeline, num_feats),
+                                                   ('cat_pipeline', cat_pipeline, cat_feats)])
+        logger.info("Created the preprocessor object as a series of numerical and categorical pipelines.")
+        return preprocessor_pipeline
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Build the preprocessor pipeline of a single table from its raw data, with the market context columns when a
+# context is given. Runs in a worker process.
+def build_preprocessor_pipeline(df_name: str, raw_path: str, prep_pip_path: str, store: ArtifactStore, cache: StageCache,
+                                market_context_path: str = None):
+    # The pipeline only depends on the raw data and the context, skip the tables whose inputs are unchanged
+    cache_key = cache.make_key('preprocessor_pipeline', raw_path, *context_files(market_context_path))
+    if cache.fetch(cache_key, [prep_pip_path]):
+        return
+    
+    df = store.read(raw_path)
+    logger.info(f"Stored the dataframe df, reading through '{raw_path}'.")
+
+    market_context = load_market_context(market_context_path)
+    if market_context is not None:
+        df = market_context.add_context(df)
+
+    # The raw data is already typed at ingestion: ids and metadata are categoricals left out of the features
+    num_feats, cat_feats = feature_columns(df)
+    logger.info(f"Stored the numerical features {num_feats} and categorical features {cat_feats} of {df_name}.")
+
+    # The unfitted pipeline is fully described by its feature lists, stored as a JSON spec
+    save_json(file_path=prep_pip_path, obj=dict(num_feats=num_feats, cat_feats=cat_feats))
+    logger.info(f"Saved the preprocessor pipeline spec into '{prep_pip_path}' file.")
+
+    cache.store(cache_key, [prep_pip_path])
+
+
+# Transformation pipeline class. Tables are processed in parallel over 'max_workers' processes; the tables that
+# fail are logged and listed in 'failures' instead of aborting the run. The market tables are not transformed
+# themselves: their context is built once into 'market_context_path' and joined onto every other table.
 class TransformationPipeline:
-    def __init__(self):
-        self.__transformation_pipeline_config = TransformationPipelineConfig()
+    def __init__(self, store: ArtifactStore = None, catalog: DataCatalog = None, cache: StageCache = None,
+                 max_workers: int = None):
+        self.__transformation_pipeline_config = TransformationPipelineConfig(store=store, catalog=catalog, cache=cache)
+        self.__max_workers = max_workers
+        self.failures = {}
+        self.market_context_path = None
         logger.info("Transformation pipeline config captured.")
 
         
@@ -51,62 +120,12 @@ class TransformationPipeline:
         df_name_list = self.__transformation_pipeline_config.df_name_list
         df_paths_dict = self.__transformation_pipeline_config.df_paths_dict
         prep_pip_paths_dict = self.__transformation_pipeline_config.preprocessor_pipeline_paths_dict
+        store = self.__transformation_pipeline_config.store
+        cache = self.__transformation_pipeline_config.cache
 
-        for df_name in df_name_list:
-            
-            df = pd.read_csv(df_paths_dict[df_name])
-            logger.info(f"Stored the dataframe df, reading through '.artifacts/{df_name}/raw.csv'.")
-
-            try:
-                for col in df.columns.values.tolist():
-                    if any([x in col for x in ['id', 'meta']]):
-                        df_ind = df_ind.astype({col: str})
-                        logger.info(f"Converted the column, {col}, type into string.")
-                    if col in ['category.id', 'market.id']:
-                        df_ind[col] = df_ind[col].astype('category')
-                        logger.info(f"Converted the column, {col}, type into category.")
-
-                print(df.info())
-            except Exception as e:
-                raise CustomException(e)
-
-            cat_feats = df.select_dtypes(include=['category']).columns.to_list()
-            logger.info("Stored the categorical features into the list 'cat_feats'.")
-            print(cat_feats)
-
-            num_feats = df.select_dtypes(include=['number']).columns.to_list()
-            logger.info("Stored the numerical features into the list 'num_feats'.")
-            print(num_feats)
-
-            try:
-                num_pipeline = Pipeline(steps=[('imputer', SimpleImputer(strategy='median')),
-                                               ('scalar', StandardScaler())])
-                logger.info("Numerical pipeline created as a series of SimpleImputer and StandardScalar.")
-            except Exception as e:
-                raise CustomException(e)
-            
-            try:
-                cat_pipeline = Pipeline(steps=[('imputer', SimpleImputer(strategy='most_frequent')),
-                                               ('one_hot_encoder', OneHotEncoder()),
-                                               ('scalar', StandardScaler(with_mean=False))])
-                logger.info("Categorical pipeline created as a series of SimpleImputer, OneHotEncoder and StandardScalar.")
-            except Exception as e:
-                raise CustomException(e)
-            
-            try:
-                preprocessor_pipeline = ColumnTransformer([('num_pipeline', num_pipeline, num_feats),
-                                                           ('cat_pipeline', cat_pipeline, cat_feats)])
-                logger.info("Created the preprocessor object as a series of numerical and categorical pipelines.")
-            except Exception as e:
-                raise CustomException(e)
-            
-            try:
-                save_obj(file_path=prep_pip_paths_dict[df_name], obj=preprocessor_pipeline)
-                logger.info(f"Saved the preprocessor pipeline object into '.artifacts/{df_name}/preprocessor_pipeline.pkl' file.")
-            except Exception as e:
-                raise CustomException(e)
-        
-
-
-
+        self.market_context_path = build_market_context(store, cache)
 
+        tasks = {df_name: (df_paths_dict[df_name], prep_pip_paths_dict[df_name], store, cache, self.market_context_path)
+                 for df_name in df_name_list}
+        _, self.failures = run_tables(build_preprocessor_pipeline, tasks, max_workers=self.__max_workers)
+        logger.info(f"Built the preprocessor pipelines of {len(tasks) - len(self.failures)} tables, {len(self.failures)} failed.")
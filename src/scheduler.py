@@ -0,0 +1,44 @@
+from src.log import logger, stage_timer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+
+
+# Run a task in a worker process. Exceptions are re-raised as plain RuntimeErrors, so they unpickle in the parent.
+def _run_task(func: Callable, df_name: str, args: tuple):
+    try:
+        with stage_timer(func.__name__, df_name):
+            return func(df_name, *args)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+# Run func(df_name, *args) for each table of 'tasks' ({df_name: args}) over a process pool.
+# Returns the results of the tables that succeeded and the errors of those that failed, so that one bad table does
+# not abort the run. With max_workers=1, the tables run serially in the current process.
+# Results are pickled back to the parent process, so tasks return small objects: the transformation stages write
+# their arrays as memory-mappable artifacts and return their paths.
+def run_tables(func: Callable, tasks: dict, max_workers: int = None):
+    results, failures = {}, {}
+
+    if max_workers == 1:
+        for df_name, args in tasks.items():
+            try:
+                with stage_timer(func.__name__, df_name):
+                    results[df_name] = func(df_name, *args)
+            except Exception as e:
+                failures[df_name] = f"{type(e).__name__}: {e}"
+                logger.error(f"Table {df_name} failed: {failures[df_name]}")
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_run_task, func, df_name, args): df_name for df_name, args in tasks.items()}
+        for future in as_completed(futures):
+            df_name = futures[future]
+            try:
+                results[df_name] = future.result()
+                logger.info(f"Table {df_name} done.")
+            except Exception as e:
+                failures[df_name] = str(e)
+                logger.error(f"Table {df_name} failed: {failures[df_name]}")
+
+    return results, failures
@@ -0,0 +1,121 @@
+from src.exceptions import CustomException
+from src.log import logger
+from src.utils import fetch_table, jalali_key
+from collections import OrderedDict
+import base64
+import json
+import os
+import threading
+import numpy as np
+
+
+# Largest-Triangle-Three-Buckets downsampling: indices of 'n_out' points of (x, y) that keep the visual shape
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        next_hi = max(next_hi, next_lo + 1)
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+
+    return idx
+
+
+# OHLC bars of a price series, over 'n_out' buckets of equal row counts; no bars for an empty series
+def ohlc_resample(dates: np.ndarray, prices: np.ndarray, n_out: int):
+    n = len(prices)
+    if n == 0 or n_out < 1:
+        return dict(x=dates[:0], open=prices[:0], high=prices[:0], low=prices[:0], close=prices[:0])
+    starts = np.unique(np.linspace(0, n, min(n_out, n) + 1).astype(np.int64)[:-1])
+    ends = np.append(starts[1:], n)
+    return dict(x=dates[starts], open=prices[starts], high=np.maximum.reduceat(prices, starts),
+                low=np.minimum.reduceat(prices, starts), close=prices[ends - 1])
+
+
+# Plotly typed array: base64-encoded little-endian binary data
+def typed_array(values: np.ndarray, dtype: str = 'f8'):
+    return {'dtype': dtype, 'bdata': base64.b64encode(np.ascontiguousarray(values, dtype=f'<{dtype}').tobytes()).decode()}
+
+
+# Chart data server for the Dash front end. Per-symbol, per-date-range frames are kept in a size-bounded LRU cache
+# (a request inside a cached range is answered by slicing it), and chart requests are downsampled to the pixel
+# width and serialized as Plotly JSON with binary typed arrays.
+class ChartDataServer:
+    def __init__(self, schema: str = 'production', max_bytes: int = None, price_col: str = 'close_price'):
+        self.schema = schema
+        self.max_bytes = max_bytes or int(os.getenv('CHART_CACHE_MAX_BYTES', str(256 * 1024 ** 2)))
+        self.price_col = price_col
+        self.__frames = OrderedDict()
+        self.__nbytes = 0
+        self.__lock = threading.Lock()
+
+    # Frame of a symbol between two Jalali dates ('YYYY/MM/DD', inclusive), sorted by date
+    def get_frame(self, symbol: str, start: str, end: str):
+        start, end = jalali_key(start), jalali_key(end)
+        with self.__lock:
+            for (cached_symbol, cached_start, cached_end), df in reversed(self.__frames.items()):
+                if cached_symbol == symbol and cached_start <= start and end <= cached_end:
+                    self.__frames.move_to_end((cached_symbol, cached_start, cached_end))
+                    jal_date = df['jal_date'].to_numpy()
+                    return df.iloc[np.searchsorted(jal_date, start, 'left'):np.searchsorted(jal_date, end, 'right')]
+
+        df = fetch_table(symbol, self.schema, order_by='j_date', date_range=(start, end))
+        self.__put((symbol, start, end), df)
+        return df
+
+    def __put(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self.__lock:
+            if key in self.__frames:
+                return
+            self.__frames[key] = df
+            self.__nbytes += size
+            while self.__nbytes > self.max_bytes and len(self.__frames) > 1:
+                _, evicted = self.__frames.popitem(last=False)
+                self.__nbytes -= int(evicted.memory_usage(deep=True).sum())
+        logger.info(f"Cached {len(df)} rows of {key[0]} from {key[1]} to {key[2]}, {self.__nbytes} bytes in cache.")
+
+    # Line chart of a column, downsampled with LTTB to at most 'width' points
+    def line(self, symbol: str, start: str, end: str, width: int, column: str = None):
+        column = column or self.price_col
+        try:
+            df = self.get_frame(symbol, start, end)
+            dates = df['greg_date'].to_numpy()
+            values = df[column].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(values)
+            dates, values = dates[valid], values[valid]
+            idx = lttb(dates.astype('datetime64[ns]').astype(np.int64), values, width)
+            return dict(type='scatter', mode='lines', name=symbol,
+                        x=np.datetime_as_string(dates[idx], unit='D').tolist(), y=typed_array(values[idx]))
+        except Exception as e:
+            raise CustomException(e)
+
+    # Candlestick chart of the price, resampled to at most 'width' bars
+    def ohlc(self, symbol: str, start: str, end: str, width: int):
+        try:
+            df = self.get_frame(symbol, start, end)
+            prices = df[self.price_col].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(prices)
+            bars = ohlc_resample(df['greg_date'].to_numpy()[valid], prices[valid], width)
+            return dict(type='candlestick', name=symbol, x=np.datetime_as_string(bars['x'], unit='D').tolist(),
+                        **{k: typed_array(bars[k]) for k in ['open', 'high', 'low', 'close']})
+        except Exception as e:
+            raise CustomException(e)
+
+    # Pre-serialized Plotly figure JSON of some traces
+    @staticmethod
+    def to_json(*traces: dict):
+        return json.dumps({'data': list(traces)}, separators=(',', ':'))
@@ -0,0 +1,145 @@
+from src.exceptions import CustomException
+from src.log import logger
+import pandas as pd
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import List
+
+# Version of each stage's code, part of every cache key. Bump a stage's version when its output changes.
+STAGE_VERSIONS = {
+    'ingestion': '2',
+    'preprocessor_pipeline': '3',
+    'transformation': '3',
+    'market_context': '1',
+}
+
+
+# Feed an input of a stage into a hash: dataframes by content, paths to existing files by content, else as JSON
+def _update_hash(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(json.dumps([list(map(str, obj.columns)), list(map(str, obj.dtypes))]).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, str) and os.path.isfile(obj):
+        with open(obj, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    else:
+        h.update(json.dumps(obj, sort_keys=True, default=str).encode())
+
+
+# Copy a file, or a directory and its content
+def _copy(src: str, dst: str):
+    if os.path.isdir(src):
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+# Size of a file, or of the files under a directory
+def _size(path: str):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+# Cache of stage outputs (files or directories) under '.artifacts', keyed on the content hash of the stage inputs plus the stage version.
+# Entries are evicted least recently used first, once their total size exceeds 'max_bytes'.
+# Several worker processes share the cache: an entry is written into a temporary directory then renamed into place,
+# and evicted by renaming it away before removing it, so it is complete while at its path. An entry evicted by
+# another process while it is restored reads as a miss.
+class StageCache:
+    def __init__(self, cache_dir: str = os.path.join('.artifacts', '.cache'), max_bytes: int = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes or int(os.getenv('STAGE_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+
+    # Cache key of a stage, given its inputs
+    def make_key(self, stage: str, *inputs):
+        h = hashlib.sha256()
+        _update_hash(h, [stage, STAGE_VERSIONS[stage]])
+        for obj in inputs:
+            _update_hash(h, obj)
+        return f"{stage}-{h.hexdigest()}"
+
+    def __entry_files(self, key: str, output_paths: List[str]):
+        return [os.path.join(self.cache_dir, key, f"{i}_{os.path.basename(path)}") for i, path in enumerate(output_paths)]
+
+    # Restore the cached outputs of a key into 'output_paths', return False on a cache miss. An entry evicted by
+    # another process while it is restored is a miss too: a copy fails, or the entry is gone from its path by the
+    # end of the copy.
+    def fetch(self, key: str, output_paths: List[str]):
+        entry_dir = os.path.join(self.cache_dir, key)
+        entry_files = self.__entry_files(key, output_paths)
+        if not all(os.path.exists(f) for f in entry_files):
+            return False
+
+        try:
+            for entry_file, path in zip(entry_files, output_paths):
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                _copy(entry_file, path)
+            os.utime(entry_dir)
+        except (FileNotFoundError, shutil.Error) as e:
+            logger.warning(f"Cache entry '{key}' could not be restored, treated as a miss (evicted meanwhile?): {e}")
+            return False
+        except Exception as e:
+            raise CustomException(e)
+
+        logger.info(f"Cache hit for '{key}', restored {output_paths}.")
+        return True
+
+    # Store the outputs of a key, then evict the least recently used entries over the size budget. An entry stored
+    # meanwhile by another process for the same key is kept, as it holds the same outputs.
+    def store(self, key: str, output_paths: List[str]):
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{key}-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(tmp_dir)
+            for entry_file, path in zip(self.__entry_files(key, output_paths), output_paths):
+                _copy(path, os.path.join(tmp_dir, os.path.basename(entry_file)))
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                if not os.path.isdir(entry_dir):
+                    raise
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.info(f"Cached {output_paths} under '{key}'.")
+        except Exception as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise CustomException(e)
+
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits in 'max_bytes'. Entries being written (temporary
+    # directories) are skipped, and those removed meanwhile by another process are left out of the total.
+    def evict(self):
+        try:
+            entries = []
+            for key in os.listdir(self.cache_dir):
+                if key.startswith('.'):
+                    continue
+                entry_dir = os.path.join(self.cache_dir, key)
+                try:
+                    entries.append((os.path.getmtime(entry_dir), _size(entry_dir), entry_dir))
+                except FileNotFoundError:
+                    continue
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry_dir in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    evicted_dir = os.path.join(self.cache_dir, f".evicted-{uuid.uuid4().hex}")
+                    os.rename(entry_dir, evicted_dir)
+                    shutil.rmtree(evicted_dir, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                logger.info(f"Evicted the cache entry '{entry_dir}'.")
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            raise CustomException(e)
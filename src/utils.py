@@ -1,31 +1,56 @@
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv, find_dotenv
 from src.exceptions import CustomException
-from src.log import logger
+from src.log import logger, stage_timer
+from src.indicators import add_indicators
 import pandas as pd
-import talib as ta
-import dill
+import numpy as np
+import io
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Any
-from persiantools.jdatetime import JalaliDate
 
-_ = load_dotenv(find_dotenv())
+# The database driver, dill, persiantools and pyarrow are imported by the functions that use them, so that importing
+# this module stays cheap for the stages (and worker processes) that never touch them.
 
-# Create a Postgresql connection engine, given a database
+# Process-wide pooled engine, created on the first call to postgres_connect
+_ENGINE = None
+
+# Process-wide cache of converted Jalali date strings, shared by all the tables of a run
+_JALALI_DATE_CACHE = {}
+
+# Use an existing engine for all the later database calls, e.g. a local stand-in database for benchmarks
+def set_engine(engine):
+    global _ENGINE
+    _ENGINE = engine
+    logger.info(f"Using the '{engine.dialect.name}' engine for the database calls.")
+
+
+# Create a Postgresql connection engine, given a database. The engine (and its connection pool) is created once
+# per process and reused by every later call.
 def postgres_connect():
+    global _ENGINE
+    if _ENGINE is not None:
+        return _ENGINE
+
+    from sqlalchemy import create_engine
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
     try:
         conn = os.getenv('DATABASE_URL')
         logger.info("Database URL fetched.")
 
-        engine = create_engine(conn)
-        logger.info("Engine created, establishing a connection to the Postgresql database, 'mabna' database.")
-        return engine
+        pool_size = int(os.getenv('DATABASE_POOL_SIZE', '8'))
+        _ENGINE = create_engine(conn, pool_size=pool_size, max_overflow=pool_size, pool_pre_ping=True)
+        logger.info(f"Engine created with a pool of {pool_size} connections to the Postgresql database, 'mabna' database.")
+        return _ENGINE
     except Exception as e:
         raise CustomException(e)
 
 
 # Grab the schema and return the list of all tables in that schema and the schema in a tuple.
 def fetch_tables_list(schema: str):
+    from sqlalchemy import text
     engine = postgres_connect()
     sql_all_tables = text(f"""SELECT table_name 
                               FROM information_schema.tables 
@@ -47,36 +72,266 @@ def fetch_tables_list(schema: str):
         raise CustomException(e)
     
 
-# Grab the list of table names and the schema and return a dictionary of the tables and corresponding dataframes
-def fetch_tables_dict(tables_list: List[str], schema:str):
+# Grab the schema and return its catalog: per table, the column names and types, the row count and the last 'j_date'
+def fetch_schema_catalog(schema: str):
+    from sqlalchemy import text
     engine = postgres_connect()
+    sql_all_columns = text("""SELECT table_name, column_name, data_type
+                              FROM information_schema.columns
+                              WHERE table_schema = :schema
+                              ORDER BY table_name, ordinal_position
+                           """)
+    catalog = {}
+    try:
+        with engine.connect() as conn:
+            for table, column, data_type in conn.execute(sql_all_columns, {'schema': schema}).fetchall():
+                if any([x in table for x in ['energy', 'property']]):
+                    continue
+                entry = catalog.setdefault(table, {'columns': [], 'dtypes': {}, 'row_count': None, 'watermark': None})
+                entry['columns'].append(column)
+                entry['dtypes'][column] = data_type
+            logger.info(f"Executed the query to grab the columns of {len(catalog)} tables in schema '{schema}'.")
+
+            if catalog:
+                sql_stats = text(" UNION ALL ".join(
+                    f"""SELECT '{table}', COUNT(*), {'MAX(j_date)' if 'j_date' in entry['columns'] else 'NULL'}
+                        FROM "{schema}".{table}"""
+                    for table, entry in catalog.items()))
+                for table, row_count, watermark in conn.execute(sql_stats).fetchall():
+                    catalog[table]['row_count'] = int(row_count)
+                    catalog[table]['watermark'] = watermark
+                logger.info(f"Executed the query to grab the row counts and watermarks of the tables in schema '{schema}'.")
+
+        return catalog
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Zero-padded form of a Jalali date string, which compares in date order as a string ('1402/9/5' -> '1402/09/05')
+def jalali_key(date_str: str):
+    year, month, day = (int(x) for x in str(date_str).split('/'))
+    return f"{year:04d}/{month:02d}/{day:02d}"
+
+
+# Keep the rows of a dataframe with a 'j_date' past the 'since' watermark and within the (start, end) 'date_range',
+# comparing the zero-padded dates whatever the padding of the stored ones; rows without a date are dropped
+def filter_jalali(df: pd.DataFrame, since: str = None, date_range: tuple = None):
+    if since is None and date_range is None:
+        return df
+    try:
+        dates = df['j_date']
+        keys = dates.map({date_str: jalali_key(date_str) for date_str in dates.dropna().unique()})
+        mask = np.array(keys.notna(), dtype=bool)
+        if since is not None:
+            mask &= keys > jalali_key(since)
+        if date_range is not None:
+            mask &= (keys >= jalali_key(date_range[0])) & (keys <= jalali_key(date_range[1]))
+        return df if mask.all() else df[mask].reset_index(drop=True)
+    except Exception as e:
+        raise CustomException(e)
+
+
+# ORDER BY expression of the 'j_date' strings in date order, whatever their zero-padding: their integer year, month
+# and day parts ('1402/9/5' before '1402/10/1')
+JALALI_ORDER_BY = ", ".join(f"CAST(split_part(j_date, '/', {i}) AS INTEGER)" for i in (1, 2, 3))
+
+
+# Build the SELECT query of a table, with its parameters bound. 'columns' projects the columns, a 'since' watermark
+# and a (start, end) 'date_range' narrow the rows down to the years of the 'j_date' bounds, and 'order_by' sorts the
+# rows in the database, order_by='j_date' in date order (see JALALI_ORDER_BY). The stored dates are not always
+# zero-padded, so only their 4-digit year prefix compares in date order as a string: the exact bounds are applied on
+# the fetched rows, by filter_jalali.
+def table_query(table: str, schema: str, columns: List[str] = None, since: str = None, date_range: tuple = None,
+                order_by: str = None):
+    from sqlalchemy import text
+    conditions, params = [], {}
+    if since is not None:
+        conditions.append("j_date >= :since_year")
+        params['since_year'] = jalali_key(since)[:4]
+    if date_range is not None:
+        conditions.append("j_date >= :start_year AND j_date < :end_year")
+        params['start_year'] = jalali_key(date_range[0])[:4]
+        params['end_year'] = f"{int(jalali_key(date_range[1])[:4]) + 1:04d}"
+    select_clause = ", ".join(f'"{col}"' for col in columns) if columns else "*"
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_clause = f"ORDER BY {JALALI_ORDER_BY if order_by == 'j_date' else order_by}" if order_by is not None else ""
+    query = text(f"""
+                     SELECT {select_clause}
+                     FROM "{schema}".{table}
+                     {where_clause}
+                     {order_clause}
+                  """)
+    return query.bindparams(**params) if params else query
+
+
+# Stream the content of a table in dataframe chunks, through a server-side cursor (see table_query for the filters)
+def iter_table_chunks(table: str, schema: str, chunksize: int = 100_000, since: str = None, order_by: str = None,
+                      date_range: tuple = None, columns: List[str] = None):
+    engine = postgres_connect()
+    sql_ind_table = table_query(table, schema, columns, since, date_range, order_by)
+    try:
+        with engine.connect().execution_options(stream_results=True) as conn:
+            for chunk in pd.read_sql_query(sql=sql_ind_table, con=conn, chunksize=chunksize):
+                yield filter_jalali(chunk, since, date_range)
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Grab the column names and types (information_schema data_type) of a single table
+def fetch_column_dtypes(table: str, schema: str):
+    from sqlalchemy import text
+    engine = postgres_connect()
+    sql_columns = text("""SELECT column_name, data_type
+                          FROM information_schema.columns
+                          WHERE table_schema = :schema AND table_name = :table
+                          ORDER BY ordinal_position
+                       """)
+    try:
+        with engine.connect() as conn:
+            return dict(conn.execute(sql_columns, {'schema': schema, 'table': table}).fetchall())
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Arrow types of the PostgreSQL column types, so that COPY reads a column as read_sql_query does: text stays text
+# (e.g. ids with leading zeros), integers with NULLs turn into floats and numerics into floats. Other types are
+# left to the CSV reader's inference.
+def _arrow_column_types(dtypes: dict):
+    import pyarrow as pa
+    arrow_types = {}
+    for col, data_type in dtypes.items():
+        if data_type in ('character varying', 'character', 'text', 'uuid', 'json', 'jsonb'):
+            arrow_types[col] = pa.string()
+        elif data_type in ('smallint', 'integer', 'bigint'):
+            arrow_types[col] = pa.int64()
+        elif data_type in ('real', 'double precision', 'numeric'):
+            arrow_types[col] = pa.float64()
+        elif data_type == 'boolean':
+            arrow_types[col] = pa.bool_()
+        elif data_type == 'date':
+            arrow_types[col] = pa.date32()
+    return arrow_types
+
+
+# Parse the CSV output of 'COPY ... TO STDOUT WITH (FORMAT csv, HEADER true)' into a dataframe, with the column
+# types of 'dtypes' (column name -> information_schema data_type). COPY writes NULL as an unquoted empty field and
+# an empty string as a quoted one, so only the former is read as missing, as read_sql_query returns them.
+def read_copy_csv(buffer, dtypes: dict):
+    import pyarrow.csv as pa_csv
+    try:
+        table_arrow = pa_csv.read_csv(buffer, convert_options=pa_csv.ConvertOptions(
+            column_types=_arrow_column_types(dtypes), strings_can_be_null=True, quoted_strings_can_be_null=False,
+            null_values=['']))
+        return table_arrow.to_pandas()
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Bulk-read a table with PostgreSQL 'COPY ... TO STDOUT' (CSV), parsed straight into Arrow buffers by the pyarrow
+# CSV reader, with the filters of table_query applied in the database. The column types come from 'dtypes' (e.g.
+# the catalog's), or are looked up in information_schema. Only available with the psycopg2 driver.
+def copy_table(table: str, schema: str, since: str = None, order_by: str = None, date_range: tuple = None,
+               columns: List[str] = None, dtypes: dict = None):
+    if dtypes is None:
+        dtypes = fetch_column_dtypes(table, schema)
+    engine = postgres_connect()
+    query = table_query(table, schema, columns, since, date_range, order_by)
+    raw_conn = engine.raw_connection()
+    try:
+        # COPY takes no bound parameters, the filter values are rendered as quoted literals
+        query = query.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+        buffer = io.BytesIO()
+        with raw_conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+        buffer.seek(0)
+        return filter_jalali(read_copy_csv(buffer, dtypes), since, date_range)
+    except Exception as e:
+        raise CustomException(e)
+    finally:
+        raw_conn.close()
+
+
+# Replace the 'j_date' string column of a dataframe with the Jalali and Gregorian date columns
+def add_date_columns(df_ind, table: str):
+    try:
+        dates = jalali_str_to_greg(df_ind['j_date'])
+        df_ind.insert(loc=1, column='jal_date', value=dates['jalali'])
+        df_ind.insert(loc=2, column='greg_date', value=dates['gregorian'])
+        df_ind.insert(loc=3, column='jal_year', value=dates['jal_year'])
+        df_ind.insert(loc=4, column='jal_month', value=dates['jal_month'])
+        df_ind.insert(loc=5, column='jal_day', value=dates['jal_day'])
+        df_ind.drop(columns=['j_date'], inplace=True)
+        logger.info(f"Added the 'jal_date', 'greg_date' and integer Jalali date part columns to the dataframe {table}.")
+        return df_ind
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Fetch a single table into a dataframe and add its date columns. With method='copy', the table is bulk-read with
+# COPY, falling back to the chunked query when COPY is not available (e.g. another database driver); 'dtypes' are
+# the column types of the table, passed on to copy_table. COPY stays opt-in, and no stage uses it, until the
+# 'fetch_tables_dict' benchmark of both methods has been recorded against a PostgreSQL server.
+def fetch_table(table: str, schema: str, chunksize: int = 100_000, since: str = None, order_by: str = None,
+                date_range: tuple = None, columns: List[str] = None, method: str = 'sql', dtypes: dict = None):
+    start = time.perf_counter()
+    if columns is not None and 'j_date' not in columns:
+        columns = ['j_date'] + list(columns)
+
+    with stage_timer('fetch', table, schema=schema, method=method) as event:
+        df_ind = None
+        if method == 'copy':
+            try:
+                df_ind = copy_table(table, schema, since, order_by, date_range, columns, dtypes)
+                logger.info(f"Copied {table} content into a dataframe.")
+            except CustomException as e:
+                logger.warning(f"COPY of {table} failed, falling back to the query: {e.exception_message}")
+                event['method'] = 'sql'
+
+        if df_ind is None:
+            try:
+                chunks = list(iter_table_chunks(table, schema, chunksize, since, order_by, date_range, columns))
+                df_ind = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+                logger.info(f"Executed the query to store {table} content into a dataframe.")
+            except Exception as e:
+                raise CustomException(e)
+
+        df_ind = add_date_columns(df_ind, table)
+        event['rows'] = len(df_ind)
+        event['bytes'] = int(df_ind.memory_usage(deep=False).sum())
+
+    logger.info(f"Fetched {len(df_ind)} rows of {table} in {time.perf_counter() - start:.3f}s.")
+    return df_ind
+
+
+# Grab the list of table names and the schema and return a dictionary of the tables and corresponding dataframes.
+# Tables are fetched concurrently over the pooled engine, 'max_workers' at a time. 'since_dict' optionally maps
+# table names to a 'j_date' watermark, so that only the newer rows of those tables are fetched;
+# 'columns' and 'method' are passed on to fetch_table, and 'dtypes_dict' optionally maps table names to their column
+# types (e.g. from the catalog) for the COPY reads.
+def fetch_tables_dict(tables_list: List[str], schema: str, max_workers: int = 4, chunksize: int = 100_000,
+                      since_dict: dict = None, columns: List[str] = None, method: str = 'sql',
+                      dtypes_dict: dict = None):
+    start = time.perf_counter()
+    postgres_connect()
+    since_dict = since_dict or {}
+    dtypes_dict = dtypes_dict or {}
     df_dict = {}
 
-    for table in tables_list:
-        sql_ind_table = text(f"""
-                                 SELECT *
-                                 FROM "{schema}".{table}
-                              """)
-        try:
-            df_ind = pd.read_sql_query(sql=sql_ind_table, con=engine)
-            logger.info(f"Executed the query to store {table} content into a dataframe.")
-        except Exception as e:
-            raise CustomException(e)
-        
-        try:
-            df_ind.insert(loc=1, column='jal_date', value=jalali_str_to_greg(df_ind['j_date'])['jalali'])                    
-            df_ind.insert(loc=2, column='greg_date', value=jalali_str_to_greg(df_ind['j_date'])['gregorian'])
-            df_ind.drop(columns=['j_date'], inplace=True)
-            logger.info(f"Added the 'jal_date' and 'greg_date' columns to the dataframe {table} as datetime type.")
-
-        except Exception as e:
-            raise CustomException(e)
-    print(df_dict)        
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_table, table, schema, chunksize, since_dict.get(table),
+                                   columns=columns, method=method, dtypes=dtypes_dict.get(table)): table
+                   for table in tables_list}
+        for future in as_completed(futures):
+            df_dict[futures[future]] = future.result()
+
+    df_dict = {table: df_dict[table] for table in tables_list}
+    logger.info(f"Fetched {len(df_dict)} tables ({sum(len(df) for df in df_dict.values())} rows) from schema '{schema}' in {time.perf_counter() - start:.3f}s.")
     return df_dict
 
 
 # Store obj into a file
 def save_obj(file_path:str, obj: Any):
+    import dill
     try:
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
@@ -94,6 +349,7 @@ def save_obj(file_path:str, obj: Any):
 
 # Load an object from a file
 def load_obj(file_path:str):
+    import dill
     try:
         with open(file_path, "rb") as f:
             obj = dill.load(f)
@@ -103,80 +359,162 @@ def load_obj(file_path:str):
         raise CustomException(e)
     
 
-# Convert string date to Jalali and Gregorian dates in a dictionary
+# Store a JSON-serializable object into a file
+def save_json(file_path: str, obj: Any):
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as f:
+            json.dump(obj, f)
+            logger.info(f"Stored the object {type(obj)} into '{file_path}'.")
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Load a JSON object from a file
+def load_json(file_path: str):
+    try:
+        with open(file_path, "r") as f:
+            obj = json.load(f)
+            logger.info(f"Loaded the file path, {file_path} content.")
+            return obj
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Load the ingestion watermark stored in a file, None if there is no watermark yet
+def load_watermark(file_path: str):
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, "r") as f:
+            watermark = json.load(f)['j_date']
+            logger.info(f"Loaded the watermark {watermark} from '{file_path}'.")
+            return watermark
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Store the ingestion watermark into a file
+def save_watermark(file_path: str, watermark: str):
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as f:
+            json.dump({'j_date': watermark}, f)
+            logger.info(f"Stored the watermark {watermark} into '{file_path}'.")
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Convert string dates to Jalali and Gregorian dates in a dictionary.
+# Conversion runs once per distinct date string (trading calendars repeat across tables), the results are cached
+# process-wide and broadcast back over the whole column as NumPy arrays. Jalali dates are returned zero-padded (see
+# jalali_key). Missing dates give NaT and NaN date parts (the parts are then floats).
 def jalali_str_to_greg(date_str_series):
-    date_str_df = date_str_series.str.split('/', expand=True)
-    year_series = date_str_df[0].astype(int)
-    month_series = date_str_df[1].astype(int)
-    day_series = date_str_df[2].astype(int)
-
-    j_dates = []
-    g_dates = []
-    for i in year_series.index:
-        j_dates.append(JalaliDate(year_series[i], month_series[i], day_series[i]))
-        g_dates.append(JalaliDate(year_series[i], month_series[i], day_series[i]).to_gregorian())
-
-    j_date_series = pd.Series(j_dates)
-    g_date_series = pd.Series(g_dates)
-    dict_date_series = dict(jalali=j_date_series, gregorian=g_date_series)
+    from persiantools.jdatetime import JalaliDate
+    try:
+        missing = pd.isna(date_str_series).to_numpy()
+        values = np.asarray(date_str_series, dtype=object)
+        uniques, inverse = np.unique(values[~missing].astype(str), return_inverse=True)
+
+        for date_str in uniques:
+            if date_str not in _JALALI_DATE_CACHE:
+                year, month, day = (int(x) for x in date_str.split('/'))
+                g_date = JalaliDate(year, month, day).to_gregorian()
+                _JALALI_DATE_CACHE[date_str] = (jalali_key(date_str), np.datetime64(g_date, 'D'), year, month, day)
+
+        parts = [_JALALI_DATE_CACHE[date_str] for date_str in uniques]
+        j_dates = np.full(len(values), None, dtype=object)
+        j_dates[~missing] = np.array([p[0] for p in parts], dtype=object)[inverse]
+        g_dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[D]')
+        g_dates[~missing] = np.array([p[1] for p in parts], dtype='datetime64[D]')[inverse]
+        date_parts = []
+        for i, dtype in [(2, np.int16), (3, np.int8), (4, np.int8)]:
+            part = np.array([p[i] for p in parts], dtype=dtype)[inverse]
+            if missing.any():
+                part = np.full(len(values), np.nan)
+                part[~missing] = np.array([p[i] for p in parts], dtype=np.float64)[inverse]
+            date_parts.append(part)
+        logger.info(f"Converted {len(values)} Jalali date strings ({len(uniques)} distinct) into Gregorian dates.")
+    except Exception as e:
+        raise CustomException(e)
+
+    index = date_str_series.index
+    dict_date_series = dict(jalali=pd.Series(j_dates, index=index),
+                            gregorian=pd.Series(g_dates, index=index),
+                            jal_year=pd.Series(date_parts[0], index=index),
+                            jal_month=pd.Series(date_parts[1], index=index),
+                            jal_day=pd.Series(date_parts[2], index=index))
     return dict_date_series
 
 
-# Define trading indicators columns
-def add_trade_indicators(train_df, test_df, df_name):
-    
-    # Calculate Relative Strength Index (RSI)
-    RSI_PERIOD = 14
-    train_df['rsi'] = ta.RSI(train_df['close_price'], RSI_PERIOD) 
-    test_df["rsi"] = ta.RSI(test_df["close_price"], RSI_PERIOD)
-    logger.info(f"'rsi' column created, for train and test dataframes in {df_name}")
-
-    # Calculate Moving Average Convergence Divergence (MACD)
-    MACD_FAST_EMA = 12
-    MACD_SLOW_EMA = 26
-    MACD_SIGNAL_PERIOD = 9 
-
-    train_df['macd'], train_df['signal'], train_df['hist'] = ta.MACD(train_df['close_price'], 
-                                                      fastperiod=MACD_FAST_EMA, 
-                                                      slowperiod=MACD_SLOW_EMA, 
-                                                      signalperiod=MACD_SIGNAL_PERIOD)
-    test_df['macd'], test_df['signal'], test_df['hist'] = ta.MACD(test_df['close_price'], 
-                                                      fastperiod=MACD_FAST_EMA, 
-                                                      slowperiod=MACD_SLOW_EMA, 
-                                                      signalperiod=MACD_SIGNAL_PERIOD)
-    logger.info(f"'macd', 'signal' and 'hist' columns created, for train and test dataframes in {df_name}")
-
-    # Calculate Bollinger Bands (BB)
-    # 20-day moving average 
-    BBANDS_PERIOD = 20
-
-    train_df['upper_bb'], train_df['middle_bb'], train_df['lower_bb'] = ta.BBANDS(train_df['close_price'])
-    test_df['upper_bb'], test_df['middle_bb'], test_df['lower_bb'] = ta.BBANDS(test_df['close_price'])
-    logger.info(f"'upper_bb', 'middle_bb' and 'lower_bb' columns created, for train and test dataframes in {df_name}")
+# Define trading indicators columns (RSI, MACD and Bollinger Bands, see src.indicators.INDICATOR_SPECS)
+def add_trade_indicators(train_df, test_df, df_name, specs: list = None):
+    train_df = add_indicators(train_df, specs)
+    test_df = add_indicators(test_df, specs)
+    logger.info(f"Indicator columns created, for train and test dataframes in {df_name}")
 
     return [train_df, test_df]
 
 
-# Define label column
-def add_label(train_df, test_df, df_name):
-    # Function to determine the label based on the indicators
-    def get_label(row):
-        if (row['rsi'] > 70 and \
-           row['macd'] < 0 and \
-           row['upper_bb'] > row['upper_bb'].quantile(0.9) and \
-           row['lower_bb'] < row['lower_bb'].quantile(0.9)):
-                return 'SELL'
-        elif (row['rsi'] < 30 and \
-             row['macd'] > 0 and \
-             row['upper_bb'] < row['upper_bb'].quantile(0.1) and \
-             row['lower_bb'] > row['lower_bb'].quantile(0.1)):
-                return 'BUY'
-        else:
-            return 'HOLD'
-
-    # Apply the function to create the label column
-    train_df['label'] = train_df.apply(get_label, axis=1)
-    test_df['label'] = test_df.apply(get_label, axis=1)
+# Sort a dataframe by date and split it into train and test slices, the test set being the latest rows
+def chronological_split(df, test_size: float = 0.2, date_col: str = 'greg_date'):
+    try:
+        df = df.sort_values(date_col, kind='stable', ignore_index=True)
+        cut = len(df) - int(np.ceil(len(df) * test_size))
+        return [df.iloc[:cut], df.iloc[cut:]]
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Label categories, in the order of their int8 codes
+LABELS = ['HOLD', 'BUY', 'SELL']
+
+# Default labelling thresholds: RSI levels and the quantiles of the Bollinger bands
+LABEL_THRESHOLDS = dict(rsi_overbought=70, rsi_oversold=30, high_quantile=0.9, low_quantile=0.1)
+
+
+# Compute the Bollinger band quantile thresholds once per column, e.g. on the train data
+def fit_label_thresholds(df, thresholds: dict = None):
+    thresholds = {**LABEL_THRESHOLDS, **(thresholds or {})}
+    try:
+        upper_bb = df['upper_bb'].to_numpy(dtype=np.float64)
+        lower_bb = df['lower_bb'].to_numpy(dtype=np.float64)
+        fitted = dict(thresholds,
+                      upper_bb_high=np.nanquantile(upper_bb, thresholds['high_quantile']),
+                      upper_bb_low=np.nanquantile(upper_bb, thresholds['low_quantile']),
+                      lower_bb_high=np.nanquantile(lower_bb, thresholds['high_quantile']),
+                      lower_bb_low=np.nanquantile(lower_bb, thresholds['low_quantile']))
+        return fitted
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Assign the SELL/BUY/HOLD labels with boolean masks over whole columns, as a categorical backed by int8 codes
+def assign_labels(df, fitted: dict):
+    try:
+        rsi = df['rsi'].to_numpy(dtype=np.float64)
+        macd = df['macd'].to_numpy(dtype=np.float64)
+        upper_bb = df['upper_bb'].to_numpy(dtype=np.float64)
+        lower_bb = df['lower_bb'].to_numpy(dtype=np.float64)
+
+        sell = (rsi > fitted['rsi_overbought']) & (macd < 0) & \
+               (upper_bb > fitted['upper_bb_high']) & (lower_bb < fitted['lower_bb_high'])
+        buy = (rsi < fitted['rsi_oversold']) & (macd > 0) & \
+              (upper_bb < fitted['upper_bb_low']) & (lower_bb > fitted['lower_bb_low'])
+
+        codes = np.zeros(len(df), dtype=np.int8)
+        codes[buy] = LABELS.index('BUY')
+        codes[sell] = LABELS.index('SELL')
+        return pd.Categorical.from_codes(codes, categories=LABELS)
+    except Exception as e:
+        raise CustomException(e)
+
+
+# Define label column. Thresholds are fitted on the train data and reused on the test data.
+def add_label(train_df, test_df, df_name, thresholds: dict = None):
+    fitted = fit_label_thresholds(train_df, thresholds)
+    train_df['label'] = assign_labels(train_df, fitted)
+    test_df['label'] = assign_labels(test_df, fitted)
     logger.info(f"Added label column, wrt indicators for dataframe {df_name}.")
 
     return [train_df, test_df]
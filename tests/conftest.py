@@ -0,0 +1,25 @@
+import os
+import tempfile
+import pytest
+
+
+# The tests run outside the repository, so that the '.logs' opened by src.log and the '.artifacts' written by the
+# stages stay out of it: a session directory before any import of src, then a directory per test
+def pytest_configure(config):
+    os.chdir(tempfile.mkdtemp(prefix='trading-pipeline-tests-'))
+
+
+@pytest.fixture(autouse=True)
+def _work_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+# SQLite stand-in database used by all the database calls of a test, with the 'production' schema attached
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    pytest.importorskip('sqlalchemy')
+    from src import utils
+    from src.benchmarks import stand_in_engine
+    engine = stand_in_engine(work_dir=str(tmp_path / 'db'))
+    monkeypatch.setattr(utils, '_ENGINE', engine)
+    return engine
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src import catalog, cli
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import time budget of the entry point, in milliseconds
+IMPORT_BUDGET_MS = 100
+
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'sqlalchemy', 'pyarrow', 'dill', 'talib']
+
+# Import time budgets of the stages and of the modules the scheduler's worker processes import to run their tasks,
+# in milliseconds. pandas and numpy are imported first: every stage needs them, the budget is the modules' own cost.
+STAGE_IMPORT_BUDGETS_MS = {
+    'src.utils': 100,
+    'src.scheduler': 100,
+    'src.components.data_ingestion': 150,
+    'src.components.data_transformation': 150,
+    'src.pipelines.transformation_pipeline': 150,
+}
+
+# Modules only imported by the functions that use them
+DEFERRED_MODULES = ['sklearn', 'scipy', 'sqlalchemy', 'dill', 'talib', 'persiantools', 'pyarrow.parquet',
+                    'pyarrow.feather']
+
+
+# Time to import a module in a fresh interpreter, after the 'preloaded' modules, and the 'watched' modules it loads
+def _import_report(module: str, watched: list, preloaded: list = ()):
+    code = (f"import json, sys, time; {''.join(f'import {m}; ' for m in preloaded)}"
+            f"start = time.perf_counter(); import {module}; elapsed = time.perf_counter() - start; "
+            f"print(json.dumps(dict(ms=elapsed * 1000, loaded=[m for m in {watched!r} if m in sys.modules])))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_cli_import_is_cheap():
+    report = _import_report('src.cli', HEAVY_MODULES)
+    assert report['loaded'] == []
+    assert report['ms'] < IMPORT_BUDGET_MS
+
+
+@pytest.mark.parametrize('module', list(STAGE_IMPORT_BUDGETS_MS))
+def test_stage_imports_are_cheap(module):
+    report = _import_report(module, DEFERRED_MODULES, preloaded=['pandas', 'numpy'])
+    assert report['loaded'] == []
+    assert report['ms'] < STAGE_IMPORT_BUDGETS_MS[module]
+
+
+def test_unknown_tables_are_a_usage_error(monkeypatch, capsys):
+    monkeypatch.setattr(catalog, 'fetch_schema_catalog', lambda schema: {'symbol': dict(columns=['j_date'], dtypes={},
+                                                                                       row_count=0, watermark=None)})
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(['ingest', '--tables', 'symbol', 'missing'])
+    assert exit_info.value.code == 2
+    assert "Tables ['missing'] are not in the 'production' catalog." in capsys.readouterr().err
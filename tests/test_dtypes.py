@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.artifact_store import ArtifactStore
+from src.benchmarks import synthetic_table
+from src.dtypes import DtypePolicy, feature_columns
+from src.utils import add_date_columns
+
+
+# A raw table whose integer ids have missing values, so that they are read from the database as floats
+def _raw_table():
+    df = add_date_columns(synthetic_table(200, seed=1), 'symbol')
+    df['market.id'] = df['market.id'].astype(float)
+    df['category.id'] = df['category.id'].astype(float)
+    df.loc[df.index[::9], ['market.id', 'category.id']] = np.nan
+    return df
+
+
+def test_integer_ids_with_missing_values_are_integer_strings():
+    raw = _raw_table()
+    typed = DtypePolicy().apply(raw, 'symbol')
+    complete = DtypePolicy().apply(raw.dropna(subset=['market.id']).astype({'market.id': 'int64'}), 'symbol')
+
+    assert list(typed['market.id'].cat.categories) == list(complete['market.id'].cat.categories)
+    assert not any(value.endswith('.0') for value in typed['category.id'].cat.categories)
+    assert typed['market.id'].isna().tolist() == raw['market.id'].isna().tolist()
+
+
+@pytest.mark.parametrize('backend', ['parquet', 'feather', 'csv'])
+def test_stored_frames_keep_the_policy_dtypes(backend):
+    policy = DtypePolicy()
+    typed = policy.apply(_raw_table(), 'symbol')
+    policy.save()
+    store = ArtifactStore(backend)
+    path = store.artifact_path('symbol', 'raw')
+    store.write(typed, path)
+
+    read = store.read(path)
+    assert feature_columns(read) == feature_columns(typed)
+    assert 'category.id' not in feature_columns(read)[0]
+    for col in ['market.id', 'category.id']:
+        assert isinstance(read[col].dtype, pd.CategoricalDtype)
+        pd.testing.assert_series_equal(read[col].astype(object), typed[col].astype(object))
+
+
+def test_date_parts_are_not_features():
+    num_feats, cat_feats = feature_columns(DtypePolicy().apply(_raw_table(), 'symbol'))
+    assert not {'jal_year', 'jal_month', 'jal_day', 'greg_date'} & set(num_feats + cat_feats)
+    assert 'close_price' in num_feats and cat_feats == ['category.id', 'market.id']
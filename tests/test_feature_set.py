@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from src.feature_set import FeatureSet, _csr_nbytes
+
+
+def _X(n_rows: int, n_cols: int, density: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 1, (n_rows, n_cols)) * (rng.random((n_rows, n_cols)) < density)
+    X[0, 0] = np.nan
+    return X
+
+
+@pytest.mark.parametrize('density', [0.0, 0.05, 0.3, 0.7, 1.0])
+def test_csr_size_estimate_matches_scipy(density):
+    X = _X(200, 30, density)
+    csr = sparse.csr_matrix(X.astype(np.float32))
+    assert _csr_nbytes(np.count_nonzero(X), *X.shape) == csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes
+
+
+@pytest.mark.parametrize('density, is_sparse', [(0.05, True), (0.9, False)])
+@pytest.mark.parametrize('as_sparse', [False, True])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_load_round_trip(tmp_path, density, is_sparse, as_sparse, mmap):
+    X = _X(300, 40, density)
+    labels = ['HOLD', 'BUY', 'SELL']
+    y = np.random.default_rng(1).choice(labels, len(X))
+    names = [f"f{j}" for j in range(X.shape[1])]
+    feature_set = FeatureSet.from_arrays(sparse.csr_matrix(X) if as_sparse else X, y, names, labels)
+    assert feature_set.is_sparse == is_sparse
+
+    feature_set.save(str(tmp_path))
+    loaded = FeatureSet.load(str(tmp_path), mmap=mmap)
+    assert loaded.is_sparse == is_sparse
+    assert loaded.feature_names == names and loaded.labels == labels
+    X_loaded = loaded.X.toarray() if loaded.is_sparse else np.asarray(loaded.X)
+    assert X_loaded.dtype == np.float32
+    np.testing.assert_array_equal(X_loaded, X.astype(np.float32))
+    assert loaded.y.dtype == np.int8
+    assert loaded.label_values().tolist() == y.tolist()
+    assert loaded.nbytes == feature_set.nbytes
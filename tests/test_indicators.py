@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from src.indicators import BACKENDS, INDICATOR_SPECS, StreamingIndicators, compute_indicators
+
+SPECS = INDICATOR_SPECS + [dict(kind='MACD', fastperiod=26, slowperiod=12, signalperiod=5, columns=['m', 's', 'h']),
+                           dict(kind='BBANDS', timeperiod=2, nbdevup=1, nbdevdn=3, columns=['u', 'mid', 'l'])]
+
+
+# Random walk of prices around 1000, one step in ten flat
+def _prices(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 1, n) * (rng.random(n) > 0.1)
+    return 1000 + np.cumsum(steps)
+
+
+@pytest.mark.skipif('talib' not in BACKENDS, reason="TA-Lib is not installed")
+@pytest.mark.parametrize('n', [5, 26, 34, 35, 1_000, 1_000_000])
+def test_numpy_backend_matches_talib(n):
+    close = _prices(n)
+    columns, expected = compute_indicators(close, SPECS, backend='talib')
+    _, values = compute_indicators(close, SPECS, backend='numpy')
+
+    for j, col in enumerate(columns):
+        assert np.array_equal(np.isnan(values[:, j]), np.isnan(expected[:, j])), col
+        np.testing.assert_allclose(values[:, j], expected[:, j], rtol=1e-9, atol=1e-8, equal_nan=True, err_msg=col)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_streaming_indicators_match_batch(seed):
+    rng = np.random.default_rng(seed)
+    close = _prices(3_000, seed)
+    _, expected = compute_indicators(close, SPECS, backend='numpy')
+
+    # Chunks of 0, 1, a few and many prices, so that the warm-up periods span several chunks
+    cuts = np.sort(rng.choice(np.arange(1, len(close)), size=300, replace=True))
+    chunks = np.split(close, np.concatenate([[0, 0, 1, 2], cuts]))
+    indicators = StreamingIndicators(SPECS)
+    values = np.concatenate([indicators.update(chunk)[1] for chunk in chunks])
+
+    assert np.array_equal(np.isnan(values), np.isnan(expected))
+    np.testing.assert_allclose(values, expected, rtol=1e-9, atol=1e-8, equal_nan=True)
+
+
+@pytest.mark.parametrize('cut', [0, 1, 3, 20, 40, 2_999])
+def test_streaming_indicators_resume_from_their_state(cut):
+    close = _prices(3_000, cut)
+    _, expected = compute_indicators(close, SPECS, backend='numpy')
+
+    indicators = StreamingIndicators(SPECS)
+    head = indicators.update(close[:cut])[1]
+    state = indicators.get_state()
+    assert state.shape == (indicators.state_size,) and state.dtype == np.float64
+    resumed = StreamingIndicators(SPECS).set_state(state.copy())
+    values = np.concatenate([head, resumed.update(close[cut:])[1]])
+
+    np.testing.assert_allclose(values, expected, rtol=1e-9, atol=1e-8, equal_nan=True)
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.indicators import add_indicators
+from src.latest_state import BAND_COLUMNS, THRESHOLD_COLUMNS, LatestStateIndex
+from src.utils import add_label, fit_label_thresholds, LABELS
+
+
+# Per-symbol frames of a random walk, with symbols of very different history lengths
+def _frames(lengths=(300, 40, 5, 1, 120), seed=0):
+    rng = np.random.default_rng(seed)
+    return {f"SYM{i}": pd.DataFrame({'greg_date': pd.date_range('2020-01-01', periods=n, freq='D'),
+                                     'close_price': 1000 + np.cumsum(rng.normal(0, 5, n))})
+            for i, n in enumerate(lengths)}
+
+
+# Frame of a symbol whose random walk never leaves HOLD: a flat stretch, a rally and its retracement, then a sharp
+# rebound that the thresholds of its whole history label SELL, and a few flat bars
+def _shock_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    close = np.concatenate([800 + rng.normal(0, 3, 300), np.linspace(800, 1000, 11)[1:],
+                            np.linspace(1000, 800, 31)[1:], 800 + 60 * np.arange(1, 4), 980 + rng.normal(0, 3, 10)])
+    return pd.DataFrame({'greg_date': pd.date_range('2020-01-01', periods=len(close), freq='D'), 'close_price': close})
+
+
+# Label of the last bar of a symbol, as the batch path labels it: thresholds fitted over its whole history
+def _batch_label(df):
+    indicators = add_indicators(df)
+    _, last = add_label(indicators.copy(), indicators.iloc[-1:].copy(), 'symbol')
+    return last['label'].iloc[0]
+
+
+@pytest.mark.parametrize('cut', [1, 30, 200])
+def test_stored_index_updates_like_a_full_rebuild(cut, tmp_path):
+    frames = _frames()
+    expected = LatestStateIndex.from_frames(frames)
+
+    # First bars, stored and loaded back (memory-mapped), then the rest of the bars
+    index = LatestStateIndex.from_frames({symbol: df.iloc[:cut] for symbol, df in frames.items()})
+    index.save(str(tmp_path))
+    assert not any(name.endswith('.pkl') for name in os.listdir(tmp_path))
+    index = LatestStateIndex.load(str(tmp_path))
+    index.update_frames({symbol: df.iloc[cut:] for symbol, df in frames.items()})
+
+    assert index.symbols == expected.symbols
+    for name in ['days', 'closes', 'values', 'states', 'thresholds', 'band_samples', 'band_seen']:
+        np.testing.assert_allclose(getattr(index, name), getattr(expected, name), rtol=1e-9, atol=1e-8,
+                                   equal_nan=True, err_msg=name)
+    pd.testing.assert_frame_equal(index.screen(sort_by='close'), expected.screen(sort_by='close'))
+
+
+def test_labels_match_add_label_over_the_whole_history():
+    frames = {**_frames((300, 40, 1)), 'SHOCK': _shock_frame()}
+    index = LatestStateIndex.from_frames({symbol: df.iloc[:200] for symbol, df in frames.items()})
+
+    # The rest of the bars one at a time: each label is that of the thresholds refitted over the history so far
+    labels = []
+    for end in range(201, len(frames['SHOCK']) + 1):
+        index.update_frames({symbol: df.iloc[end - 1:end] for symbol, df in frames.items()})
+        for symbol, df in frames.items():
+            if end > len(df):
+                continue
+            history = df.iloc[:end]
+            i = index.symbols.index(symbol)
+            fitted = fit_label_thresholds(add_indicators(history))
+            np.testing.assert_allclose(index.thresholds[i], [fitted[col] for col in THRESHOLD_COLUMNS],
+                                       rtol=1e-12, equal_nan=True)
+            labels.append(LABELS[index.labels[i]])
+            assert labels[-1] == _batch_label(history), (symbol, end)
+    assert 'SELL' in labels
+
+
+def test_band_samples_beyond_capacity(tmp_path):
+    frames = _frames((300, 40))
+    index = LatestStateIndex.from_frames({symbol: df.iloc[:150] for symbol, df in frames.items()}, n_band_samples=16)
+    index.save(str(tmp_path))
+    index.update_frames({symbol: df.iloc[150:] for symbol, df in frames.items()})
+
+    for i, (symbol, df) in enumerate(frames.items()):
+        bands = add_indicators(df)[BAND_COLUMNS].to_numpy()
+        for j in range(len(BAND_COLUMNS)):
+            values = bands[:, j][~np.isnan(bands[:, j])]
+            assert index.band_seen[i, j] == len(values)
+            sample = index.band_samples[i, j, :min(len(values), 16)]
+            assert (np.abs(sample[:, None] - values[None, :]).min(axis=1) < 1e-8).all()
+        lower, upper = np.nanmin(bands[:, 0]), np.nanmax(bands[:, 0])
+        assert lower <= index.thresholds[i, 1] <= index.thresholds[i, 0] <= upper
+
+    # A stored index resumes with the same draws
+    resumed = LatestStateIndex.load(str(tmp_path))
+    resumed.update_frames({symbol: df.iloc[150:] for symbol, df in frames.items()})
+    for name in ['band_samples', 'band_seen', 'thresholds', 'labels']:
+        np.testing.assert_array_equal(getattr(resumed, name), getattr(index, name), err_msg=name)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from src.market_context import MarketContext
+
+
+def _context():
+    index_df = pd.DataFrame({'greg_date': pd.to_datetime(['2023-01-10', '2023-01-03', '2023-01-05', '2023-01-05']),
+                             'close': [4.0, 1.0, 2.0, 3.0], 'volume': [40.0, 10.0, 20.0, 30.0]})
+    news_df = pd.DataFrame({'greg_date': pd.to_datetime(['2023-01-04', '2023-01-01', '2023-01-10', '2023-01-04'])})
+    return MarketContext.from_frames(index_df, news_df, windows=[1, 7])
+
+
+def test_join_is_as_of_each_date():
+    context = _context()
+    assert context.columns == ['index_close', 'index_volume', 'news_count_1d', 'news_count_7d']
+
+    # Unsorted dates: before the first index date, on index dates (the last row of a date wins), between them and
+    # after the last one
+    dates = pd.to_datetime(['2023-01-11', '2023-01-02', '2023-01-05', '2023-01-03', '2023-01-09', '2023-01-04'])
+    values = context.join(dates.to_numpy())
+
+    expected_index = [[4, 40], [np.nan, np.nan], [3, 30], [1, 10], [3, 30], [1, 10]]
+    np.testing.assert_array_equal(values[:, :2], expected_index)
+    # News of the trailing windows, the date itself included: (date - window, date]
+    assert values[:, 2].tolist() == [0, 0, 0, 0, 0, 2]
+    assert values[:, 3].tolist() == [1, 1, 3, 1, 2, 3]
+
+
+def test_join_matches_merge_asof():
+    rng = np.random.default_rng(2)
+    index_dates = pd.to_datetime('2023-01-01') + pd.to_timedelta(np.sort(rng.choice(200, 60, replace=False)), 'D')
+    index_df = pd.DataFrame({'greg_date': index_dates, 'close': rng.normal(size=60)})
+    context = MarketContext.from_frames(index_df.sample(frac=1, random_state=0))
+    dates = pd.to_datetime('2022-12-20') + pd.to_timedelta(rng.integers(0, 230, 500), 'D')
+
+    expected = pd.merge_asof(pd.DataFrame({'greg_date': dates}).reset_index().sort_values('greg_date'), index_df,
+                             on='greg_date').sort_values('index')['close'].to_numpy()
+    np.testing.assert_array_equal(context.join(dates.to_numpy())[:, 0], expected)
+
+
+def test_add_context_keeps_the_rows_and_replaces_stale_columns():
+    context = _context()
+    df = pd.DataFrame({'greg_date': pd.to_datetime(['2023-01-06', '2023-01-01']), 'index_close': [-1.0, -1.0]},
+                      index=[7, 3])
+    out = context.add_context(df)
+    assert out.index.tolist() == [7, 3]
+    assert out.columns.tolist() == ['greg_date'] + context.columns
+    np.testing.assert_array_equal(out['index_close'], [3, np.nan])
+
+
+def test_save_load_round_trip(tmp_path):
+    context = _context()
+    context.save(str(tmp_path))
+    loaded = MarketContext.load(str(tmp_path))
+    dates = pd.date_range('2022-12-30', '2023-01-12').to_numpy()
+    assert loaded.columns == context.columns
+    np.testing.assert_array_equal(loaded.join(dates), context.join(dates))
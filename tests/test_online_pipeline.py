@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.benchmarks import synthetic_table
+from src.dtypes import DtypePolicy, feature_columns
+from src.indicators import add_indicators
+from src.market_context import MarketContext
+from src.pipelines.online_pipeline import OnlineTransformer
+from src.pipelines.preprocessor_state import FittedPreprocessor
+from src.pipelines.transformation_pipeline import make_preprocessor_pipeline
+from src.utils import add_date_columns
+
+pytest.importorskip('sklearn')
+
+
+# Market context of the dates of a table: index values from its 50th date on, on every third date (so that bars
+# fall before the first index date, on index dates and between them), and news on random dates
+def _market_context(dates):
+    rng = np.random.default_rng(8)
+    index_dates = np.unique(dates)[50::3]
+    index_df = pd.DataFrame({'greg_date': index_dates, 'close': rng.normal(1000, 50, len(index_dates)),
+                             'volume': rng.integers(1, 1_000, len(index_dates)).astype(float)})
+    news_df = pd.DataFrame({'greg_date': rng.choice(dates, 300)})
+    return MarketContext.from_frames(index_df, news_df)
+
+
+@pytest.mark.parametrize('with_context', [False, True])
+def test_online_transformer_matches_batch_bar_by_bar(with_context):
+    df = add_date_columns(synthetic_table(600, seed=3), 'symbol')
+    df.loc[df.index[::7], 'volume'] = np.nan
+    df.loc[df.index[::11], 'market.id'] = None
+    df = DtypePolicy().apply(df, 'symbol').sort_values('greg_date', ignore_index=True)
+    market_context = _market_context(df['greg_date'].to_numpy()) if with_context else None
+    num_feats, cat_feats = feature_columns(df if market_context is None else market_context.add_context(df))
+    if market_context is not None:
+        assert set(market_context.columns) < set(num_feats)
+
+    # Batch path: indicators over the whole series, preprocessor fitted on the train rows
+    batch_df = add_indicators(df if market_context is None else market_context.add_context(df))
+    train_df, test_df = batch_df.iloc[:400], batch_df.iloc[400:]
+    preprocessor = FittedPreprocessor.from_column_transformer(
+        make_preprocessor_pipeline(num_feats, cat_feats).fit(train_df))
+    expected = preprocessor.transform(test_df)
+
+    # Online path: indicator state warmed up over the train rows, then fed the test bars (without any context
+    # column) one at a time
+    transformer = OnlineTransformer.from_history(preprocessor, df.iloc[:400], market_context=market_context)
+    for i, bar in enumerate(df.iloc[400:].to_dict('records')):
+        np.testing.assert_allclose(transformer.transform_bar(bar), expected[i], rtol=1e-6, atol=1e-6)
+        online_indicators = [transformer.last_indicators[col] for col in transformer.indicators.columns]
+        np.testing.assert_allclose(online_indicators, test_df[transformer.indicators.columns].iloc[i].to_numpy(),
+                                   rtol=1e-9, atol=1e-9, equal_nan=True)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.benchmarks import synthetic_table
+from src.dtypes import DtypePolicy, feature_columns
+from src.panel import Panel
+from src.pipelines.panel_pipeline import PanelPreprocessor
+from src.utils import add_date_columns
+
+
+def _frames(lengths=(50, 0, 120, 7)):
+    policy = DtypePolicy()
+    return {f"SYM{i}": policy.apply(add_date_columns(synthetic_table(n, seed=i), f"SYM{i}"))
+            for i, n in enumerate(lengths)}
+
+
+def _panel(lengths=(50, 0, 120, 7)):
+    return Panel.from_frames(_frames(lengths))
+
+
+@pytest.mark.parametrize('split', ['chronological', 'random'])
+def test_split_matches_the_per_symbol_split(split):
+    panel = _panel()
+    mask = panel.train_mask(0.2) if split == 'chronological' else \
+        np.random.default_rng(0).random(len(panel.data)) < 0.7
+    train, test = panel.split(mask)
+
+    for part, rows in [(train, mask), (test, ~mask)]:
+        assert part.symbols == panel.symbols
+        assert part.offsets[-1] == len(part.data) == rows.sum()
+        assert part.data.index.equals(pd.RangeIndex(len(part.data)))
+        for symbol in panel.symbols:
+            start, end = panel.bounds(symbol)
+            expected = panel.view(symbol)[rows[start:end]].reset_index(drop=True)
+            pd.testing.assert_frame_equal(part.view(symbol).reset_index(drop=True), expected)
+
+
+def test_transform_rejects_other_symbols():
+    panel = _panel()
+    num_feats, cat_feats = feature_columns(panel.data)
+    preprocessor = PanelPreprocessor(num_feats, cat_feats).fit(panel)
+    other = _panel((30, 40))
+    with pytest.raises(ValueError, match="symbols differ"):
+        preprocessor.transform(other)
+
+
+def test_vocabularies_come_from_the_fitted_rows():
+    policy = DtypePolicy()
+    raw = add_date_columns(synthetic_table(100, seed=3), 'SYM0')
+    raw.loc[raw.index[-1], 'market.id'] = 99
+    panel = Panel.from_frames({'SYM0': policy.apply(raw, 'SYM0'), 'SYM1': _frames((60,))['SYM0']})
+    assert '99' in panel.data['market.id'].cat.categories
+
+    mask = panel.train_mask(0.2)
+    preprocessor = PanelPreprocessor(*feature_columns(panel.data)).fit(panel, mask)
+    vocabulary = preprocessor.vocabularies[preprocessor.cat_feats.index('market.id')]
+    assert vocabulary == sorted(set(panel.data.loc[mask, 'market.id'].astype(str)))
+    assert '99' not in vocabulary
+
+    # The test row of the value unseen in the train rows encodes as all zeros, as an unknown category
+    X = preprocessor.transform(panel)
+    columns = [i for i, name in enumerate(preprocessor.feature_names) if name.startswith('cat_pipeline__market.id_')]
+    assert not X[panel.bounds('SYM0')[1] - 1, columns].any()
+
+
+def test_panel_transformation_stores_the_split_offsets(monkeypatch):
+    from src import catalog
+    from src.artifact_store import ArtifactStore
+    from src.catalog import DataCatalog
+    from src.components.panel_transformation import PanelTransformation
+    from src.utils import load_json
+
+    frames = _frames((40, 25, 90))
+    store = ArtifactStore()
+    for symbol, df in frames.items():
+        store.write(df, store.artifact_path(symbol, 'raw'))
+    monkeypatch.setattr(catalog, 'fetch_schema_catalog', lambda schema: {
+        symbol: dict(columns=list(df.columns), dtypes={}, row_count=len(df), watermark=None)
+        for symbol, df in frames.items()})
+
+    train_features, test_features, index_path = PanelTransformation(
+        catalog=DataCatalog('production'), store=store).initiate_panel_transformation()
+    index = load_json(index_path)
+
+    panel = Panel.from_frames(frames)
+    train, test = panel.split(panel.train_mask(0.2))
+    assert index['symbols'] == panel.symbols
+    assert index['train_offsets'] == train.offsets.tolist() and index['test_offsets'] == test.offsets.tolist()
+    assert index['train_offsets'][-1] == train_features.X.shape[0]
+    assert index['test_offsets'][-1] == test_features.X.shape[0]
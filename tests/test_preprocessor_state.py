@@ -0,0 +1,97 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from src.benchmarks import synthetic_table
+from src.dtypes import DtypePolicy, feature_columns
+from src.exceptions import CustomException
+from src.pipelines.preprocessor_state import FittedPreprocessor
+from src.utils import add_date_columns
+
+pytest.importorskip('sklearn')
+from src.pipelines.transformation_pipeline import make_preprocessor_pipeline
+
+
+# Typed table with missing numerical and categorical values, split into train and test rows
+def _frames(n: int = 600):
+    df = add_date_columns(synthetic_table(n, seed=5), 'symbol')
+    df['volume'] = df['volume'].astype(float)
+    df.loc[df.index[::6], 'volume'] = np.nan
+    df['market.id'] = df['market.id'].astype(float)
+    df.loc[df.index[::13], 'market.id'] = np.nan
+    df = DtypePolicy().apply(df, 'symbol')
+    return df.iloc[:400], df.iloc[400:]
+
+
+@pytest.fixture
+def fitted():
+    train_df, test_df = _frames()
+    column_transformer = make_preprocessor_pipeline(*feature_columns(train_df)).fit(train_df)
+    return column_transformer, train_df, test_df
+
+
+def test_transform_matches_the_column_transformer(fitted):
+    column_transformer, train_df, test_df = fitted
+    preprocessor = FittedPreprocessor.from_column_transformer(column_transformer)
+
+    assert preprocessor.get_feature_names_out().tolist() == column_transformer.get_feature_names_out().tolist()
+    for df in [train_df, test_df]:
+        expected = column_transformer.transform(df)
+        expected = expected.toarray() if hasattr(expected, 'toarray') else expected
+        X = preprocessor.transform(df)
+        assert X.dtype == np.float32 and X.shape == expected.shape
+        np.testing.assert_allclose(X, expected, rtol=1e-6, atol=1e-5)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_load_round_trip(fitted, tmp_path, mmap):
+    column_transformer, _, test_df = fitted
+    preprocessor = FittedPreprocessor.from_column_transformer(column_transformer)
+    preprocessor.save(str(tmp_path))
+
+    loaded = FittedPreprocessor.load(str(tmp_path), mmap=mmap)
+    assert loaded.feature_names == preprocessor.feature_names
+    assert loaded.most_frequent == preprocessor.most_frequent
+    np.testing.assert_array_equal(loaded.transform(test_df), preprocessor.transform(test_df))
+
+
+def _edit_spec(dir_path: str, **changes):
+    path = os.path.join(dir_path, 'spec.json')
+    with open(path) as f:
+        spec = json.load(f)
+    spec.update(changes)
+    with open(path, "w") as f:
+        json.dump(spec, f)
+
+
+def test_load_rejects_a_stale_or_corrupted_state(fitted, tmp_path):
+    preprocessor = FittedPreprocessor.from_column_transformer(fitted[0])
+    dir_path = str(tmp_path)
+    state_path = os.path.join(dir_path, 'state.npy')
+
+    # Another layout version
+    preprocessor.save(dir_path)
+    _edit_spec(dir_path, version=0)
+    with pytest.raises(CustomException, match="Unsupported preprocessor state version 0"):
+        FittedPreprocessor.load(dir_path)
+
+    # A state of another size than its spec (e.g. a spec and state from different saves)
+    preprocessor.save(dir_path)
+    np.save(state_path, np.load(state_path)[:-1])
+    with pytest.raises(CustomException, match="does not match its spec"):
+        FittedPreprocessor.load(dir_path)
+    preprocessor.save(dir_path)
+    _edit_spec(dir_path, vocabularies=[vocabulary[:-1] for vocabulary in preprocessor.vocabularies])
+    with pytest.raises(CustomException, match="does not match its spec"):
+        FittedPreprocessor.load(dir_path)
+
+    # A changed value, of the same size: only the checksum catches it
+    preprocessor.save(dir_path)
+    state = np.load(state_path)
+    state[0] += 1.0
+    np.save(state_path, state)
+    with pytest.raises(CustomException, match="failed its checksum"):
+        FittedPreprocessor.load(dir_path)
+    assert FittedPreprocessor.load(dir_path, verify=False).medians[0] == preprocessor.medians[0] + 1.0
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from src.exceptions import CustomException
+from src.scheduler import run_tables
+
+
+# Task of the tests: the table's value times a factor, in the worker's process. Tables named 'bad*' fail, those
+# named 'custom*' with the CustomException of the stages, which does not unpickle in the parent process.
+def _task(df_name: str, value: int, factor: int = 1):
+    if df_name.startswith('bad'):
+        raise KeyError(f"no column for {df_name}")
+    if df_name.startswith('custom'):
+        try:
+            1 / 0
+        except Exception as e:
+            raise CustomException(e)
+    return dict(value=value * factor, pid=os.getpid())
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_failed_tables_do_not_stop_the_others(max_workers):
+    tasks = {'a': (1, 10), 'bad_b': (2,), 'c': (3, 10), 'custom_d': (4,), 'e': (5,)}
+    results, failures = run_tables(_task, tasks, max_workers=max_workers)
+
+    assert {df_name: result['value'] for df_name, result in results.items()} == {'a': 10, 'c': 30, 'e': 5}
+    assert set(failures) == {'bad_b', 'custom_d'}
+    assert failures['bad_b'] == "KeyError: 'no column for bad_b'"
+    assert failures['custom_d'].startswith('CustomException') and 'division by zero' in failures['custom_d']
+
+
+def test_serial_path_runs_in_this_process():
+    results, failures = run_tables(_task, {'a': (1,), 'b': (2,)}, max_workers=1)
+    assert failures == {}
+    assert {result['pid'] for result in results.values()} == {os.getpid()}
+
+
+def test_pool_runs_in_worker_processes():
+    results, failures = run_tables(_task, {f"t{i}": (i,) for i in range(6)}, max_workers=2)
+    assert failures == {}
+    assert [results[f"t{i}"]['value'] for i in range(6)] == list(range(6))
+    assert os.getpid() not in {result['pid'] for result in results.values()}
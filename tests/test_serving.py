@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.serving import ChartDataServer, ohlc_resample
+
+
+@pytest.fixture
+def server(stand_in):
+    close = np.arange(10, dtype=float)
+    df = pd.DataFrame({'id': range(10), 'j_date': [f"1402/1/{d}" for d in range(1, 11)], 'close_price': close,
+                       'volume': np.nan})
+    with stand_in.begin() as conn:
+        df.to_sql('symbol', con=conn, schema='production', index=False)
+    return ChartDataServer()
+
+
+def test_ohlc_resample_of_an_empty_series():
+    bars = ohlc_resample(np.array([], dtype='datetime64[ns]'), np.array([]), 100)
+    assert all(len(values) == 0 for values in bars.values())
+    assert bars['x'].dtype == np.dtype('datetime64[ns]') and bars['open'].dtype == np.float64
+
+
+def test_ohlc_resample_buckets():
+    dates = np.arange('2023-01-01', '2023-01-11', dtype='datetime64[D]')
+    bars = ohlc_resample(dates, np.arange(10.0), 3)
+    assert bars['x'].tolist() == dates[[0, 3, 6]].tolist()
+    assert bars['open'].tolist() == [0, 3, 6] and bars['close'].tolist() == [2, 5, 9]
+    assert bars['high'].tolist() == [2, 5, 9] and bars['low'].tolist() == [0, 3, 6]
+
+
+@pytest.mark.parametrize('start, end, column', [('1402/2/1', '1402/3/1', 'close_price'),
+                                                ('1402/1/1', '1402/1/10', 'volume')])
+def test_charts_of_a_range_without_prices_are_empty(server, start, end, column):
+    ohlc = server.ohlc('symbol', start, end, width=100) if column == 'close_price' else None
+    line = server.line('symbol', start, end, width=100, column=column)
+    assert line['x'] == [] and line['y']['bdata'] == ''
+    if ohlc is not None:
+        assert ohlc['x'] == [] and all(ohlc[k]['bdata'] == '' for k in ['open', 'high', 'low', 'close'])
+        json.loads(server.to_json(ohlc, line))
+
+
+def test_ohlc_of_a_range(server):
+    trace = server.ohlc('symbol', '1402/1/3', '1402/1/7', width=100)
+    assert len(trace['x']) == 5
+    assert np.frombuffer(__import__('base64').b64decode(trace['close']['bdata']), '<f8').tolist() == [2, 3, 4, 5, 6]
@@ -0,0 +1,115 @@
+import os
+import shutil
+import time
+
+import pandas as pd
+
+from src.stage_cache import StageCache
+
+
+def _write(path: str, text: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def _read(path: str):
+    with open(path) as f:
+        return f.read()
+
+
+def test_keys_follow_the_inputs_content():
+    cache = StageCache()
+    df = pd.DataFrame({'a': [1, 2]})
+    _write('in.txt', 'x')
+    key = cache.make_key('transformation', df, 'in.txt', 3)
+    assert key == cache.make_key('transformation', df.copy(), 'in.txt', 3)
+    assert key != cache.make_key('transformation', df.assign(a=[1, 3]), 'in.txt', 3)
+    assert key != cache.make_key('ingestion', df, 'in.txt', 3)
+    _write('in.txt', 'y')
+    assert key != cache.make_key('transformation', df, 'in.txt', 3)
+
+
+def test_miss_store_then_hit():
+    cache = StageCache()
+    outputs = ['out/a.txt', 'out/dir']
+    key = cache.make_key('transformation', 'inputs')
+    assert not cache.fetch(key, outputs)
+
+    _write('out/a.txt', 'a')
+    _write('out/dir/b.txt', 'b')
+    cache.store(key, outputs)
+    shutil.rmtree('out')
+    assert cache.fetch(key, outputs)
+    assert _read('out/a.txt') == 'a' and _read('out/dir/b.txt') == 'b'
+    # Only complete entries, no temporary directory left behind
+    assert os.listdir(cache.cache_dir) == [key]
+
+
+def test_evicts_least_recently_used_entries_over_the_budget():
+    cache = StageCache(max_bytes=250)
+    keys = [cache.make_key('transformation', i) for i in range(3)]
+    for i, key in enumerate(keys):
+        _write('out.txt', 'x' * 100)
+        cache.store(key, ['out.txt'])
+        os.utime(os.path.join(cache.cache_dir, key), (time.time() - 100 + i, time.time() - 100 + i))
+        if i == 1:
+            # A hit makes the first entry the most recently used
+            assert cache.fetch(keys[0], ['out.txt'])
+    assert sorted(os.listdir(cache.cache_dir)) == sorted([keys[0], keys[2]])
+    assert not cache.fetch(keys[1], ['out.txt'])
+
+
+def test_entry_removed_by_another_process_is_a_miss(monkeypatch):
+    from src import stage_cache
+    cache = StageCache()
+    key = cache.make_key('transformation', 'inputs')
+    _write('out/a.txt', 'a')
+    cache.store(key, ['out/a.txt'])
+
+    # Another process evicts the entry between the existence check and the copy
+    def evicted_copy(src, dst):
+        shutil.rmtree(os.path.join(cache.cache_dir, key))
+        raise FileNotFoundError(src)
+    monkeypatch.setattr(stage_cache, '_copy', evicted_copy)
+    assert not cache.fetch(key, ['out/a.txt'])
+
+    # Eviction skips the entries that disappear while it lists them
+    monkeypatch.setattr(stage_cache, '_size', lambda path: (_ for _ in ()).throw(FileNotFoundError(path)))
+    cache.evict()
+
+
+def test_store_of_an_existing_entry_keeps_it():
+    cache = StageCache()
+    key = cache.make_key('transformation', 'inputs')
+    _write('out/a.txt', 'a')
+    cache.store(key, ['out/a.txt'])
+    cache.store(key, ['out/a.txt'])
+    assert os.listdir(cache.cache_dir) == [key]
+    assert cache.fetch(key, ['out/a.txt'])
+
+
+# Worker of the concurrency test: store and fetch entries of a cache shared with other processes, over a budget
+# that keeps evicting them
+def _store_and_fetch(worker: int):
+    cache = StageCache(max_bytes=2_000)
+    hits = 0
+    for i in range(30):
+        key = cache.make_key('transformation', i % 7)
+        output = os.path.join(f"w{worker}", f"out{i}", 'dir')
+        if cache.fetch(key, [output]):
+            assert _read(os.path.join(output, 'data.txt')) == str(i % 7) * 500
+            hits += 1
+            continue
+        # A miss runs the stage, which writes its outputs, then stores them
+        _write(os.path.join(output, 'data.txt'), str(i % 7) * 500)
+        cache.store(key, [output])
+    return hits
+
+
+def test_concurrent_processes_share_the_cache():
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        hits = list(executor.map(_store_and_fetch, range(8)))
+    assert sum(hits) > 0
+    assert not [name for name in os.listdir(StageCache().cache_dir) if name.startswith('.')]
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from src.benchmarks import synthetic_table
+from src.dtypes import DtypePolicy, feature_columns
+from src.pipelines.streaming_pipeline import Reservoir, StreamingPreprocessor
+from src.utils import add_date_columns, assign_labels, fit_label_thresholds
+
+pytest.importorskip('sklearn')
+from src.pipelines.transformation_pipeline import make_preprocessor_pipeline
+
+
+# A raw table with missing volumes and market ids, and unpadded dates ('1390/1/5')
+def _raw_table(n: int, seed: int = 4):
+    df = synthetic_table(n, seed=seed)
+    df['j_date'] = ['/'.join(str(int(part)) for part in date.split('/')) for date in df['j_date']]
+    df['volume'] = df['volume'].astype(float)
+    df.loc[df.index[::7], 'volume'] = np.nan
+    df['market.id'] = df['market.id'].astype(float)
+    df.loc[df.index[::11], 'market.id'] = np.nan
+    return df
+
+
+def _dense(X):
+    return X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+
+
+def test_reservoir_below_capacity_keeps_every_value():
+    values = np.random.default_rng(0).normal(0, 1, 1_000)
+    reservoir = Reservoir(capacity=1_000)
+    for chunk in np.array_split(np.concatenate([values, [np.nan] * 10]), 7):
+        reservoir.update(chunk)
+    assert np.array_equal(np.sort(reservoir.values), np.sort(values))
+    assert reservoir.quantile(0.9) == np.quantile(values, 0.9)
+
+
+def test_streaming_preprocessor_matches_column_transformer():
+    df = DtypePolicy().apply(add_date_columns(_raw_table(700), 'symbol'), 'symbol')
+    num_feats, cat_feats = feature_columns(df)
+    expected = _dense(make_preprocessor_pipeline(num_feats, cat_feats).fit(df).transform(df))
+
+    # Chunks of uneven sizes, with a reservoir holding all the rows: the medians are exact
+    preprocessor = StreamingPreprocessor(num_feats, cat_feats, reservoir_capacity=len(df))
+    for chunk in np.array_split(np.arange(len(df)), [1, 50, 51, 300, 650]):
+        preprocessor.partial_fit(df.iloc[chunk])
+    X = preprocessor.finalize().transform(df)
+
+    assert X.shape == expected.shape
+    np.testing.assert_allclose(X, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_streaming_transformation_matches_the_batch_path(stand_in, monkeypatch):
+    from src import catalog
+    from src.catalog import DataCatalog
+    from src.components.streaming_transformation import StreamingTransformation
+    from src.feature_set import FeatureSet
+    from src.indicators import add_indicators
+
+    n, test_size = 500, 0.2
+    raw = _raw_table(n)
+    with stand_in.begin() as conn:
+        raw.sample(frac=1, random_state=0).to_sql('symbol', con=conn, schema='production', index=False)
+    monkeypatch.setattr(catalog, 'fetch_schema_catalog', lambda schema: {
+        'symbol': dict(columns=list(raw.columns), dtypes={}, row_count=n, watermark=None)})
+
+    train_parts, test_parts = StreamingTransformation(catalog=DataCatalog('production'), chunksize=64,
+                                                      test_size=test_size).initiate_streaming_transformation()
+    parts = [FeatureSet.load(path) for path in train_parts['symbol'] + test_parts['symbol']]
+    X = np.concatenate([_dense(part.X) for part in parts])
+    y = np.concatenate([part.y for part in parts])
+    n_train = sum(len(FeatureSet.load(path).y) for path in train_parts['symbol'])
+
+    # Batch path: the whole table in date order, fitted on its first rows
+    df = DtypePolicy('vocabularies.json').apply(add_date_columns(raw, 'symbol'), 'symbol')
+    df = df.sort_values('greg_date', kind='stable', ignore_index=True)
+    num_feats, cat_feats = feature_columns(df)
+    df = add_indicators(df)
+    train_df = df.iloc[:n - int(np.ceil(n * test_size))]
+    expected_X = _dense(make_preprocessor_pipeline(num_feats, cat_feats).fit(train_df).transform(df))
+    expected_y = np.asarray(assign_labels(df, fit_label_thresholds(train_df)).codes)
+
+    assert n_train == len(train_df)
+    np.testing.assert_allclose(X, expected_X, rtol=1e-5, atol=1e-5)
+    assert np.array_equal(y, expected_y)
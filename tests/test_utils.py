@@ -0,0 +1,158 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import jalali_str_to_greg
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+persiantools = pytest.importorskip('persiantools')
+from persiantools.jdatetime import JalaliDate
+
+
+# Conversion of a single date string, as the baseline did
+def _reference(date_str: str):
+    year, month, day = (int(x) for x in date_str.split('/'))
+    return JalaliDate(year, month, day).to_gregorian()
+
+
+def test_jalali_str_to_greg_matches_persiantools():
+    rng = np.random.default_rng(0)
+    days = rng.integers(0, 30_000, size=500)
+    date_strs = [JalaliDate.fromordinal(JalaliDate(1370, 1, 1).toordinal() + int(d)).strftime('%Y/%m/%d')
+                 for d in days]
+    series = pd.Series(date_strs, index=np.arange(10, 510))
+
+    dates = jalali_str_to_greg(series)
+    expected = pd.to_datetime([_reference(s) for s in date_strs])
+    assert (dates['gregorian'].to_numpy() == expected.to_numpy().astype('datetime64[D]')).all()
+    assert dates['gregorian'].index.equals(series.index)
+    assert dates['jal_year'].tolist() == [int(s[:4]) for s in date_strs]
+    assert dates['jal_month'].tolist() == [int(s[5:7]) for s in date_strs]
+    assert dates['jal_day'].tolist() == [int(s[8:]) for s in date_strs]
+
+
+def test_jalali_str_to_greg_without_zero_padding():
+    padded = jalali_str_to_greg(pd.Series(['1402/09/05', '1402/10/01', '1399/01/01']))
+    unpadded = jalali_str_to_greg(pd.Series(['1402/9/5', '1402/10/1', '1399/1/1']))
+    assert (padded['gregorian'].to_numpy() == unpadded['gregorian'].to_numpy()).all()
+    assert unpadded['gregorian'].tolist() == [pd.Timestamp(_reference(s)) for s in ['1402/9/5', '1402/10/1', '1399/1/1']]
+    assert unpadded['jal_month'].tolist() == [9, 10, 1]
+
+
+def test_jalali_str_to_greg_with_missing_dates():
+    dates = jalali_str_to_greg(pd.Series(['1402/9/5', np.nan, None, '1402/10/01']))
+    assert dates['gregorian'].isna().tolist() == [False, True, True, False]
+    assert dates['gregorian'].iloc[0] == pd.Timestamp(_reference('1402/9/5'))
+    assert dates['jal_year'].isna().tolist() == [False, True, True, False]
+    assert dates['jal_day'].iloc[3] == 1
+
+
+def test_fetch_table_since_and_date_range_compare_dates_not_strings(stand_in):
+    from src.utils import fetch_table
+    # As strings, '1402/9/5' > '1402/10/01' and '1402/12/1' < '1402/2/1'
+    j_dates = ['1402/2/1', '1402/9/5', '1402/10/01', '1402/12/1', '1403/1/2', '1401/12/29']
+    df = pd.DataFrame({'id': range(len(j_dates)), 'j_date': j_dates, 'close_price': np.arange(len(j_dates), dtype=float)})
+    with stand_in.begin() as conn:
+        df.to_sql('symbol', con=conn, schema='production', index=False)
+
+    since = fetch_table('symbol', 'production', since='1402/9/5', order_by='j_date')
+    assert since['jal_date'].tolist() == ['1402/10/01', '1402/12/01', '1403/01/02']
+
+    in_range = fetch_table('symbol', 'production', date_range=('1402/2/1', '1402/10/1'), order_by='j_date')
+    assert in_range['jal_date'].tolist() == ['1402/02/01', '1402/09/05', '1402/10/01']
+
+    # The stored watermark is the largest zero-padded date
+    assert fetch_table('symbol', 'production', order_by='j_date')['jal_date'].max() == '1403/01/02'
+
+
+# A table with text ids (leading zeros), integers and text with NULLs, and empty strings
+def _typed_table():
+    return pd.DataFrame({'id': ['00123', '00456', None, '07'], 'j_date': ['1402/9/5', '1402/10/01', '1402/10/2', '1403/1/1'],
+                         'volume': pd.array([10, None, 30, 40], dtype='Int64'), 'close_price': [1.5, 2.0, None, 4.25],
+                         'meta': ['a', '', None, 'd']})
+
+
+# The rows in the CSV format of PostgreSQL's COPY: NULL as an unquoted empty field, strings quoted when needed
+def _copy_csv(df: pd.DataFrame):
+    def field(value):
+        if pd.isna(value):
+            return ''
+        if isinstance(value, str):
+            return f'"{value}"' if value == '' or ',' in value else value
+        return str(value)
+    lines = [','.join(df.columns)] + [','.join(field(v) for v in row) for row in df.astype(object).itertuples(index=False)]
+    return io.BytesIO(('\n'.join(lines) + '\n').encode())
+
+
+_TYPED_DTYPES = {'id': 'character varying', 'j_date': 'character varying', 'volume': 'bigint',
+                 'close_price': 'double precision', 'meta': 'text'}
+
+
+def test_copy_csv_reads_like_the_sql_path(stand_in):
+    from src.utils import add_date_columns, fetch_table, read_copy_csv
+    df = _typed_table()
+    with stand_in.begin() as conn:
+        df.to_sql('typed', con=conn, schema='production', index=False, dtype={'volume': sqlalchemy.types.BigInteger})
+
+    expected = fetch_table('typed', 'production', method='sql')
+    copied = add_date_columns(read_copy_csv(_copy_csv(df), _TYPED_DTYPES), 'typed')
+    pd.testing.assert_frame_equal(copied, expected)
+    assert copied['id'].tolist()[:2] == ['00123', '00456']
+    assert copied['meta'].iloc[1] == '' and pd.isna(copied['meta'].iloc[2])
+
+
+@pytest.mark.skipif(not os.getenv('BENCH_DATABASE_URL'), reason="No PostgreSQL database (BENCH_DATABASE_URL)")
+def test_copy_matches_the_sql_path_on_postgresql(monkeypatch):
+    from sqlalchemy import create_engine
+    from src import utils
+    engine = create_engine(os.environ['BENCH_DATABASE_URL'])
+    monkeypatch.setattr(utils, '_ENGINE', engine)
+    schema = 'copy_parity_test'
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+        conn.exec_driver_sql(f'CREATE SCHEMA "{schema}"')
+        _typed_table().to_sql('typed', con=conn, schema=schema, index=False,
+                              dtype={'volume': sqlalchemy.types.BigInteger})
+    try:
+        for kwargs in [{}, dict(since='1402/9/5'), dict(columns=['id', 'meta'])]:
+            pd.testing.assert_frame_equal(utils.fetch_table('typed', schema, method='copy', order_by='j_date', **kwargs),
+                                          utils.fetch_table('typed', schema, method='sql', order_by='j_date', **kwargs))
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'DROP SCHEMA "{schema}" CASCADE')
+
+
+@pytest.mark.parametrize('n, test_size, n_test', [(10, 0.2, 2), (11, 0.2, 3), (1, 0.2, 1), (0, 0.2, 0),
+                                                  (10, 0.0, 0), (10, 1.0, 10)])
+def test_chronological_split_boundaries(n, test_size, n_test):
+    from src.utils import chronological_split
+    rng = np.random.default_rng(n)
+    # Unsorted rows, with repeated dates
+    df = pd.DataFrame({'greg_date': pd.to_datetime('2020-01-01') + pd.to_timedelta(rng.integers(0, 5, n), unit='D'),
+                       'row': np.arange(n)})
+    train, test = chronological_split(df, test_size)
+
+    assert (len(train), len(test)) == (n - n_test, n_test)
+    assert train['greg_date'].is_monotonic_increasing and test['greg_date'].is_monotonic_increasing
+    if len(train) and len(test):
+        assert train['greg_date'].max() <= test['greg_date'].min()
+    # Rows of the same date keep their order
+    expected = df.sort_values('greg_date', kind='stable')['row'].tolist()
+    assert train['row'].tolist() + test['row'].tolist() == expected
+
+
+def test_chunks_ordered_by_j_date_are_in_date_order(stand_in):
+    from src.utils import iter_table_chunks, jalali_key
+    # Unpadded dates, stored out of order: as strings, '1402/9/5' > '1402/10/1' and '1402/12/1' < '1402/2/1'
+    j_dates = ['1402/10/1', '1402/9/5', '1403/1/2', '1402/2/1', '1402/12/1', '1402/9/15', '1401/12/29', '1402/1/10']
+    df = pd.DataFrame({'id': range(len(j_dates)), 'j_date': j_dates})
+    with stand_in.begin() as conn:
+        df.to_sql('symbol', con=conn, schema='production', index=False)
+
+    chunks = list(iter_table_chunks('symbol', 'production', chunksize=3, order_by='j_date'))
+    assert len(chunks) == 3
+    dates = pd.concat(chunks)['j_date'].tolist()
+    assert dates == sorted(j_dates, key=jalali_key)